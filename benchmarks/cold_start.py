@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import time
+
+# a child process measures from its very first line
+START = time.perf_counter()
+
+from os.path import join, dirname, abspath
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS = dirname(abspath(__file__))
+PACKAGE = join(dirname(BENCHMARKS), "ecs_chargeback")
+ENV = dict(
+    os.environ,
+    AWS_DEFAULT_REGION="us-east-1",
+    AWS_ACCESS_KEY_ID="benchmark",
+    AWS_SECRET_ACCESS_KEY="benchmark",
+    DATADOG_API_KEY="benchmark",
+    DATADOG_METRIC_PREFIX="benchmark",
+    CACHE_BUCKET="benchmark",
+)
+
+
+def import_times(runs: int):
+    # -X importtime of the handler module in fresh interpreters; returns the
+    # median milliseconds, and the modules and their own milliseconds of the
+    # median run
+    samples = []
+    for _ in range(runs):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "__import__('lambda')"],
+            cwd=PACKAGE,
+            env=ENV,
+            stderr=subprocess.PIPE,
+            check=True,
+        ).stderr.decode()
+        lines = []
+        for line in stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            if self_us.strip().isdigit():
+                lines.append((int(self_us), int(cumulative_us), name))
+        # the handler module's own imports are the nested lines right above
+        # it; those before come from interpreter startup
+        end = next(i for i, line in enumerate(lines) if line[2].strip() == "lambda")
+        start = end
+        while start > 0 and lines[start - 1][2].startswith(" "):
+            start -= 1
+        modules = {name.strip(): us / 1000 for us, _, name in lines[start : end + 1]}
+        total = lines[end][1] / 1000
+        samples.append((total, modules))
+    samples.sort(key=lambda sample: sample[0])
+    return samples[len(samples) // 2]
+
+
+def child(services: int):
+    sys.path.insert(0, PACKAGE)
+    sys.path.insert(0, BENCHMARKS)
+    os.environ.update(ENV)
+    # everything below is a cold container: boto3, the handler module and
+    # its first invocation, which creates the clients
+    import boto3
+    import importlib
+    from lib import clients
+    from replay import Replayer, ReplayHTTP
+    from fleet import SyntheticFleet
+
+    fleet = SyntheticFleet(
+        clusters=max(1, services // 100),
+        services=services,
+        task_definitions=max(1, services // 4),
+    )
+    session = boto3.session.Session()
+    Replayer(session, fleet)
+    clients.configure(session)
+    lambda_module = importlib.import_module("lambda")
+    lambda_module.dd.submitter._http = ReplayHTTP()
+    sys.stdout = open(os.devnull, "w")
+    lambda_module.handler({}, None)
+    cold = time.perf_counter() - START
+    start = time.perf_counter()
+    lambda_module.handler({}, None)
+    warm = time.perf_counter() - start
+    sys.stdout = sys.__stdout__
+    print(json.dumps({"cold": cold, "warm": warm}))
+
+
+def handler_times(services: int, runs: int) -> dict:
+    samples = [
+        json.loads(
+            subprocess.run(
+                [
+                    sys.executable,
+                    abspath(__file__),
+                    "--child",
+                    "--services",
+                    str(services),
+                ],
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+        )
+        for _ in range(runs)
+    ]
+    return {
+        key: statistics.median(sample[key] for sample in samples)
+        for key in ("cold", "warm")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of the lambda handler module and "
+        "its first invocations, and check the import against a budget."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--services", type=int, default=100)
+    parser.add_argument(
+        "--budget",
+        default=join(BENCHMARKS, "cold_start_budget.json"),
+        help="JSON with import_ms, the most the handler module may take to "
+        "import, and modules it must not import",
+    )
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.services)
+        return
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+    total, modules = import_times(args.runs)
+    handler = handler_times(args.services, args.runs)
+
+    print(f"import lambda: {total:.1f}ms (budget {budget['import_ms']}ms)")
+    for name, ms in sorted(modules.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"  {ms:7.1f}ms  {name}")
+    print(
+        f"first invocation, from a cold process: {1000 * handler['cold']:.0f}ms, "
+        f"second: {1000 * handler['warm']:.0f}ms ({args.services} services)"
+    )
+
+    failures = []
+    if total > budget["import_ms"]:
+        failures.append(f"import takes {total:.1f}ms")
+    for name in budget["forbidden_modules"]:
+        if name in modules:
+            failures.append(f"{name} is imported")
+    for failure in failures:
+        print(f"over budget: {failure}")
+    sys.exit(1 if len(failures) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+from os.path import join, dirname, abspath
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+
+import numpy as np
+from tabulate import tabulate
+from lib.cost_calculator import ClusterCostCalculator
+from lib.cost_loader import ClusterInstanceType
+from lib.service import Service, ServiceTable
+
+
+class StaticCostLoader:
+    def instance_types(self, cluster_name: str):
+        return [
+            ClusterInstanceType(
+                "m5.large", cost=120.0, usage=720, vcpus=2, memory=8192
+            ),
+            ClusterInstanceType(
+                "c5.xlarge", cost=150.0, usage=360, vcpus=4, memory=8192
+            ),
+            ClusterInstanceType(
+                "r5.2xlarge", cost=360.0, usage=480, vcpus=8, memory=65536
+            ),
+        ]
+
+
+def synthetic_services(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [
+        Service(
+            name=f"service-{i}",
+            task_count=rng.randint(0, 20),
+            task_cpu_reservation=rng.choice([0, 256, 512, 1024, 2048, 4096]),
+            task_memory_reservation=rng.choice([512, 1024, 2048, 4096, 16384]),
+            cpu_utilization=rng.uniform(0, 100),
+            memory_utilization=rng.uniform(0, 100),
+            fargate=rng.random() < 0.1,
+        )
+        for i in range(count)
+    ]
+
+
+def per_service(calculator: ClusterCostCalculator, services: list):
+    costs, wastes = [], []
+    for service in services:
+        cost = calculator.hourly_service_reservation_cost(service)
+        costs.append(cost)
+        wastes.append(cost - calculator.hourly_service_utilization_cost(service))
+    return costs, wastes
+
+
+def vectorized(calculator: ClusterCostCalculator, services: ServiceTable):
+    costs, wastes = calculator.hourly_service_costs(services)
+    return costs.tolist(), wastes.tolist()
+
+
+def best_of(repeat: int, fn, *args):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the per-service and the vectorized cost computation "
+        "of ClusterCostCalculator over synthetic services."
+    )
+    parser.add_argument(
+        "--services", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.services:
+        services = synthetic_services(count, args.seed)
+        calculator = ClusterCostCalculator("benchmark", cost_loader=StaticCostLoader())
+        loop_seconds, expected = best_of(args.repeat, per_service, calculator, services)
+        vector_seconds, actual = best_of(
+            args.repeat, vectorized, calculator, ServiceTable(services)
+        )
+        if not all(np.allclose(e, a) for e, a in zip(expected, actual)):
+            raise AssertionError(f"results differ for {count} services")
+        rows.append(
+            [
+                count,
+                f"{loop_seconds * 1000:.1f}",
+                f"{vector_seconds * 1000:.1f}",
+                f"{loop_seconds / vector_seconds:.1f}x",
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=["Services", "Per-service (ms)", "Vectorized (ms)", "Speedup"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+from datetime import timedelta
+from os.path import join, dirname, abspath
+import argparse
+import contextlib
+import http.client
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.cluster import Cluster
+from lib.cost_cache import DailyCostCache
+from lib.cost_loader import FleetCostLoader
+from lib.daemon import Daemon
+from lib.instance_specs import InstanceSpecCatalog
+from replay import Replayer
+from lib.service import TagPool
+from fleet import SyntheticFleet
+
+
+def latencies(port: int, path: str, requests: int) -> list:
+    # milliseconds per request over one keep-alive connection
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    samples = []
+    size = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        size = len(response.read())
+        samples.append(1000 * (time.perf_counter() - start))
+    connection.close()
+    samples.sort()
+    return [
+        path,
+        f"{size / 1024:.1f}",
+        f"{statistics.median(samples):.3f}",
+        f"{samples[int(0.99 * len(samples))]:.3f}",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Start the daemon against a synthetic fleet and measure "
+        "its refreshes and the latency of its HTTP endpoint"
+    )
+    parser.add_argument("--services", type=int, default=1_000)
+    parser.add_argument("--services-per-cluster", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds added to every call"
+    )
+    parser.add_argument("--requests", type=int, default=2_000)
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(
+        clusters=max(1, args.services // args.services_per_cluster),
+        services=args.services,
+        task_definitions=max(1, args.services // 4),
+    )
+    session = boto3.session.Session()
+    Replayer(session, fleet, latency=args.latency)
+    clients.configure(session)
+
+    tag_pool = TagPool()
+    cost_cache = DailyCostCache(ttl=timedelta(hours=1))
+    spec_catalog = InstanceSpecCatalog()
+    daemon = Daemon(
+        lambda name: Cluster(name=name, tag_pool=tag_pool, task_definitions={}),
+        lambda: FleetCostLoader(cost_cache=cost_cache, spec_catalog=spec_catalog),
+        # refreshes only run when asked to below
+        services_interval=3600,
+        utilization_interval=3600,
+        costs_interval=3600,
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        daemon.start()
+        started = time.perf_counter() - start
+        refreshes = []
+        for schedule in daemon.schedules:
+            schedule.run()
+            refreshes.append([schedule.name, f"{schedule.seconds:.2f}"])
+
+    server = daemon.server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    cluster_name = fleet.cluster_names[0]
+    rows = [
+        latencies(port, "/services", args.requests),
+        latencies(port, f"/clusters/{cluster_name}", args.requests),
+        latencies(port, "/status", args.requests),
+    ]
+
+    # the same, while every refresh runs at once
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [
+            threading.Thread(target=schedule.run) for schedule in daemon.schedules
+        ]
+        for thread in threads:
+            thread.start()
+        busy = latencies(port, f"/clusters/{cluster_name}", args.requests)
+        for thread in threads:
+            thread.join()
+    busy[0] += " (refreshing)"
+    rows.append(busy)
+    server.shutdown()
+    daemon.stop()
+
+    print(
+        f"{args.services} services in {len(fleet.cluster_names)} clusters, "
+        f"first refresh of everything: {started:.2f}s"
+    )
+    print(tabulate(refreshes, headers=["Warm refresh", "Seconds"]))
+    print()
+    print(tabulate(rows, headers=["Path", "KiB", "p50 (ms)", "p99 (ms)"]))
+
+
+if __name__ == "__main__":
+    main()
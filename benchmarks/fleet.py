@@ -0,0 +1,387 @@
+from datetime import date, datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+import io
+import json
+import random
+import threading
+from botocore.response import StreamingBody
+
+INSTANCE_TYPES = {
+    "m5.large": (2, 8192),
+    "m5.xlarge": (4, 16384),
+    "c5.2xlarge": (8, 16384),
+    "r5.xlarge": (4, 32768),
+}
+
+
+class SyntheticFleet:
+    # answers the AWS calls the collector makes for a fleet of
+    # clusters x services, where services share task_definitions revisions
+    def __init__(
+        self,
+        clusters: int,
+        services: int,
+        task_definitions: int,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+        self.cluster_names = [f"cluster-{c}" for c in range(clusters)]
+        self.services = {
+            name: [
+                {
+                    "serviceName": f"{name}-svc-{s}",
+                    "serviceArn": f"arn:aws:ecs:us-east-1:1:service/{name}/{name}-svc-{s}",
+                    "runningCount": rng.randint(1, 10),
+                    "taskDefinition": f"arn:aws:ecs:us-east-1:1:task-definition/td-{rng.randrange(task_definitions)}:1",
+                    # one service in five runs on Fargate
+                    **({"launchType": "FARGATE"} if s % 5 == 0 else {}),
+                    "tags": [
+                        {"key": "team", "value": f"team-{rng.randrange(20)}"},
+                        {"key": "env", "value": rng.choice(["prod", "staging"])},
+                    ],
+                }
+                for s in range(services // clusters)
+            ]
+            for name in self.cluster_names
+        }
+        self.services_by_arn = {
+            service["serviceArn"]: service
+            for services in self.services.values()
+            for service in services
+        }
+        self.services_by_name = {
+            (name, service["serviceName"]): service
+            for name, services in self.services.items()
+            for service in services
+        }
+        # ECS events EventBridge would forward to the inventory queue
+        self.events = []
+        self.instance_types = {
+            name: rng.sample(sorted(INSTANCE_TYPES), 2) for name in self.cluster_names
+        }
+        self.objects = {}
+        self._task_arns = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, service: str, operation: str, params: dict) -> dict:
+        return getattr(self, f"_{service}_{operation}".replace("-", "_"))(params)
+
+    def _ecs_ListClusters(self, params):
+        return self._page(
+            [f"arn:aws:ecs:us-east-1:1:cluster/{n}" for n in self.cluster_names],
+            params,
+            "clusterArns",
+            "nextToken",
+            "maxResults",
+            100,
+        )
+
+    def _ecs_ListServices(self, params):
+        return self._page(
+            [s["serviceArn"] for s in self.services[params["cluster"]]],
+            params,
+            "serviceArns",
+            "nextToken",
+            "maxResults",
+            10,
+        )
+
+    def _ecs_DescribeServices(self, params):
+        services, failures = [], []
+        for s in params["services"]:
+            service = self.services_by_arn.get(s) or self.services_by_name.get(
+                (params["cluster"], s)
+            )
+            if service is None:
+                failures.append({"arn": s, "reason": "MISSING"})
+            else:
+                services.append(service)
+        return {"services": services, "failures": failures}
+
+    def _ecs_ListTasks(self, params):
+        # a task arn ends in <service name>/<task number>
+        cluster = params["cluster"]
+        task_arns = self._task_arns.get(cluster)
+        if task_arns is None:
+            task_arns = self._task_arns[cluster] = [
+                f"arn:aws:ecs:us-east-1:1:task/{cluster}/{s['serviceName']}/{t}"
+                for s in self.services[cluster]
+                for t in range(s["runningCount"])
+            ]
+        if "serviceName" in params:
+            prefix = f"arn:aws:ecs:us-east-1:1:task/{cluster}/{params['serviceName']}/"
+            task_arns = [arn for arn in task_arns if arn.startswith(prefix)]
+        return self._page(
+            task_arns,
+            params,
+            "taskArns",
+            "nextToken",
+            "maxResults",
+            100,
+        )
+
+    def _ecs_DescribeTasks(self, params):
+        tasks = []
+        for arn in params["tasks"]:
+            _, service_name, t = arn.rsplit("/", 2)
+            service = self.services_by_name[(params["cluster"], service_name)]
+            task = {
+                "taskArn": arn,
+                "group": f"service:{service_name}",
+                "lastStatus": "RUNNING",
+                "taskDefinitionArn": service["taskDefinition"],
+            }
+            if service.get("launchType") == "FARGATE":
+                task.update(launchType="FARGATE", cpu="512", memory="1024")
+            else:
+                n = int(service["taskDefinition"].split("td-")[1].split(":")[0])
+                # every other service is halfway through deploying the next
+                # task definition
+                if int(service_name.rsplit("-", 1)[1]) % 2 == 1 and int(t) % 2 == 0:
+                    n += 1
+                task.update(
+                    launchType="EC2",
+                    containers=[
+                        {"cpu": str(cpu), "memory": str(memory)}
+                        for cpu, memory in self._containers(n)
+                    ],
+                )
+            tasks.append(task)
+        return {"tasks": tasks, "failures": []}
+
+    def _ecs_ListContainerInstances(self, params):
+        return self._page(
+            [arn for arn, _ in self._container_instances(params["cluster"])],
+            params,
+            "containerInstanceArns",
+            "nextToken",
+            "maxResults",
+            100,
+        )
+
+    def _ecs_DescribeContainerInstances(self, params):
+        instance_types = dict(self._container_instances(params["cluster"]))
+        return {
+            "containerInstances": [
+                {
+                    "containerInstanceArn": arn,
+                    "status": "ACTIVE",
+                    "attributes": [
+                        {"name": "ecs.os-type", "value": "linux"},
+                        {"name": "ecs.instance-type", "value": instance_types[arn]},
+                    ],
+                }
+                for arn in params["containerInstances"]
+            ],
+            "failures": [],
+        }
+
+    def _container_instances(self, cluster: str):
+        # an instance for every ten tasks not on Fargate, alternating between
+        # the cluster's two instance types
+        instances = self._instances.get(cluster)
+        if instances is None:
+            tasks = sum(
+                s["runningCount"]
+                for s in self.services[cluster]
+                if s.get("launchType") != "FARGATE"
+            )
+            instances = self._instances[cluster] = [
+                (
+                    f"arn:aws:ecs:us-east-1:1:container-instance/{cluster}/{i}",
+                    self.instance_types[cluster][i % 2],
+                )
+                for i in range(max(1, tasks // 10))
+            ]
+        return instances
+
+    def scale(self, cluster: str, service_name: str, running_count: int):
+        # changes a service and queues the task event ECS would emit
+        self.services_by_name[(cluster, service_name)]["runningCount"] = running_count
+        self.events.append(
+            {
+                "detail-type": "ECS Task State Change",
+                "source": "aws.ecs",
+                "detail": {
+                    "clusterArn": f"arn:aws:ecs:us-east-1:1:cluster/{cluster}",
+                    "group": f"service:{service_name}",
+                    "lastStatus": "RUNNING",
+                },
+            }
+        )
+
+    def _sqs_ReceiveMessage(self, params):
+        with self._lock:
+            events = self.events[: params.get("MaxNumberOfMessages", 1)]
+            del self.events[: len(events)]
+        return {
+            "Messages": [
+                {
+                    "MessageId": str(i),
+                    "ReceiptHandle": str(i),
+                    "Body": json.dumps(event),
+                }
+                for i, event in enumerate(events)
+            ]
+        }
+
+    def _sqs_DeleteMessageBatch(self, params):
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in params["Entries"]],
+            "Failed": [],
+        }
+
+    def _ecs_DescribeTaskDefinition(self, params):
+        n = int(params["taskDefinition"].split("td-")[1].split(":")[0])
+        return {
+            "taskDefinition": {
+                "taskDefinitionArn": params["taskDefinition"],
+                "containerDefinitions": [
+                    {"cpu": cpu, "memory": memory}
+                    for cpu, memory in self._containers(n)
+                ],
+            }
+        }
+
+    def _containers(self, n: int):
+        return [(256 * (1 + n % 4), 512 * (1 + n % 8)), (64, 128)]
+
+    def _cloudwatch_GetMetricData(self, params):
+        results = []
+        for query in params["MetricDataQueries"]:
+            if "Expression" in query:
+                cluster = query["Expression"].split('ClusterName="')[1].split('"')[0]
+                period = int(query["Expression"].rsplit(",", 1)[1].strip(" )"))
+                for service in self.services[cluster]:
+                    results.append(
+                        self._metric(
+                            query["Id"], service["serviceName"], period, params
+                        )
+                    )
+            else:
+                period = query["MetricStat"]["Period"]
+                results.append(self._metric(query["Id"], query["Id"], period, params))
+        return {"MetricDataResults": results}
+
+    def _metric(self, metric_id, label, period, params):
+        # one point per period, newest first
+        seconds = (params["EndTime"] - params["StartTime"]).total_seconds()
+        timestamps = [
+            params["StartTime"] + timedelta(seconds=period * n)
+            for n in range(int(seconds // period) - 1, -1, -1)
+        ]
+        base = hash(label + metric_id) % 1000
+        return {
+            "Id": metric_id,
+            "Label": label,
+            "StatusCode": "Complete",
+            "Timestamps": timestamps,
+            "Values": [(base + 37 * n) % 1000 / 10 for n in range(len(timestamps))],
+        }
+
+    def _ce_GetCostAndUsage(self, params):
+        start = date.fromisoformat(params["TimePeriod"]["Start"])
+        end = date.fromisoformat(params["TimePeriod"]["End"])
+        results = []
+        day = start
+        while day < end:
+            groups = []
+            for name in self.cluster_names:
+                for instance_type in self.instance_types[name]:
+                    vcpus, _ = INSTANCE_TYPES[instance_type]
+                    groups.append(
+                        {
+                            "Keys": [f"cluster${name}", f"BoxUsage:{instance_type}"],
+                            "Metrics": {
+                                "BlendedCost": {"Amount": str(0.05 * vcpus * 24 * 3)},
+                                "UsageQuantity": {"Amount": str(24 * 3)},
+                            },
+                        }
+                    )
+            results.append(
+                {
+                    "TimePeriod": {
+                        "Start": str(day),
+                        "End": str(day + timedelta(days=1)),
+                    },
+                    "Groups": groups,
+                }
+            )
+            day += timedelta(days=1)
+        return {"ResultsByTime": results}
+
+    def _ec2_DescribeInstanceTypes(self, params):
+        return {
+            "InstanceTypes": [
+                {
+                    "InstanceType": name,
+                    "VCpuInfo": {"DefaultVCpus": INSTANCE_TYPES[name][0]},
+                    "MemoryInfo": {"SizeInMiB": INSTANCE_TYPES[name][1]},
+                }
+                for name in params["InstanceTypes"]
+            ]
+        }
+
+    def _s3_GetObject(self, params):
+        with self._lock:
+            stored = self.objects.get(params["Key"])
+        if stored is None:
+            raise ClientError(
+                {
+                    "Error": {"Code": "NoSuchKey"},
+                    "ResponseMetadata": {"HTTPStatusCode": 404},
+                },
+                "GetObject",
+            )
+        body, etag, last_modified = stored
+        if params.get("IfNoneMatch") == etag:
+            raise ClientError(
+                {
+                    "Error": {"Code": "304"},
+                    "ResponseMetadata": {"HTTPStatusCode": 304},
+                },
+                "GetObject",
+            )
+        return {
+            "Body": StreamingBody(io.BytesIO(body), len(body)),
+            "ETag": etag,
+            "LastModified": last_modified,
+        }
+
+    def _s3_HeadObject(self, params):
+        with self._lock:
+            stored = self.objects.get(params["Key"])
+        if stored is None:
+            raise ClientError(
+                {"Error": {"Code": "404"}, "ResponseMetadata": {"HTTPStatusCode": 404}},
+                "HeadObject",
+            )
+        return {"ETag": stored[1], "LastModified": stored[2]}
+
+    def _s3_PutObject(self, params):
+        body = params["Body"]
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self._lock:
+            etag = f'"{len(self.objects)}-{len(body)}"'
+            self.objects[params["Key"]] = (body, etag, datetime.now(timezone.utc))
+        return {"ETag": etag}
+
+    def _sts_AssumeRole(self, params):
+        return {
+            "Credentials": {
+                "AccessKeyId": "benchmark",
+                "SecretAccessKey": "benchmark",
+                "SessionToken": params["RoleArn"],
+                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+            }
+        }
+
+    def _page(self, items, params, items_key, token_key, size_key, default_size):
+        start = int(params.get(token_key) or 0)
+        size = params.get(size_key, default_size)
+        response = {items_key: items[start : start + size]}
+        if start + size < len(items):
+            response[token_key] = str(start + size)
+        return response
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+from datetime import timedelta
+from os.path import join, dirname, abspath
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.cost_cache import DailyCostCache
+from lib.cost_calculator import ClusterCostCalculator
+from lib.cost_loader import FleetCostLoader
+from lib.instance_specs import InstanceSpecCatalog
+from lib.rate_index import LiveRateIndex
+from replay import Replayer
+from fleet import SyntheticFleet
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the calls and rates of cost explorer rates and "
+        "live rates from the container instances of a synthetic fleet"
+    )
+    parser.add_argument("--services", type=int, default=10_000)
+    parser.add_argument("--services-per-cluster", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds added to every call"
+    )
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(
+        clusters=max(1, args.services // args.services_per_cluster),
+        services=args.services,
+        task_definitions=max(1, args.services // 4),
+    )
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=args.latency)
+    clients.configure(session)
+    cost_cache = DailyCostCache(ttl=timedelta(hours=1))
+    spec_catalog = InstanceSpecCatalog(path=os.devnull)
+
+    def cost_loader():
+        return FleetCostLoader(cost_cache=cost_cache, spec_catalog=spec_catalog)
+
+    def run(name, new_loader):
+        # every cluster's rates, as a run of the collector would load them
+        replayer.calls.clear()
+        start = time.perf_counter()
+        loader = new_loader()
+        loader.load()
+        rates = {}
+        for cluster_name in fleet.cluster_names:
+            calculator = ClusterCostCalculator(name=cluster_name, cost_loader=loader)
+            rates[cluster_name] = calculator.hourly_vcpu_cost
+        seconds = time.perf_counter() - start
+        calls = ", ".join(
+            f"{operation} {count}"
+            for (_, operation), count in sorted(replayer.calls.items())
+        )
+        return rates, [name, calls, f"{seconds:.2f}"]
+
+    billed, cold = run("cost explorer, cold cache", cost_loader)
+    _, warm = run("cost explorer, cached days", cost_loader)
+    live, indexed = run(
+        "live instances", lambda: LiveRateIndex(cost_loader=cost_loader())
+    )
+    print(tabulate([cold, warm, indexed], headers=["Rates", "Calls", "Seconds"]))
+
+    worst = max(abs(live[name] / billed[name] - 1) for name in fleet.cluster_names)
+    print(
+        f"\n{len(fleet.cluster_names)} clusters, worst difference of live and "
+        f"cost explorer hourly vCPU rates: {100 * worst:.2f}%"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from collections import Counter
+from typing import Callable, List
+import base64
+import io
+import json
+import threading
+import time
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+# responders take (service, operation, params) and return the parsed
+# response, or raise a ClientError
+Responder = Callable[[str, str, dict], dict]
+
+
+class Recorder:
+    calls: List[dict]
+
+    def __init__(self, session):
+        self.calls = []
+        self._lock = threading.Lock()
+        session.events.register("before-parameter-build.*.*", _stash_params)
+        session.events.register("after-call.*.*", self._after_call)
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        if isinstance(parsed.get("Body"), StreamingBody):
+            body = parsed["Body"].read()
+            parsed["Body"] = StreamingBody(io.BytesIO(body), len(body))
+            parsed = dict(parsed, Body={"base64": base64.b64encode(body).decode()})
+        call = {
+            "service": model.service_model.service_name,
+            "operation": model.name,
+            "params": context.get("replay_params", {}),
+            "status": http_response.status_code,
+            "response": parsed,
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.calls, f, default=str, indent=1)
+
+
+class Replayer:
+    calls: Counter
+
+    def __init__(self, session, responder: Responder, latency: float = 0):
+        self.responder = responder
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        session.events.register("before-parameter-build.*.*", _stash_params)
+        session.events.register("before-call.*.*", self._before_call)
+
+    def _before_call(self, model, context, **kwargs):
+        service, operation = model.service_model.service_name, model.name
+        with self._lock:
+            self.calls[(service, operation)] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        try:
+            response = self.responder(service, operation, context["replay_params"])
+            status = 200
+        except ClientError as e:
+            response, status = e.response, int(
+                e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 400)
+            )
+        response.setdefault("ResponseMetadata", {})
+        return AWSResponse(f"replay://{service}", status, {}, None), response
+
+
+class RecordingResponder:
+    # replays a Recorder file; calls are matched on operation and params,
+    # falling back to the recorded calls of the operation in order
+    def __init__(self, path: str):
+        with open(path) as f:
+            calls = json.load(f)
+        self._by_params = {}
+        self._by_operation = {}
+        for call in calls:
+            key = (call["service"], call["operation"])
+            self._by_params[key + (_params_key(call["params"]),)] = call
+            self._by_operation.setdefault(key, []).append(call)
+        self._next = Counter()
+
+    def __call__(self, service: str, operation: str, params: dict) -> dict:
+        call = self._by_params.get((service, operation, _params_key(params)))
+        if call is None:
+            calls = self._by_operation.get((service, operation), [])
+            if len(calls) == 0:
+                raise ClientError(
+                    {"Error": {"Code": "NotRecorded", "Message": operation}},
+                    operation,
+                )
+            call = calls[self._next[(service, operation)] % len(calls)]
+            self._next[(service, operation)] += 1
+
+        response = json.loads(json.dumps(call["response"]))
+        if call["status"] >= 300:
+            raise ClientError(response, operation)
+        if isinstance(response.get("Body"), dict):
+            body = base64.b64decode(response["Body"]["base64"])
+            response["Body"] = StreamingBody(io.BytesIO(body), len(body))
+        return response
+
+
+class ReplayHTTP:
+    # stands in for the urllib3 pool of SeriesSubmitter
+    def __init__(self, latency: float = 0, status: int = 202):
+        self.latency = latency
+        self.status = status
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def request(self, method: str, url: str, body: bytes = b"", headers=None):
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(body)
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return _HTTPResponse(self.status)
+
+
+class _HTTPResponse:
+    def __init__(self, status: int):
+        self.status = status
+        self.data = b"{}"
+
+
+def _stash_params(params, context, **kwargs):
+    context["replay_params"] = dict(params)
+
+
+def _params_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True, default=str)
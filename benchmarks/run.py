@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+from os.path import join, dirname, abspath
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients, instance_specs, object_cache
+from lib.instrumentation import instrumentation
+from replay import RecordingResponder, Replayer, ReplayHTTP
+from fleet import SyntheticFleet
+
+
+def run_lambda(latency: float):
+    os.environ.update(
+        DATADOG_API_KEY="benchmark",
+        DATADOG_METRIC_PREFIX="benchmark",
+        CACHE_BUCKET="benchmark",
+    )
+    lambda_module = importlib.import_module("lambda")
+    http = ReplayHTTP(latency=latency)
+    lambda_module.dd.submitter._http = http
+    # AWS calls as counted by the lambda, which includes those made in its
+    # worker processes
+    calls = Counter()
+    handle_instrumentation = lambda_module.dd.handle_instrumentation
+
+    def count_calls(operations, clusters):
+        for (service, operation), stats in operations.items():
+            if service != "datadog":
+                calls[(service, operation)] += stats.calls
+        handle_instrumentation(operations, clusters)
+
+    lambda_module.dd.handle_instrumentation = count_calls
+    lambda_module.handler({}, None)
+    return http, calls
+
+
+def run_main(latency: float):
+    main_module = importlib.import_module("main")
+    sys.argv = ["main.py"]
+    main_module.main()
+    return None, None
+
+
+ENTRY_POINTS = {"lambda": run_lambda, "main": run_main}
+
+
+def benchmark(name: str, services: int, args) -> list:
+    entry_point = ENTRY_POINTS[name]
+    if args.replay is not None:
+        fleet = RecordingResponder(args.replay)
+    else:
+        fleet = SyntheticFleet(
+            clusters=max(1, services // args.services_per_cluster),
+            services=services,
+            task_definitions=max(1, services // args.services_per_task_definition),
+        )
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=args.latency)
+    clients.configure(session)
+    # drop state a previous benchmark left in the process
+    for module in ("lambda", "main"):
+        sys.modules.pop(module, None)
+    with tempfile.TemporaryDirectory() as workdir:
+        # keep local caches such as the instance type catalog out of the
+        # real temp dir so every benchmark starts cold
+        tempfile.tempdir = workdir
+        instance_specs.default_catalog = instance_specs.InstanceSpecCatalog()
+        object_cache.default_cache.clear()
+        object_cache.default_cache.stats = object_cache.CacheStats()
+        # the lambda counts calls through the process-wide instrumentation,
+        # which other entry points also add to
+        instrumentation.snapshot(reset=True)
+        if args.warm:
+            # a first untimed run fills the caches, like an earlier
+            # invocation of a warm lambda container
+            with contextlib.redirect_stdout(io.StringIO()):
+                entry_point(args.latency)
+            replayer.calls.clear()
+            instrumentation.snapshot(reset=True)
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            http, calls = entry_point(args.latency)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tempfile.tempdir = None
+
+    calls = calls if calls is not None else replayer.calls
+    partitions = max(1, args.accounts * args.regions) if name == "lambda" else 1
+    return [
+        name,
+        services * partitions if args.replay is None else "-",
+        len(fleet.cluster_names) * partitions if args.replay is None else "-",
+        f"{seconds:.2f}",
+        sum(calls.values()),
+        http.requests if http is not None else "-",
+        f"{peak / 2**20:.1f}",
+        ", ".join(
+            f"{operation}={count}" for (_, operation), count in sorted(calls.items())
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the lambda handler and the CLI against a synthetic "
+        "or recorded fleet, answering AWS and Datadog calls in-process with "
+        "simulated latency."
+    )
+    parser.add_argument(
+        "--services", type=int, nargs="+", default=[10, 100, 1_000, 10_000]
+    )
+    parser.add_argument("--services-per-cluster", type=int, default=100)
+    parser.add_argument("--services-per-task-definition", type=int, default=4)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds added to every call"
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="replay calls recorded with main.py --record instead of a synthetic fleet",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="measure a second run in the same process",
+    )
+    parser.add_argument(
+        "--inventory",
+        action="store_true",
+        help="let the lambda keep a service inventory fed by ECS events",
+    )
+    parser.add_argument(
+        "--entry-points",
+        nargs="+",
+        default=["lambda", "main"],
+        choices=["lambda", "main"],
+    )
+    parser.add_argument(
+        "--accounts",
+        type=int,
+        default=0,
+        help="let the lambda collect from this many accounts, each a copy of the fleet",
+    )
+    parser.add_argument("--regions", type=int, default=1, help="regions per account")
+    parser.add_argument(
+        "--processes", type=int, default=1, help="processes collecting accounts"
+    )
+    args = parser.parse_args()
+    if args.inventory:
+        os.environ["INVENTORY_QUEUE_URL"] = "benchmark"
+    if args.accounts > 0:
+        os.environ.update(
+            COLLECTION_ACCOUNTS=",".join(
+                f"{100000000000 + a}" for a in range(args.accounts)
+            ),
+            COLLECTION_REGIONS=",".join(f"region-{r}" for r in range(args.regions)),
+            COLLECTOR_PROCESSES=str(args.processes),
+        )
+
+    rows = [
+        benchmark(name, services, args)
+        for services in (args.services if args.replay is None else [None])
+        for name in args.entry_points
+    ]
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Entry point",
+                "Services",
+                "Clusters",
+                "Wall (s)",
+                "AWS calls",
+                "Datadog requests",
+                "Peak MiB",
+                "Calls by operation",
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+from datetime import timedelta
+from os.path import join, dirname, abspath
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.datadog_handler import DataDogHandler
+from replay import Replayer, ReplayHTTP
+from lib.series_filter import SeriesFilter
+from fleet import SyntheticFleet
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send the series of a synthetic fleet's services for a few "
+        "runs with and without suppressing unchanged series"
+    )
+    parser.add_argument("--services", type=int, default=10_000)
+    parser.add_argument("--services-per-cluster", type=int, default=100)
+    parser.add_argument(
+        "--changed",
+        type=float,
+        default=0.05,
+        help="share of services whose cost changes between runs",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--rollup-tags", nargs="*", default=["team"])
+    args = parser.parse_args()
+
+    fleet = SyntheticFleet(
+        clusters=max(1, args.services // args.services_per_cluster),
+        services=args.services,
+        task_definitions=max(1, args.services // 4),
+    )
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=0)
+    clients.configure(session)
+
+    def run(name: str, dd: DataDogHandler, costs: dict) -> list:
+        http = dd.submitter._http = ReplayHTTP()
+        replayer.calls.clear()
+        start = time.perf_counter()
+        for cluster, services in fleet.services.items():
+            for service in services:
+                dd.handle_service(
+                    cluster=cluster,
+                    service=service["serviceName"],
+                    tags=service["tags"],
+                    cpu_reservation=256 * service["runningCount"],
+                    memory_reservation=512 * service["runningCount"],
+                    hourly_cost=costs[service["serviceArn"]],
+                    hourly_waste=costs[service["serviceArn"]] / 2,
+                )
+            dd.flush()
+        seconds = time.perf_counter() - start
+        series_filter = dd.series_filter
+        return [
+            name,
+            (
+                f"{series_filter.emitted} / {series_filter.suppressed}"
+                if series_filter is not None
+                else "-"
+            ),
+            http.requests,
+            f"{http.bytes / 1024:.0f}",
+            replayer.calls[("s3", "PutObject")],
+            f"{seconds:.2f}",
+        ]
+
+    rng = random.Random(0)
+    costs = {arn: rng.uniform(0.01, 2) for arn in fleet.services_by_arn}
+    handlers = {
+        "every series": DataDogHandler(api_key="benchmark", metric_prefix="bm"),
+        "unchanged suppressed": DataDogHandler(
+            api_key="benchmark",
+            metric_prefix="bm",
+            series_filter=SeriesFilter(heartbeat=timedelta(hours=1), bucket="bm"),
+        ),
+        "unchanged suppressed, rollups": DataDogHandler(
+            api_key="benchmark",
+            metric_prefix="bm",
+            series_filter=SeriesFilter(
+                heartbeat=timedelta(hours=1), bucket="bm", prefix="rollups"
+            ),
+            rollup_tags=args.rollup_tags,
+        ),
+    }
+    for handler in handlers.values():
+        # one submission per cluster, like the lambda
+        handler.buffered = True
+
+    rows = []
+    for n in range(args.runs):
+        if n > 0:
+            for arn in rng.sample(sorted(costs), int(args.changed * len(costs))):
+                costs[arn] *= rng.uniform(0.5, 1.5)
+        for name, handler in handlers.items():
+            rows.append(run(f"run {n + 1}, {name}", handler, costs))
+            if handler.series_filter is not None:
+                handler.series_filter.reset_counts()
+
+    state_bytes = sum(
+        len(body)
+        for key, (body, _, _) in fleet.objects.items()
+        if key.startswith("series/")
+    )
+    print(
+        f"{args.services} services in {len(fleet.cluster_names)} clusters, "
+        f"{100 * args.changed:.0f}% of services change cost every run"
+    )
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Run",
+                "Emitted / suppressed",
+                "Requests",
+                "KiB sent",
+                "State writes",
+                "Seconds",
+            ],
+        )
+    )
+    print(f"\nstored state, without rollups: {state_bytes / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
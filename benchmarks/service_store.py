@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass, field
+from os.path import join, dirname, abspath
+from typing import List, Mapping
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.cluster import Cluster
+from replay import Replayer
+from lib.service import TagPool
+from fleet import SyntheticFleet
+
+STORES = ("table", "dataclasses")
+
+
+@dataclass
+class ListedService:
+    # the Service record before the column table: a dataclass per service,
+    # kept in a list per cluster, with its own tag dicts as decoded from
+    # describe_services
+    name: str
+    task_count: int
+    task_cpu_reservation: int = 0
+    task_memory_reservation: int = 0
+    cpu_utilization: float = 0
+    memory_utilization: float = 0
+    tags: List[Mapping[str, str]] = field(default_factory=list)
+
+
+def listed_services(cluster: Cluster) -> List[ListedService]:
+    # strings are copied, as every service decoded its own
+    return [
+        ListedService(
+            name=_copy(service.name),
+            task_count=service.task_count,
+            task_cpu_reservation=int(service.task_cpu_reservation),
+            task_memory_reservation=int(service.task_memory_reservation),
+            cpu_utilization=service.cpu_utilization,
+            memory_utilization=service.memory_utilization,
+            tags=[
+                {"key": _copy(tag["key"]), "value": _copy(tag["value"])}
+                for tag in service.tags
+            ],
+        )
+        for service in cluster.services
+    ]
+
+
+def _copy(value: str) -> str:
+    return value.encode().decode()
+
+
+def current_rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def snapshot(
+    services: int, services_per_cluster: int, traced: bool, store: str
+) -> dict:
+    # loads every cluster of a synthetic fleet and keeps all of them, the
+    # way a fleet-wide snapshot would. The dataclass store converts each
+    # cluster's table as it is loaded, so one table at most is alive
+    fleet = SyntheticFleet(
+        clusters=max(1, services // services_per_cluster),
+        services=services,
+        task_definitions=max(1, services // 4),
+    )
+    session = boto3.session.Session()
+    Replayer(session, fleet, latency=0)
+    clients.configure(session)
+    clients.client("ecs")
+    clients.client("cloudwatch")
+
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    baseline = current_rss()
+    start = time.perf_counter()
+    task_definitions = {}
+    tag_pool = TagPool()
+    if store == "table":
+        clusters = [
+            Cluster(name=name, task_definitions=task_definitions, tag_pool=tag_pool)
+            for name in fleet.cluster_names
+        ]
+        loaded = sum(len(cluster.services) for cluster in clusters)
+    else:
+        clusters = [
+            listed_services(Cluster(name=name, task_definitions=task_definitions))
+            for name in fleet.cluster_names
+        ]
+        loaded = sum(len(services) for services in clusters)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    result = {
+        "services": loaded,
+        "clusters": len(clusters),
+        "seconds": seconds,
+        "retained": current_rss() - baseline,
+        "peak": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    if traced:
+        result["traced"] = tracemalloc.get_traced_memory()[0]
+    return result
+
+
+def run_child(
+    services: int, services_per_cluster: int, store: str, flags: list
+) -> dict:
+    output = subprocess.run(
+        [
+            sys.executable,
+            abspath(__file__),
+            "--child",
+            str(services),
+            "--services-per-cluster",
+            str(services_per_cluster),
+            "--store",
+            store,
+        ]
+        + flags,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the memory a fleet-wide snapshot of services takes. "
+        "Every size runs in its own process so peak RSS is not shared."
+    )
+    parser.add_argument(
+        "--services", type=int, nargs="+", default=[1_000, 10_000, 50_000]
+    )
+    parser.add_argument("--services-per-cluster", type=int, default=100)
+    parser.add_argument(
+        "--stores",
+        nargs="+",
+        choices=STORES,
+        default=list(STORES),
+        help="the column table, and the dataclass list it replaced",
+    )
+    parser.add_argument("--store", choices=STORES, help=argparse.SUPPRESS)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--traced", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(
+            json.dumps(
+                snapshot(args.child, args.services_per_cluster, args.traced, args.store)
+            )
+        )
+        return
+
+    rows = []
+    for services in args.services:
+        for store in args.stores:
+            # tracing slows the load and inflates RSS, so it gets its own run
+            result, traced = [
+                run_child(services, args.services_per_cluster, store, flags)
+                for flags in ([], ["--traced"])
+            ]
+            rows.append(
+                [
+                    result["services"],
+                    store,
+                    result["clusters"],
+                    f"{result['seconds']:.2f}",
+                    f"{traced['traced'] / 2**20:.1f}",
+                    f"{result['retained'] / 2**20:.1f}",
+                    f"{result['peak'] / 2**20:.1f}",
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Services",
+                "Store",
+                "Clusters",
+                "Load (s)",
+                "Retained traced MiB",
+                "Retained RSS MiB",
+                "Peak RSS MiB",
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+from os.path import join, dirname, abspath
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.cluster import RESERVATION_SOURCES, Cluster
+from replay import Replayer
+from fleet import SyntheticFleet
+
+
+def benchmark(services: int, source: str) -> list:
+    # loads the reservations of one cluster; the peak is what the load
+    # allocates on top of the finished service table
+    fleet = SyntheticFleet(
+        clusters=1, services=services, task_definitions=max(1, services // 4)
+    )
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=0)
+    clients.configure(session)
+    ecs = clients.client("ecs")
+    cluster = Cluster(name=fleet.cluster_names[0], reservation_source=source)
+    # the fleet's own list of task arns is not part of the load
+    fleet._ecs_ListTasks({"cluster": cluster.name})
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cluster._load_services()
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    table = cluster._services
+    return [
+        source,
+        len(table),
+        sum(s["runningCount"] for s in fleet.services[cluster.name]),
+        sum(table.task_count),
+        sum(replayer.calls.values()),
+        f"{seconds:.2f}",
+        f"{retained / 2**20:.1f}",
+        f"{peak / 2**20:.1f}",
+        f"{sum(s.cpu_reservation for s in table) / 1024:.0f}",
+        sum(table.fargate),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure loading a cluster's reservations from its running "
+        "tasks against multiplying running counts by task definitions"
+    )
+    parser.add_argument("--services", type=int, nargs="+", default=[200, 2_000, 20_000])
+    args = parser.parse_args()
+
+    rows = [
+        benchmark(services, source)
+        for services in args.services
+        for source in RESERVATION_SOURCES
+    ]
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Source",
+                "Services",
+                "Tasks",
+                "Counted tasks",
+                "API calls",
+                "Load (s)",
+                "Retained MiB",
+                "Peak MiB",
+                "vCPUs",
+                "Fargate services",
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
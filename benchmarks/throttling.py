@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, dirname, abspath
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+import botocore
+from botocore.awsrequest import AWSResponse
+from tabulate import tabulate
+from lib import clients
+from lib.rate_limiter import RateLimiter
+
+
+class ThrottlingEndpoint:
+    # answers DescribeTaskDefinition at the HTTP layer, below botocore's
+    # retries, and throttles requests beyond `rate` per second with bursts of
+    # `burst`, like the token buckets AWS APIs are fronted with
+    def __init__(self, rate: float, burst: int, latency: float):
+        self.rate = rate
+        self.burst = burst
+        self.latency = latency
+        self.requests = 0
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, request, **kwargs):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            self.requests += 1
+            allowed = self._tokens >= 1
+            if allowed:
+                self._tokens -= 1
+            else:
+                self.throttled += 1
+        time.sleep(self.latency)
+        if allowed:
+            status, body = 200, {"taskDefinition": {"cpu": "256", "memory": "512"}}
+        else:
+            status, body = 400, {
+                "__type": "ThrottlingException",
+                "message": "Rate exceeded",
+            }
+        return AWSResponse(
+            request.url,
+            status,
+            {"content-type": "application/x-amz-json-1.1"},
+            _Raw(json.dumps(body).encode("utf-8")),
+        )
+
+
+class _Raw:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    def stream(self, **kwargs):
+        yield self._body
+
+
+def benchmark(
+    name: str, retry_mode: str, max_attempts: int, limiter: RateLimiter, args
+) -> list:
+    endpoint = ThrottlingEndpoint(args.rate, args.burst, args.latency)
+    session = boto3.session.Session()
+    session.events.register("before-send.ecs.DescribeTaskDefinition", endpoint)
+    os.environ["AWS_RETRY_MODE"] = retry_mode
+    os.environ["AWS_MAX_ATTEMPTS"] = str(max_attempts)
+    clients.limiter = limiter
+    clients.configure(session)
+    ecs = clients.client("ecs")
+
+    def call(i: int) -> bool:
+        try:
+            ecs.describe_task_definition(taskDefinition=f"task-definition-{i}")
+            return True
+        except botocore.exceptions.ClientError:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        succeeded = sum(executor.map(call, range(args.calls)))
+    seconds = time.perf_counter() - start
+    return [
+        name,
+        f"{seconds:.2f}",
+        succeeded,
+        args.calls - succeeded,
+        endpoint.requests,
+        endpoint.throttled,
+        f"{succeeded / seconds:.1f}",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark retries and the adaptive rate limiter against an "
+        "endpoint that throttles"
+    )
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--rate", type=float, default=40, help="requests per second the endpoint allows"
+    )
+    parser.add_argument(
+        "--burst", type=int, default=40, help="requests the endpoint allows at once"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="seconds per request"
+    )
+    parser.add_argument(
+        "--limit",
+        type=float,
+        default=100,
+        help="requests per second the limiter starts from and never exceeds",
+    )
+    args = parser.parse_args()
+
+    rows = [
+        # botocore's defaults, which the clients used before
+        benchmark("legacy retries", "legacy", 5, RateLimiter(default_rate=0), args),
+        benchmark(
+            "standard retries", "standard", 10, RateLimiter(default_rate=0), args
+        ),
+        benchmark(
+            "standard retries + limiter",
+            "standard",
+            10,
+            RateLimiter(default_rate=args.limit),
+            args,
+        ),
+    ]
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "",
+                "Wall (s)",
+                "Succeeded",
+                "Failed",
+                "Requests",
+                "Throttled",
+                "Calls/s",
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
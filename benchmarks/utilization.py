@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta, timezone
+from os.path import join, dirname, abspath
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "ecs_chargeback"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+import boto3
+from tabulate import tabulate
+from lib import clients
+from lib.cluster import MAX_METRIC_DATA_QUERIES, Cluster
+from replay import Replayer
+from lib.sketch import QuantileSketch
+from lib.utilization import UtilizationStore
+from fleet import SyntheticFleet
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def accuracy(series: int, points: int) -> list:
+    # worst relative error of the sketch quantiles against exact ones, over
+    # series of spiky utilization
+    rng = random.Random(0)
+    errors = {q: 0.0 for q in QUANTILES}
+    for _ in range(series):
+        base = rng.uniform(1, 60)
+        values = [
+            min(400, base * rng.lognormvariate(0, 0.5)) + (rng.random() < 0.02) * 50
+            for _ in range(points)
+        ]
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        values.sort()
+        for q in QUANTILES:
+            exact = values[min(len(values) - 1, int(q * len(values)))]
+            errors[q] = max(errors[q], abs(sketch.quantile(q) - exact) / exact)
+    return [f"p{int(100 * q)}: {100 * errors[q]:.2f}%" for q in QUANTILES]
+
+
+def state_size(points: int, half_life: timedelta) -> int:
+    # JSON bytes of one service's two sketches after a minute per point
+    rng = random.Random(1)
+    store = UtilizationStore(half_life=half_life)
+    sketches = {}
+    for attribute in ("cpu_utilization", "memory_utilization"):
+        sketch = QuantileSketch()
+        base = rng.uniform(1, 60)
+        for n in range(points):
+            sketch.add(
+                base * rng.lognormvariate(0, 0.5),
+                store.weight(timedelta(minutes=points - n)),
+            )
+        sketches[attribute] = sketch.to_dict()
+    return len(json.dumps(sketches))
+
+
+def fetches(services: int, args) -> list:
+    # GetMetricData calls and datapoints of one cluster's runs: the peak of
+    # the lookback every run, and the sketches' first and later runs
+    fleet = SyntheticFleet(
+        clusters=1, services=services, task_definitions=max(1, services // 4)
+    )
+    datapoints = [0]
+    metric = fleet._metric
+
+    def counting_metric(*metric_args):
+        result = metric(*metric_args)
+        datapoints[0] += len(result["Values"])
+        return result
+
+    fleet._metric = counting_metric
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=0)
+    clients.configure(session)
+    store = UtilizationStore(
+        percentile=95, initial_lookback=timedelta(hours=args.initial_lookback_hours)
+    )
+
+    def run(name: str, utilization_store: UtilizationStore) -> list:
+        replayer.calls.clear()
+        datapoints[0] = 0
+        cluster = Cluster(
+            name=fleet.cluster_names[0], utilization_store=utilization_store
+        )
+        start = time.perf_counter()
+        cluster.services
+        seconds = time.perf_counter() - start
+        return [
+            services,
+            name,
+            sum(
+                count
+                for (_, operation), count in replayer.calls.items()
+                if operation == "GetMetricData"
+            ),
+            datapoints[0],
+            f"{seconds:.2f}",
+        ]
+
+    rows = [run("peak of 5 minutes", None), run("sketches, first run", store)]
+    # the next run, five minutes later
+    key = store.key(fleet.cluster_names[0])
+    snapshot = store.object_cache.get(None, key)
+    fetched_until = datetime.fromisoformat(snapshot["fetched_until"])
+    store.object_cache.put(
+        None,
+        key,
+        {
+            **snapshot,
+            "fetched_until": (fetched_until - timedelta(minutes=5)).isoformat(),
+        },
+    )
+    rows.append(run("sketches, next run", store))
+    return rows
+
+
+def metric_stat_baseline(cluster: Cluster) -> int:
+    # utilization as it was fetched before SEARCH expressions: one MetricStat
+    # query per service and metric, all in one request, and every result
+    # matched to its service by scanning the services
+    services = list(cluster.services)
+    queries, routes = [], {}
+    for service in services:
+        for metric in ["MemoryUtilization", "CPUUtilization"]:
+            query_id = service.name.lower().replace("-", "") + "_" + metric
+            routes[query_id] = (service.name, metric)
+            queries.append(
+                {
+                    "Id": query_id,
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": "AWS/ECS",
+                            "MetricName": metric,
+                            "Dimensions": [
+                                {"Name": "ClusterName", "Value": cluster.name},
+                                {"Name": "ServiceName", "Value": service.name},
+                            ],
+                        },
+                        "Period": cluster.utilization_period,
+                        "Stat": cluster.utilization_stat,
+                    },
+                    "ReturnData": True,
+                }
+            )
+
+    cw = clients.client("cloudwatch")
+    now = datetime.now(timezone.utc)
+    paginator = cw.get_paginator("get_metric_data")
+    for response in paginator.paginate(
+        MetricDataQueries=queries,
+        StartTime=now - cluster.utilization_lookback,
+        EndTime=now,
+        ScanBy="TimestampDescending",
+    ):
+        for result in response["MetricDataResults"]:
+            values = result["Values"]
+            if len(values) == 0:
+                continue
+            service_name, metric = routes[result["Id"]]
+            for service in services:
+                if service.name == service_name:
+                    if metric == "MemoryUtilization":
+                        service.memory_utilization = max(values)
+                    else:
+                        service.cpu_utilization = max(values)
+    return len(services)
+
+
+def query_paths(services: int) -> list:
+    # the GetMetricData requests of one cluster's peak utilization, before
+    # and after SEARCH expressions
+    fleet = SyntheticFleet(
+        clusters=1, services=services, task_definitions=max(1, services // 4)
+    )
+    largest = [0]
+    get_metric_data = fleet._cloudwatch_GetMetricData
+
+    def counting_get_metric_data(params):
+        largest[0] = max(largest[0], len(params["MetricDataQueries"]))
+        return get_metric_data(params)
+
+    fleet._cloudwatch_GetMetricData = counting_get_metric_data
+    session = boto3.session.Session()
+    replayer = Replayer(session, fleet, latency=0)
+    clients.configure(session)
+
+    def run(name: str, load) -> list:
+        cluster = Cluster(name=fleet.cluster_names[0], load_utilization=False)
+        cluster.services
+        replayer.calls.clear()
+        largest[0] = 0
+        start = time.perf_counter()
+        load(cluster)
+        seconds = time.perf_counter() - start
+        return [
+            services,
+            name,
+            replayer.calls[("cloudwatch", "GetMetricData")],
+            largest[0],
+            "yes" if largest[0] <= MAX_METRIC_DATA_QUERIES else "no",
+            f"{1000 * seconds:.1f}",
+        ]
+
+    return [
+        run("MetricStat per service, before", metric_stat_baseline),
+        run("current", lambda cluster: cluster.refresh_utilization()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the utilization queries before and after SEARCH "
+        "expressions, and measure the utilization sketches: quantile accuracy, "
+        "stored size and the datapoints each run fetches"
+    )
+    parser.add_argument("--services", type=int, nargs="+", default=[100, 1_000])
+    parser.add_argument("--initial-lookback-hours", type=float, default=3)
+    args = parser.parse_args()
+
+    print("worst relative error over 1,000 series of 1,440 points:")
+    print("  " + ", ".join(accuracy(1_000, 1_440)))
+    for hours in (1, 24, 24 * 7):
+        print(
+            f"stored sketches per service after {hours}h of 1 minute points "
+            f"(24h half life): {state_size(hours * 60, timedelta(hours=24))} bytes"
+        )
+    print()
+    rows = [row for services in args.services for row in query_paths(services)]
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Services",
+                "Queries",
+                "GetMetricData",
+                "Largest request",
+                "Within API limit",
+                "Load (ms)",
+            ],
+        )
+    )
+    print()
+    rows = [row for services in args.services for row in fetches(services, args)]
+    print(
+        tabulate(
+            rows,
+            headers=["Services", "Run", "GetMetricData", "Datapoints", "Load (s)"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,330 @@
-import boto3
+from collections import Counter
 from datetime import timedelta
+from lib import clients
 from lib.cluster import Cluster
+from lib.columnar_sink import ColumnarSink
+from lib.collector import collect, list_cluster_names
+from lib.cost_cache import DailyCostCache
 from lib.cost_calculator import ClusterCostCalculator
+from lib.cost_loader import FleetCostLoader
 from lib.datadog_handler import DataDogHandler
+from lib.fanout import InProcessInvoker, LambdaInvoker, fan_out
+from lib.instance_specs import InstanceSpecCatalog
+from lib.instrumentation import instrumentation
+from lib.inventory import ServiceInventory, drain_events
+from lib.object_cache import default_cache
+from lib.partitions import (
+    PartitionResult,
+    RoleCache,
+    account_partitions,
+    collect_partitions,
+)
+from lib.rate_index import LiveRateIndex
+from lib.rate_limiter import limiter
+from lib.scheduler import SchedulerState, lambda_time_remaining
+from lib.series_filter import SeriesFilter
+from lib.service import TagPool
+from lib.utilization import UtilizationStore
+from lib.sink import MultiSink
 import os
 
+MAX_CONTINUATIONS = 1
+
 dd = DataDogHandler(
     api_key=os.getenv("DATADOG_API_KEY"),
     metric_prefix=os.getenv("DATADOG_METRIC_PREFIX"),
+    buffered=True,
+    api_host=os.getenv("DATADOG_HOST", "https://api.datadoghq.com"),
+    # with DATADOG_HEARTBEAT_MINS set, a service's series are only sent when
+    # their value changed, or that long after they last were
+    series_filter=(
+        SeriesFilter(
+            heartbeat=timedelta(minutes=float(os.environ["DATADOG_HEARTBEAT_MINS"])),
+            bucket=os.getenv("CACHE_BUCKET", None),
+            prefix=os.getenv("CACHE_PREFIX", None),
+        )
+        if os.getenv("DATADOG_HEARTBEAT_MINS")
+        else None
+    ),
+    rollup_tags=[
+        key for key in os.getenv("DATADOG_ROLLUP_TAGS", "").split(",") if key != ""
+    ],
+)
+# raw per-service rows also go to files under EXPORT_LOCATION, a local
+# directory or s3://bucket/prefix, when it is set
+export = (
+    ColumnarSink(
+        location=os.environ["EXPORT_LOCATION"],
+        format=os.getenv("EXPORT_FORMAT", "csv.gz"),
+    )
+    if os.getenv("EXPORT_LOCATION")
+    else None
+)
+sinks = MultiSink([dd] + ([export] if export is not None else []))
+spec_catalog = InstanceSpecCatalog(
+    bucket=os.getenv("CACHE_BUCKET", None),
+    prefix=os.getenv("CACHE_PREFIX", None),
+)
+scheduler_state = SchedulerState(
+    bucket=os.getenv("CACHE_BUCKET", None),
+    prefix=os.getenv("CACHE_PREFIX", None),
 )
+# with ECS events forwarded to this queue, services are only described
+# again when an event touches them, plus a full listing per reconcile interval
+inventory_queue_url = os.getenv("INVENTORY_QUEUE_URL", None)
+inventory = (
+    ServiceInventory(
+        bucket=os.getenv("CACHE_BUCKET", None),
+        prefix=os.getenv("CACHE_PREFIX", None),
+        reconcile_interval=timedelta(
+            minutes=int(os.getenv("INVENTORY_RECONCILE_MINS", "60"))
+        ),
+    )
+    if inventory_queue_url is not None
+    else None
+)
+# with COLLECTION_ACCOUNTS set, clusters are collected from those accounts,
+# through the COLLECTION_ROLE_NAME role in each, and in every region of
+# COLLECTION_REGIONS, instead of the lambda's own account and region
+partitions = (
+    account_partitions(
+        accounts=os.environ["COLLECTION_ACCOUNTS"].split(","),
+        regions=os.getenv(
+            "COLLECTION_REGIONS", os.getenv("AWS_REGION", "us-east-1")
+        ).split(","),
+        role_name=os.getenv("COLLECTION_ROLE_NAME", "ecs-chargeback"),
+    )
+    if os.getenv("COLLECTION_ACCOUNTS")
+    else []
+)
+role_cache = RoleCache()
+# what the live rate indexes of this run priced, for report
+live_rates = Counter()
+
+
+def new_utilization_store(partition=None):
+    # with UTILIZATION_PERCENTILE set, waste is computed on that percentile
+    # of utilization, kept as sketches in the cache bucket, rather than on
+    # the peak of the last UTILIZATION_LOOKBACK_MINS
+    if not os.getenv("UTILIZATION_PERCENTILE"):
+        return None
+    prefix = os.getenv("CACHE_PREFIX", None)
+    if partition is not None:
+        # cluster names are only unique within an account and region
+        prefix = "/".join(
+            ([prefix] if prefix is not None else [])
+            + ["accounts", partition.account, partition.region]
+        )
+    return UtilizationStore(
+        bucket=os.getenv("CACHE_BUCKET", None),
+        prefix=prefix,
+        percentile=float(os.environ["UTILIZATION_PERCENTILE"]),
+        half_life=timedelta(
+            hours=float(os.getenv("UTILIZATION_HALF_LIFE_HOURS", "24"))
+        ),
+        initial_lookback=timedelta(
+            hours=float(os.getenv("UTILIZATION_INITIAL_LOOKBACK_HOURS", "3"))
+        ),
+    )
+
+
+utilization_store = new_utilization_store()
+# task definition revisions never change, so warm containers keep them
+task_definitions = {}
+invoker = None
 
 
 def handler(event, context):
-    ecs = boto3.client("ecs")
-    clusterArns = ecs.list_clusters()["clusterArns"]
-    for clusterArn in clusterArns:
-        cluster_name = clusterArn.split("/")[1]
-        cluster = Cluster(
+    if "clusters" in event:
+        # worker: collect the shard handed out by the coordinator, passing
+        # anything left over at the deadline on to one more worker
+        continuation = event.get("continuation", 0)
+        unfinished = collect_clusters(event["clusters"], context)
+        if len(unfinished) > 0 and continuation < MAX_CONTINUATIONS:
+            get_invoker(context)(
+                {"clusters": unfinished, "continuation": continuation + 1}
+            )
+        report()
+        return
+
+    if len(partitions) > 0:
+        # fan-out, the scheduler's ordering and the service inventory are
+        # for a single account and region, and not used here
+        collect_accounts(context)
+        report()
+        return
+
+    cluster_names = list_cluster_names()
+    if inventory is not None:
+        events = drain_events(
+            inventory_queue_url,
+            inventory,
+            max_seconds=float(os.getenv("INVENTORY_DRAIN_SECS", "10")),
+        )
+        print(f"read {events} ECS events into the service inventory")
+    shard_size = int(os.getenv("FANOUT_SHARD_SIZE", "0"))
+    if shard_size > 0:
+        # warm the shared cost cache once so workers don't all query cost
+        # explorer at the same time
+        new_cost_loader().load()
+        shards = fan_out(cluster_names, shard_size, get_invoker(context))
+        print(f"fanned out {len(cluster_names)} clusters to {shards} workers")
+        report()
+        return
+
+    scheduler_state.load()
+    unfinished = collect_clusters(scheduler_state.order(cluster_names), context)
+    scheduler_state.pending = unfinished
+    scheduler_state.save()
+    report()
+
+
+def get_invoker(context):
+    global invoker
+    if invoker is None:
+        invoker = LambdaInvoker(context.function_name)
+    return invoker
+
+
+def new_cost_loader(account=None, region=None):
+    prefix = os.getenv("CACHE_PREFIX", None)
+    # costs are queried and cached per region, as clusters of the same name
+    # in two regions are different clusters
+    region = region if region is not None else clients.client("ecs").meta.region_name
+    if account is not None:
+        # cost explorer only answers for the account it is called in
+        prefix = (
+            f"{prefix}/accounts/{account}"
+            if prefix is not None
+            else f"accounts/{account}"
+        )
+    cost_loader = FleetCostLoader(
+        cluster_tag=os.getenv("CLUSTER_TAG", "cluster"),
+        cost_lookback=timedelta(days=int(os.getenv("COST_LOOKBACK_DAYS", "3"))),
+        cost_cache=DailyCostCache(
+            bucket=os.getenv("CACHE_BUCKET", None),
+            prefix=prefix,
+            settle_days=int(os.getenv("COST_SETTLE_DAYS", "2")),
+            name=f"{region}/costs",
+        ),
+        spec_catalog=spec_catalog,
+        region=region,
+    )
+    if os.getenv("RATE_SOURCE", "cost-explorer") == "cost-explorer":
+        return cost_loader
+    # clusters are priced by the instances running now, with cost explorer
+    # only calibrating the catalog's prices
+    return LiveRateIndex(cost_loader=cost_loader, spec_catalog=spec_catalog)
+
+
+def collect_accounts(context):
+    # partitions are collected on a pool of processes and their results
+    # merged here, and left for report to flush in one batched submission
+    role_cache.refresh(partitions)
+    unfinished = 0
+    for result in collect_partitions(
+        partitions,
+        lambda partition: collect_partition(partition, context),
+        processes=collector_processes(),
+    ):
+        partition = result.partition
+        if result.error is not None:
+            print(f"{partition.account}/{partition.region} :: {result.error}")
+            continue
+        result.sink.replay(sinks, account=partition.account, region=partition.region)
+        if result.instrumentation is not None:
+            instrumentation.merge(*result.instrumentation)
+        live_rates.update(result.live_rates)
+        unfinished += len(result.unfinished)
+    if unfinished > 0:
+        print(f"out of time, skipped {unfinished} clusters")
+
+
+def collector_processes():
+    # lambda has a full vCPU per 1769 MB of memory, and below that worker
+    # processes only add their memory while sharing the one CPU
+    if os.getenv("COLLECTOR_PROCESSES"):
+        return int(os.environ["COLLECTOR_PROCESSES"])
+    memory = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "0"))
+    return max(1, min(os.cpu_count() or 1, memory // 1769))
+
+
+def collect_partition(partition, context):
+    clients.use_partition(role_cache.client_config(partition))
+    result = PartitionResult(partition)
+    result.unfinished = collect_clusters(
+        list_cluster_names(),
+        context,
+        sink=result.sink,
+        flushed_sink=result.sink,
+        cost_loader=new_cost_loader(account=partition.account, region=partition.region),
+        inventory=None,
+        utilization_store=new_utilization_store(partition),
+        live_rates=result.live_rates,
+    )
+    return result
+
+
+def collect_clusters(
+    cluster_names,
+    context,
+    sink=sinks,
+    flushed_sink=dd,
+    cost_loader=None,
+    inventory=inventory,
+    utilization_store=utilization_store,
+    live_rates=live_rates,
+):
+    unfinished, failed = [], []
+    tag_pool = TagPool()
+    cost_loader = cost_loader if cost_loader is not None else new_cost_loader()
+
+    def new_cluster(cluster_name):
+        return Cluster(
             name=cluster_name,
+            task_definitions=task_definitions,
+            tag_pool=tag_pool,
+            inventory=inventory,
             utilization_lookback=timedelta(
                 minutes=int(os.getenv("UTILIZATION_LOOKBACK_MINS", "5"))
             ),
+            reservation_source=os.getenv("RESERVATION_SOURCE", "tasks"),
+            utilization_store=utilization_store,
+            # CpuUtilized and MemoryUtilized of Container Insights instead of
+            # the AWS/ECS utilization percentages
+            container_insights=os.getenv("CONTAINER_INSIGHTS", "false") == "true",
         )
 
-        if len(cluster.services) == 0:
-            continue
-
-        cluster_calculator = ClusterCostCalculator(
+    def new_calculator(cluster_name):
+        return ClusterCostCalculator(
             name=cluster_name,
-            cluster_tag=os.getenv("CLUSTER_TAG", "cluster"),
-            cost_lookback=timedelta(days=int(os.getenv("COST_LOOKBACK_DAYS", "3"))),
-            cache_bucket=os.getenv("CACHE_BUCKET", None),
-            cache_prefix=os.getenv("CACHE_PREFIX", None),
+            cost_loader=cost_loader,
+        )
+
+    for collection in collect(
+        cluster_names,
+        new_cluster,
+        new_calculator,
+        time_remaining=lambda_time_remaining(
+            context,
+            safety_margin=float(os.getenv("DEADLINE_SAFETY_MARGIN_SECS", "10")),
+        ),
+        unfinished=unfinished,
+        failed=failed,
+    ):
+        sink.handle_cluster(
+            cluster=collection.cluster.name, collection_seconds=collection.seconds
         )
+        if collection.calculator is None:
+            continue
 
-        for service in cluster.services:
-            cost = cluster_calculator.hourly_service_reservation_cost(service)
-            waste = cost - cluster_calculator.hourly_service_utilization_cost(service)
-            dd.handle_service(
-                cluster=cluster_name,
+        cluster, cluster_calculator = collection.cluster, collection.calculator
+        costs, wastes = cluster_calculator.hourly_service_costs(cluster.services)
+        for service, cost, waste in zip(
+            cluster.services, costs.tolist(), wastes.tolist()
+        ):
+            sink.handle_service(
+                cluster=cluster.name,
                 service=service.name,
                 tags=service.tags,
                 cpu_reservation=service.cpu_reservation,
@@ -46,7 +332,87 @@ def handler(event, context):
                 hourly_cost=cost,
                 hourly_waste=waste,
             )
+        # datadog is sent per cluster; the export waits for report, so each
+        # of its partitions is one file per run
+        flush(flushed_sink)
+        scheduler_state.cluster_costs[cluster.name] = float(costs.sum())
+
+    flush(flushed_sink)
+    if isinstance(cost_loader, LiveRateIndex):
+        live_rates.update(
+            instances=cost_loader.instances,
+            unpriced=cost_loader.unpriced,
+            uncatalogued_clusters=cost_loader.uncatalogued_clusters,
+        )
+    if len(failed) > 0:
+        print(f"failed to collect {len(failed)} clusters")
+    if len(unfinished) > 0:
+        print(f"out of time, carrying over {len(unfinished)} clusters")
+    return unfinished
+
+
+def flush(sink):
+    # a failed submission or export loses its rows, but not the rest of the run
+    try:
+        sink.flush()
+    except Exception as e:
+        print(f"flush :: {e}")
+
+
+def report():
+    dd.handle_instrumentation(*instrumentation.snapshot(reset=True))
+    if export is not None:
+        flush(export)
+        dd.handle_export(rows=export.rows, files=export.files)
+    if dd.series_filter is not None:
+        dd.handle_series_filter()
+    rates = None
+    if len(live_rates) > 0:
+        rates = (
+            live_rates["instances"],
+            live_rates["unpriced"],
+            live_rates["uncatalogued_clusters"],
+        )
+        live_rates.clear()
+        dd.handle_rates(*rates)
+    flush(dd)
+
+    stats = dd.submitter.stats
+    print(
+        f"datadog: {stats.series} series, {stats.requests} requests, "
+        f"{stats.bytes} bytes, {stats.seconds:.3f}s, {stats.failed} failed"
+    )
+    dd.submitter.reset_counts()
+    if dd.series_filter is not None:
+        print(
+            f"datadog series: {dd.series_filter.emitted} emitted, "
+            f"{dd.series_filter.suppressed} unchanged and suppressed"
+        )
+        dd.series_filter.reset_counts()
+        print(f"sent series: {dd.series_filter.object_cache.stats.summary()}")
+    print(
+        f"instance type catalog: {spec_catalog.hits} hits, "
+        f"{spec_catalog.misses} misses"
+    )
+    print(f"object cache: {default_cache.stats.summary()}")
+    print(f"rate limiter: {limiter.summary()}")
+    if len(partitions) > 0:
+        print(f"assumed roles: {role_cache.assumed}")
+    if export is not None:
+        print(f"export: {export.rows} rows in {export.files} files")
+        export.reset_counts()
+    if inventory is not None:
+        print(f"service inventory: {inventory.object_cache.stats.summary()}")
+    if utilization_store is not None:
+        print(f"utilization sketches: {utilization_store.object_cache.stats.summary()}")
+    if rates is not None:
+        print(
+            f"live rates: {rates[0]} instances, {rates[1]} unpriced, "
+            f"{rates[2]} clusters in regions without catalog prices"
+        )
 
 
 if __name__ == "__main__":
+    invoker = InProcessInvoker(handler)
     handler({}, {})
+    invoker.wait()
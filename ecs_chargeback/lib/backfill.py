@@ -0,0 +1,239 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, TextIO
+import csv
+import json
+import os
+from .cluster import Cluster, UTILIZATION_METRICS
+from .cost_cache import DailyCostCache
+from .cost_calculator import ClusterCostCalculator
+from .cost_loader import FleetCostLoader
+from .instance_specs import InstanceSpecCatalog
+from .service import TagPool
+
+COLUMNS = [
+    "window_start",
+    "window_end",
+    "cluster",
+    "service",
+    "cpu_reservation",
+    "memory_reservation",
+    "cpu_utilization",
+    "memory_utilization",
+    "hourly_cost",
+    "hourly_waste",
+    "cost",
+    "waste",
+]
+
+
+class BackfillCheckpoint:
+    # the position of a backfill and the output size at that position, so a
+    # resumed run drops any rows written after it and carries on
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, params: dict) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint["params"] != params:
+            print(f"{self.path} :: checkpoint is for another backfill, starting over")
+            return None
+        return checkpoint["position"]
+
+    def save(self, params: dict, position: dict):
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump({"params": params, "position": position}, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class Backfill:
+    # walks [start, end) in windows and writes one row per window and
+    # service. Windows are processed a chunk at a time: every cluster's
+    # utilization for a chunk comes from one time-ranged GetMetricData pass
+    # with a period of one window, so memory is bounded by the chunk rather
+    # than the range. Reservations come from the services' current task
+    # definitions and running counts, since ECS keeps no history of either.
+    cluster_names: List[str]
+    start: datetime
+    end: datetime
+    window: timedelta
+    chunk_windows: int
+    rows: int = 0
+
+    def __init__(
+        self,
+        cluster_names: List[str],
+        start: datetime,
+        end: datetime,
+        window: timedelta = timedelta(days=1),
+        chunk_windows: int = 30,
+        cluster_tag: str = "cluster",
+        cost_lookback: timedelta = timedelta(days=3),
+        spec_catalog: InstanceSpecCatalog = None,
+        reservation_source: str = "tasks",
+    ):
+        self.cluster_names = cluster_names
+        self.start = start
+        self.end = end
+        self.window = window
+        self.chunk_windows = chunk_windows
+        self.cluster_tag = cluster_tag
+        self.cost_lookback = cost_lookback
+        self.spec_catalog = spec_catalog
+        self.reservation_source = reservation_source
+        # a cache of its own: backfill prunes days as it moves through time
+        self.cost_cache = DailyCostCache(name="backfill-costs")
+        self._clusters: Dict[str, Cluster] = {}
+        self._task_definitions = {}
+        self._tag_pool = TagPool()
+
+    def params(self) -> dict:
+        return {
+            "clusters": self.cluster_names,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "window_seconds": self.window.total_seconds(),
+        }
+
+    def run(self, output: TextIO, checkpoint: BackfillCheckpoint = None):
+        writer = csv.writer(output)
+        position = checkpoint.load(self.params()) if checkpoint is not None else None
+        if position is None:
+            position = {"chunk_start": self.start.isoformat(), "cluster": 0}
+            output.seek(0)
+            output.truncate()
+            writer.writerow(COLUMNS)
+        else:
+            output.seek(position["offset"])
+            output.truncate()
+            self.rows = position["rows"]
+
+        chunk_start = datetime.fromisoformat(position["chunk_start"])
+        first_cluster = position["cluster"]
+        while chunk_start < self.end:
+            chunk_end = min(chunk_start + self.window * self.chunk_windows, self.end)
+            cost_loaders = self._cost_loaders(chunk_start, chunk_end)
+            for i in range(first_cluster, len(self.cluster_names)):
+                self._backfill_cluster(
+                    writer, self.cluster_names[i], chunk_start, chunk_end, cost_loaders
+                )
+                output.flush()
+                if checkpoint is not None:
+                    done = i + 1 == len(self.cluster_names)
+                    checkpoint.save(
+                        self.params(),
+                        {
+                            "chunk_start": (
+                                chunk_end if done else chunk_start
+                            ).isoformat(),
+                            "cluster": 0 if done else i + 1,
+                            "offset": output.tell(),
+                            "rows": self.rows,
+                        },
+                    )
+            first_cluster = 0
+            chunk_start = chunk_end
+
+    def _windows(self, chunk_start: datetime, chunk_end: datetime) -> List[datetime]:
+        windows = []
+        window_start = chunk_start
+        while window_start < chunk_end:
+            windows.append(window_start)
+            window_start += self.window
+        return windows
+
+    def _cost_loaders(
+        self, chunk_start: datetime, chunk_end: datetime
+    ) -> Dict[date, FleetCostLoader]:
+        # one loader per day of the chunk, loaded in date order so the cost
+        # cache only ever fetches the day that enters the lookback
+        cost_loaders = {}
+        for window_start in self._windows(chunk_start, chunk_end):
+            day = window_start.date()
+            if day not in cost_loaders:
+                cost_loaders[day] = FleetCostLoader(
+                    cluster_tag=self.cluster_tag,
+                    cost_lookback=self.cost_lookback,
+                    cost_cache=self.cost_cache,
+                    spec_catalog=self.spec_catalog,
+                    as_of=day,
+                )
+                cost_loaders[day].load()
+        return cost_loaders
+
+    def _backfill_cluster(
+        self,
+        writer,
+        cluster_name: str,
+        chunk_start: datetime,
+        chunk_end: datetime,
+        cost_loaders: Dict[date, FleetCostLoader],
+    ):
+        import numpy as np
+
+        cluster = self._clusters.get(cluster_name)
+        if cluster is None:
+            cluster = self._clusters[cluster_name] = Cluster(
+                name=cluster_name,
+                task_definitions=self._task_definitions,
+                tag_pool=self._tag_pool,
+                utilization_period=int(self.window.total_seconds()),
+                reservation_source=self.reservation_source,
+                load_utilization=False,
+            )
+        services = cluster.services
+        if len(services) == 0:
+            return
+
+        windows = self._windows(chunk_start, chunk_end)
+        utilization = {
+            attribute: np.zeros((len(windows), len(services)))
+            for attribute in UTILIZATION_METRICS.values()
+        }
+        for attribute, row, timestamps, values in cluster.utilization_history(
+            chunk_start, chunk_end
+        ):
+            for timestamp, value in zip(timestamps, values):
+                w = int((timestamp - chunk_start) / self.window)
+                if 0 <= w < len(windows):
+                    utilization[attribute][w, row] = value
+
+        task_count = np.frombuffer(services.task_count, dtype=np.int64)
+        cpu_reservation = task_count * np.frombuffer(
+            services.task_cpu_reservation, dtype=np.float64
+        )
+        memory_reservation = task_count * np.frombuffer(
+            services.task_memory_reservation, dtype=np.float64
+        )
+        for w, window_start in enumerate(windows):
+            window_end = min(window_start + self.window, chunk_end)
+            hours = (window_end - window_start).total_seconds() / 3600
+            calculator = ClusterCostCalculator(
+                name=cluster_name, cost_loader=cost_loaders[window_start.date()]
+            )
+            costs, wastes = calculator.hourly_service_costs(
+                services,
+                cpu_utilization=utilization["cpu_utilization"][w],
+                memory_utilization=utilization["memory_utilization"][w],
+            )
+            window = [window_start.isoformat(), window_end.isoformat(), cluster_name]
+            writer.writerows(
+                window + list(columns)
+                for columns in zip(
+                    services.names,
+                    cpu_reservation.tolist(),
+                    memory_reservation.tolist(),
+                    utilization["cpu_utilization"][w].tolist(),
+                    utilization["memory_utilization"][w].tolist(),
+                    costs.tolist(),
+                    wastes.tolist(),
+                    (costs * hours).tolist(),
+                    (wastes * hours).tolist(),
+                )
+            )
+            self.rows += len(services)
@@ -0,0 +1,89 @@
+import os
+import threading
+from .instrumentation import instrumentation
+from .rate_limiter import limiter
+
+# services read from the account and region being collected while a
+# partition is in use; the rest (the caches in S3, the inventory queue,
+# invocations and the instance type catalog) stay with the home account
+PARTITION_SERVICES = ("ecs", "cloudwatch", "ce")
+
+_lock = threading.Lock()
+_session = None
+_partition = {}
+_clients = {}
+
+
+def max_pool_connections() -> int:
+    return int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+
+
+def retries() -> dict:
+    # standard mode retries throttled and transient errors with jittered
+    # exponential backoff; the attempts include the first one
+    return {
+        "mode": os.getenv("AWS_RETRY_MODE", "standard"),
+        "max_attempts": int(os.getenv("AWS_MAX_ATTEMPTS", "10")),
+    }
+
+
+def client(service_name: str):
+    # clients are thread-safe once created, but creating them from a shared
+    # session is not
+    c = _clients.get(service_name)
+    if c is None:
+        with _lock:
+            c = _clients.get(service_name)
+            if c is None:
+                # boto3 is most of the import time of the lambda, so it is
+                # only loaded once the first client is needed
+                import boto3
+                from botocore.config import Config
+
+                global _session
+                if _session is None:
+                    _session = boto3.session.Session()
+                    instrumentation.instrument(_session)
+                # partition clients come from the same session, so they
+                # share its loaded service models and event hooks
+                c = _session.client(
+                    service_name,
+                    config=Config(
+                        max_pool_connections=max_pool_connections(),
+                        retries=retries(),
+                    ),
+                    **(_partition if service_name in PARTITION_SERVICES else {}),
+                )
+                limiter.install(c)
+                _clients[service_name] = c
+    return c
+
+
+def configure(session):
+    # swap the session every client is created from, e.g. to replay
+    # recorded responses; clients created from the old session are dropped
+    global _session
+    with _lock:
+        _session = session
+        instrumentation.instrument(_session)
+        _clients.clear()
+
+
+def use_partition(config: dict = None):
+    # clients of PARTITION_SERVICES are created with these arguments, i.e. a
+    # region and assumed-role credentials, until reset with None
+    global _partition
+    with _lock:
+        config = config if config is not None else {}
+        if config == _partition:
+            return
+        _partition = config
+        for service_name in PARTITION_SERVICES:
+            _clients.pop(service_name, None)
+
+
+def reset():
+    # drops every client, e.g. in a forked process where the parent still
+    # owns their connections
+    with _lock:
+        _clients.clear()
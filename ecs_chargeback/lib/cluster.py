@@ -1,8 +1,38 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime, timezone, timedelta
-import boto3
-from .service import Service
+from . import clients
+from .inventory import ServiceInventory
+from .service import ServiceTable, TagPool
+from .utilization import UtilizationStore
+
+LIST_SERVICES_PAGE_SIZE = 100
+DESCRIBE_SERVICES_BATCH_SIZE = 10
+LIST_TASKS_PAGE_SIZE = 100
+DESCRIBE_TASKS_BATCH_SIZE = 100
+RESERVATION_SOURCES = ("tasks", "services")
+FARGATE_CAPACITY_PROVIDERS = ("FARGATE", "FARGATE_SPOT")
+MAX_METRIC_DATA_QUERIES = 500
+MAX_SEARCH_RESULTS = 500
+UTILIZATION_METRICS = {
+    "CPUUtilization": "cpu_utilization",
+    "MemoryUtilization": "memory_utilization",
+}
+# cpu units and MiB used, summed over each service's tasks; they are turned
+# into percentages of what the running tasks reserve
+CONTAINER_INSIGHTS_METRICS = {
+    "CpuUtilized": "cpu_utilization",
+    "MemoryUtilized": "memory_utilization",
+}
+
+
+@dataclass
+class ServiceReservation:
+    # running tasks of a service and what they reserve in total
+    task_count: int = 0
+    cpu: int = 0
+    memory: int = 0
+    fargate: bool = False
 
 
 @dataclass
@@ -11,76 +41,421 @@ class Cluster:
     utilization_lookback: timedelta = timedelta(minutes=5)
     utilization_period: int = 60
     utilization_stat: str = "Average"
-    _services: List[Service] = None
+    # "tasks" sums what the running tasks reserve, "services" multiplies the
+    # running count by the reservation of the service's task definition
+    reservation_source: str = "tasks"
+    # with a store, utilization is a percentile of everything seen so far,
+    # decaying with age, rather than the peak of the lookback
+    utilization_store: UtilizationStore = None
+    container_insights: bool = False
+    # without it, services come without their recent utilization, e.g. for
+    # callers that query utilization_history themselves
+    load_utilization: bool = True
+    task_definitions: Dict[str, Tuple[int, int]] = None
+    tag_pool: TagPool = None
+    inventory: ServiceInventory = None
+    api_calls: int = 0
+    _services: ServiceTable = None
+
+    def __post_init__(self):
+        if self.reservation_source not in RESERVATION_SOURCES:
+            raise ValueError(
+                f"reservation_source must be one of {', '.join(RESERVATION_SOURCES)}"
+            )
 
     @property
-    def services(self):
+    def services(self) -> ServiceTable:
         if self._services is None:
             self._load_services()
-            self._load_service_utilization()
+            if self.load_utilization:
+                self._load_service_utilization()
         return self._services
 
+    def refresh_services(self):
+        # lists and describes the services again, keeping the utilization of
+        # those still there until the next refresh_utilization
+        previous = self._services
+        self._load_services()
+        if previous is None:
+            if self.load_utilization:
+                self._load_service_utilization()
+            return
+        for attribute in UTILIZATION_METRICS.values():
+            before, after = getattr(previous, attribute), getattr(
+                self._services, attribute
+            )
+            for row, name in enumerate(self._services.names):
+                i = previous.index(name, self.name)
+                if i is not None:
+                    after[row] = before[i]
+
+    def refresh_utilization(self):
+        if self._services is None:
+            self.services
+            return
+        for attribute in UTILIZATION_METRICS.values():
+            column = getattr(self._services, attribute)
+            for row in range(len(column)):
+                column[row] = 0
+        self._load_service_utilization()
+
     def _load_services(self):
-        self._services = []
-        ecs = boto3.client("ecs")
+        ecs = clients.client("ecs")
+        if self.inventory is None:
+            records = self._describe_services(ecs, self._list_service_arns(ecs))
+            if self.reservation_source == "tasks":
+                records = _with_reservations(records, self._task_reservations(ecs))
+        else:
+            records = self._inventory_records(ecs)
+
+        self._services = ServiceTable(tag_pool=self.tag_pool)
+        for record in records.values():
+            fargate = record.get("fargate", False)
+            if self.reservation_source == "services":
+                task_count = record["task_count"]
+                cpu, memory = self._record_reservation(ecs, record)
+            else:
+                reservation = ServiceReservation(**record["reservation"])
+                task_count = reservation.task_count
+                cpu = reservation.cpu / max(1, task_count)
+                memory = reservation.memory / max(1, task_count)
+                fargate = fargate or reservation.fargate
+            self._services.append(
+                name=record["name"],
+                task_count=task_count,
+                task_cpu_reservation=cpu,
+                task_memory_reservation=memory,
+                fargate=fargate,
+                tags=record["tags"],
+                cluster=self.name,
+            )
+
+    def _record_reservation(self, ecs, record: dict) -> Tuple[int, int]:
+        # inventory snapshots saved before records kept the task definition
+        # arn carry the reservation itself
+        if "task_definition" not in record:
+            return record["task_cpu_reservation"], record["task_memory_reservation"]
+        return self._task_reservation(ecs, record["task_definition"])
+
+    def _inventory_records(self, ecs) -> Dict[str, dict]:
+        # with reservations from tasks, records also keep what their running
+        # tasks reserve, so tasks are only walked for the services events
+        # marked dirty, and for the whole cluster once per reconcile
+        tasks = self.reservation_source == "tasks"
+        snapshot = self.inventory.load(self.name)
+        if (
+            snapshot is None
+            or self.inventory.needs_reconcile(snapshot)
+            # snapshots saved without reservations, or by the other source
+            or (
+                tasks
+                and any("reservation" not in r for r in snapshot["services"].values())
+            )
+        ):
+            records = self._describe_services(ecs, self._list_service_arns(ecs))
+            if tasks:
+                records = _with_reservations(records, self._task_reservations(ecs))
+            self.inventory.save(self.name, self.inventory.reconciled(records))
+            return records
+
+        dirty = set(snapshot["dirty"])
+        if len(dirty) == 0:
+            return snapshot["services"]
+        # deleted services come back INACTIVE or as failures, so dropping
+        # the dirty ones before describing them again removes those too
+        records = {
+            arn: record
+            for arn, record in snapshot["services"].items()
+            if record["name"] not in dirty
+        }
+        described = self._describe_services(ecs, sorted(dirty))
+        if tasks:
+            if len(dirty) <= self._task_pages(snapshot["services"].values()):
+                # a listing per dirty service takes fewer calls than walking
+                # every task of the cluster
+                reservations = {}
+                for name in sorted(dirty):
+                    reservations.update(self._task_reservations(ecs, name))
+                described = _with_reservations(described, reservations)
+            else:
+                # the walk refreshes the reservations of every service
+                records = _with_reservations(
+                    {**records, **described}, self._task_reservations(ecs)
+                )
+                described = {}
+        records.update(described)
+        self.inventory.save(self.name, {**snapshot, "services": records, "dirty": []})
+        return records
+
+    def _task_pages(self, records: Iterable[dict]) -> int:
+        # pages of tasks a walk of the whole cluster takes
+        tasks = sum(record["reservation"]["task_count"] for record in records)
+        return 1 + tasks // min(LIST_TASKS_PAGE_SIZE, DESCRIBE_TASKS_BATCH_SIZE)
+
+    def _list_service_arns(self, ecs) -> List[str]:
         paginator = ecs.get_paginator("list_services")
-        responses = paginator.paginate(cluster=self.name)
+        responses = paginator.paginate(
+            cluster=self.name,
+            PaginationConfig={"PageSize": LIST_SERVICES_PAGE_SIZE},
+        )
+        service_arns = []
+        for response in responses:
+            self.api_calls += 1
+            service_arns.extend(response["serviceArns"])
+        return service_arns
+
+    def _describe_services(self, ecs, services: List[str]) -> Dict[str, dict]:
+        # service arn -> record, for services given by arn or name
+        records = {}
+        for i in range(0, len(services), DESCRIBE_SERVICES_BATCH_SIZE):
+            ecs_services = ecs.describe_services(
+                cluster=self.name,
+                services=services[i : i + DESCRIBE_SERVICES_BATCH_SIZE],
+                include=["TAGS"],
+            )["services"]
+            self.api_calls += 1
+            for ecs_service in ecs_services:
+                if ecs_service.get("status") == "INACTIVE":
+                    continue
+                records[ecs_service["serviceArn"]] = {
+                    "name": ecs_service["serviceName"],
+                    "task_count": ecs_service["runningCount"],
+                    "task_definition": ecs_service["taskDefinition"],
+                    "fargate": ecs_service.get("launchType") == "FARGATE"
+                    or any(
+                        item["capacityProvider"] in FARGATE_CAPACITY_PROVIDERS
+                        for item in ecs_service.get("capacityProviderStrategy", [])
+                    ),
+                    "tags": ecs_service.get("tags", []),
+                }
+        return records
+
+    def _task_reservations(
+        self, ecs, service_name: str = None
+    ) -> Dict[str, ServiceReservation]:
+        # service name -> reservation of its running tasks, whatever task
+        # definition revision they run, for every service or just one. Each
+        # page of task arns is described and folded in before the next is
+        # listed, so memory grows with the services, not the tasks.
+        reservations = {}
+        paginator = ecs.get_paginator("list_tasks")
+        responses = paginator.paginate(
+            cluster=self.name,
+            desiredStatus="RUNNING",
+            PaginationConfig={"PageSize": LIST_TASKS_PAGE_SIZE},
+            **({"serviceName": service_name} if service_name is not None else {}),
+        )
         for response in responses:
-            if len(response["serviceArns"]) > 0:
-                ecs_services = ecs.describe_services(
+            self.api_calls += 1
+            task_arns = response["taskArns"]
+            for i in range(0, len(task_arns), DESCRIBE_TASKS_BATCH_SIZE):
+                tasks = ecs.describe_tasks(
                     cluster=self.name,
-                    services=response["serviceArns"],
-                )["services"]
-                for ecs_service in ecs_services:
-                    task_definition = ecs.describe_task_definition(
-                        taskDefinition=ecs_service["taskDefinition"]
-                    )["taskDefinition"]
-
-                    cpu, memory = 0, 0
-                    for container in task_definition["containerDefinitions"]:
-                        cpu += container["cpu"]
-                        memory += container["memory"]
-
-                    tags = []
-                    try:
-                        tags = ecs.list_tags_for_resource(
-                            resourceArn=ecs_service["serviceArn"]
-                        )["tags"]
-                    except Exception as e:
-                        print(f'{ecs_service["serviceArn"]} :: {e}')
-
-                    self.services.append(
-                        Service(
-                            name=ecs_service["serviceName"],
-                            task_count=ecs_service["runningCount"],
-                            task_cpu_reservation=cpu,
-                            task_memory_reservation=memory,
-                            tags=tags,
-                        )
-                    )
+                    tasks=task_arns[i : i + DESCRIBE_TASKS_BATCH_SIZE],
+                )["tasks"]
+                self.api_calls += 1
+                for task in tasks:
+                    group = task.get("group", "")
+                    if not group.startswith("service:"):
+                        # standalone and scheduled tasks belong to no service
+                        continue
+                    name = group[len("service:") :]
+                    reservation = reservations.get(name)
+                    if reservation is None:
+                        reservation = reservations[name] = ServiceReservation()
+                    cpu, memory = self._running_task_reservation(ecs, task)
+                    reservation.task_count += 1
+                    reservation.cpu += cpu
+                    reservation.memory += memory
+                    if task.get("launchType") == "FARGATE" or (
+                        task.get("capacityProviderName") in FARGATE_CAPACITY_PROVIDERS
+                    ):
+                        reservation.fargate = True
+        return reservations
+
+    def _running_task_reservation(self, ecs, task: dict) -> Tuple[int, int]:
+        # task level sizes, which Fargate tasks always have and which include
+        # overrides, else the sizes of the task's containers
+        cpu = int(task.get("cpu") or 0)
+        memory = int(task.get("memory") or 0)
+        if cpu > 0 and memory > 0:
+            return cpu, memory
+        containers = task.get("containers", [])
+        container_cpu = sum(int(c.get("cpu") or 0) for c in containers)
+        container_memory = sum(
+            int(c.get("memory") or c.get("memoryReservation") or 0) for c in containers
+        )
+        if container_cpu == 0 and container_memory == 0:
+            container_cpu, container_memory = self._task_reservation(
+                ecs, task["taskDefinitionArn"]
+            )
+        return cpu or container_cpu, memory or container_memory
+
+    def _task_reservation(self, ecs, task_definition_arn: str) -> Tuple[int, int]:
+        if self.task_definitions is None:
+            self.task_definitions = {}
+        reservation = self.task_definitions.get(task_definition_arn)
+        if reservation is None:
+            task_definition = ecs.describe_task_definition(
+                taskDefinition=task_definition_arn
+            )["taskDefinition"]
+            self.api_calls += 1
+
+            # task level sizes win; containers may leave cpu out and give only
+            # a soft memoryReservation
+            cpu, memory = 0, 0
+            for container in task_definition["containerDefinitions"]:
+                cpu += container.get("cpu", 0)
+                memory += container.get("memory", container.get("memoryReservation", 0))
+            reservation = (
+                int(task_definition.get("cpu") or cpu),
+                int(task_definition.get("memory") or memory),
+            )
+            self.task_definitions[task_definition_arn] = reservation
+        return reservation
 
     def _load_service_utilization(
         self,
     ):
+        now = datetime.now(timezone.utc)
+        if self.utilization_store is not None:
+            self._load_service_percentiles(now)
+            return
+        for attribute, row, _, values in self.utilization_history(
+            now - self.utilization_lookback, now
+        ):
+            column = getattr(self._services, attribute)
+            column[row] = max(column[row], max(values))
+
+    def _load_service_percentiles(self, now: datetime):
+        store = self.utilization_store
+        state = store.load(self.name)
+        # whole periods only, the last of which CloudWatch may still be filling
+        period = timedelta(seconds=self.utilization_period)
+        end = (
+            datetime.fromtimestamp(
+                now.timestamp() // self.utilization_period * self.utilization_period,
+                timezone.utc,
+            )
+            - period
+        )
+        start = store.fetch_start(state, end)
+        if start < end:
+            store.advance(state, end)
+            names = self._services.names
+            for attribute, row, timestamps, values in self.utilization_history(
+                start, end
+            ):
+                store.add(state, names[row], attribute, end, timestamps, values)
+            store.save(self.name, state, self._services.names)
+
+        for attribute in UTILIZATION_METRICS.values():
+            column = getattr(self._services, attribute)
+            for row, name in enumerate(self._services.names):
+                column[row] = store.utilization(state, name, attribute)
+
+    def utilization_history(
+        self, start: datetime, end: datetime
+    ) -> Iterator[Tuple[str, int, List[datetime], List[float]]]:
+        # (service column, row, timestamps, values) for every service series
+        # with data between start and end, one point per utilization_period
         if len(self.services) == 0:
             return
 
-        cw = boto3.client("cloudwatch")
-        now = datetime.now(timezone.utc)
+        # query id -> (service column, row), where a row of None means the
+        # query is a SEARCH routed by its per-series label
+        routes = {}
+        if len(self.services) <= MAX_SEARCH_RESULTS:
+            queries = self._search_queries(routes)
+        else:
+            queries = self._metric_stat_queries(routes)
+
+        cw = clients.client("cloudwatch")
         paginator = cw.get_paginator("get_metric_data")
+        for i in range(0, len(queries), MAX_METRIC_DATA_QUERIES):
+            response_iterator = paginator.paginate(
+                MetricDataQueries=queries[i : i + MAX_METRIC_DATA_QUERIES],
+                StartTime=start,
+                EndTime=end,
+                ScanBy="TimestampDescending",
+            )
+
+            for response in response_iterator:
+                self.api_calls += 1
+                for result in response["MetricDataResults"]:
+                    if result["StatusCode"] not in ("Complete", "PartialData"):
+                        print(result["StatusCode"])
+                        print(result["Messages"])
+                    values = result["Values"]
+                    if len(values) == 0:
+                        continue
+
+                    attribute, row = routes[result["Id"]]
+                    if row is None:
+                        row = self._services.index(result["Label"], self.name)
+                        if row is None:
+                            continue
+                    if self.container_insights:
+                        values = self._percent_of_reservation(attribute, row, values)
+                        if values is None:
+                            continue
+                    yield attribute, row, result["Timestamps"], values
+
+    def _percent_of_reservation(
+        self, attribute: str, row: int, values: List[float]
+    ) -> Optional[List[float]]:
+        services = self._services
+        per_task = (
+            services.task_cpu_reservation
+            if attribute == "cpu_utilization"
+            else services.task_memory_reservation
+        )
+        reserved = services.task_count[row] * per_task[row]
+        if reserved == 0:
+            return None
+        return [100 * value / reserved for value in values]
+
+    def _metrics(self) -> Tuple[str, Dict[str, str]]:
+        if self.container_insights:
+            return "ECS/ContainerInsights", CONTAINER_INSIGHTS_METRICS
+        return "AWS/ECS", UTILIZATION_METRICS
+
+    def _search_queries(self, routes: Dict[str, Tuple[str, int]]) -> List[dict]:
+        namespace, metrics = self._metrics()
         queries = []
-        for service in self.services:
-            for metric in ["MemoryUtilization", "CPUUtilization"]:
+        for metric, attribute in metrics.items():
+            routes[metric.lower()] = (attribute, None)
+            queries.append(
+                {
+                    "Id": metric.lower(),
+                    "Expression": (
+                        f"SEARCH('{{{namespace},ClusterName,ServiceName}} "
+                        f'MetricName="{metric}" ClusterName="{self.name}"\', '
+                        f"'{self.utilization_stat}', {self.utilization_period})"
+                    ),
+                    "Label": "${PROP('Dim.ServiceName')}",
+                    "ReturnData": True,
+                }
+            )
+        return queries
+
+    def _metric_stat_queries(self, routes: Dict[str, Tuple[str, int]]) -> List[dict]:
+        namespace, metrics = self._metrics()
+        queries = []
+        for i, service_name in enumerate(self.services.names):
+            for metric, attribute in metrics.items():
+                query_id = f"s{i}_{metric.lower()}"
+                routes[query_id] = (attribute, i)
                 queries.append(
                     {
-                        "Id": service.name.lower().replace("-", "") + "_" + metric,
+                        "Id": query_id,
                         "MetricStat": {
                             "Metric": {
-                                "Namespace": "AWS/ECS",
+                                "Namespace": namespace,
                                 "MetricName": metric,
                                 "Dimensions": [
                                     {"Name": "ClusterName", "Value": self.name},
-                                    {"Name": "ServiceName", "Value": service.name},
+                                    {"Name": "ServiceName", "Value": service_name},
                                 ],
                             },
                             "Period": self.utilization_period,
@@ -89,33 +464,19 @@ class Cluster:
                         "ReturnData": True,
                     }
                 )
+        return queries
 
-        response_iterator = paginator.paginate(
-            MetricDataQueries=queries,
-            StartTime=now - self.utilization_lookback,
-            EndTime=now,
-            ScanBy="TimestampDescending",
-        )
 
-        for response in response_iterator:
-            for result in response["MetricDataResults"]:
-                if result["StatusCode"] != "Complete":
-                    print(result["StatusCode"])
-                    print(result["Messages"])
-                values = result["Values"]
-                if len(values) > 0:
-
-                    if len(self.services) == 1:
-                        service = self.services[0]
-                        if metric == "MemoryUtilization":
-                            service.memory_utilization = max(values)
-                        elif metric == "CPUUtilization":
-                            service.cpu_utilization = max(values)
-                    else:
-                        service_name, metric = result["Label"].split(" ")
-                        for service in self.services:
-                            if service.name == service_name:
-                                if metric == "MemoryUtilization":
-                                    service.memory_utilization = max(values)
-                                elif metric == "CPUUtilization":
-                                    service.cpu_utilization = max(values)
+def _with_reservations(
+    records: Dict[str, dict], reservations: Dict[str, ServiceReservation]
+) -> Dict[str, dict]:
+    # copies, since records may be shared with the inventory's cache
+    return {
+        arn: {
+            **record,
+            "reservation": asdict(
+                reservations.get(record["name"], ServiceReservation())
+            ),
+        }
+        for arn, record in records.items()
+    }
@@ -0,0 +1,101 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Callable, Iterator, List
+import os
+import time
+from . import clients
+from .cluster import Cluster
+from .cost_calculator import ClusterCostCalculator
+from .instrumentation import instrumentation
+
+
+@dataclass
+class ClusterCollection:
+    cluster: Cluster
+    calculator: ClusterCostCalculator = None
+    seconds: float = 0
+
+
+def default_workers() -> int:
+    return int(os.getenv("COLLECTOR_WORKERS", "8"))
+
+
+def list_cluster_names() -> List[str]:
+    ecs = clients.client("ecs")
+    paginator = ecs.get_paginator("list_clusters")
+    return [
+        arn.split("/")[1]
+        for response in paginator.paginate()
+        for arn in response["clusterArns"]
+    ]
+
+
+def collect(
+    cluster_names: List[str],
+    new_cluster: Callable[[str], Cluster],
+    new_calculator: Callable[[str], ClusterCostCalculator],
+    workers: int = None,
+    time_remaining: Callable[[], float] = None,
+    unfinished: List[str] = None,
+    failed: List[str] = None,
+) -> Iterator[ClusterCollection]:
+    # with time_remaining, no cluster is started once the budget (in seconds)
+    # runs out, and clusters that could not finish in time are appended to
+    # unfinished instead of being yielded. A cluster that raises is logged
+    # and appended to failed, and the others are still collected.
+    def load(cluster_name: str) -> ClusterCollection:
+        with instrumentation.cluster_scope(cluster_name):
+            return load_cluster(cluster_name)
+
+    def load_cluster(cluster_name: str) -> ClusterCollection:
+        start = time.monotonic()
+        cluster = new_cluster(cluster_name)
+        if len(cluster.services) == 0:
+            return ClusterCollection(cluster=cluster, seconds=time.monotonic() - start)
+        calculator = new_calculator(cluster_name)
+        return ClusterCollection(
+            cluster=cluster,
+            calculator=calculator,
+            seconds=time.monotonic() - start,
+        )
+
+    def budget() -> float:
+        return time_remaining() if time_remaining is not None else float("inf")
+
+    workers = workers or default_workers()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque(cluster_names)
+    in_flight = deque()
+    try:
+        while True:
+            while len(pending) > 0 and len(in_flight) < workers and budget() > 0:
+                cluster_name = pending.popleft()
+                in_flight.append((cluster_name, executor.submit(load, cluster_name)))
+            if len(in_flight) == 0:
+                break
+
+            cluster_name, future = in_flight[0]
+            try:
+                collection = future.result(
+                    timeout=max(0, budget()) if time_remaining is not None else None
+                )
+            except TimeoutError:
+                break
+            except Exception as e:
+                in_flight.popleft()
+                print(f"{cluster_name} :: {e}")
+                if failed is not None:
+                    failed.append(cluster_name)
+                continue
+            in_flight.popleft()
+            yield collection
+    finally:
+        for cluster_name, future in in_flight:
+            future.cancel()
+            if unfinished is not None:
+                unfinished.append(cluster_name)
+        if unfinished is not None:
+            unfinished.extend(pending)
+        # don't wait on clusters that overran the budget
+        executor.shutdown(wait=False)
@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+import csv
+import gzip
+import io
+import os
+import uuid
+from . import clients
+from .sink import Sink
+
+FORMATS = ("csv.gz", "parquet")
+COLUMNS = [
+    "collected_at",
+    "cluster",
+    "service",
+    "cpu_reservation",
+    "memory_reservation",
+    "hourly_cost",
+    "hourly_waste",
+]
+TAG_COLUMN_PREFIX = "tag_"
+
+
+class _Partition:
+    # rows of one date and cluster, column by column; every tag key seen
+    # becomes a column, empty for services without that tag
+    def __init__(self):
+        self.columns: Dict[str, list] = {name: [] for name in COLUMNS}
+        self.tags: Dict[str, List[Optional[str]]] = {}
+        self.rows = 0
+
+    def append(self, row: tuple, tags: List[Mapping[str, str]]):
+        for name, value in zip(COLUMNS, row):
+            self.columns[name].append(value)
+        for tag in tags:
+            column = self.tags.get(tag["key"])
+            if column is None:
+                column = self.tags[tag["key"]] = [None] * self.rows
+            column.append(tag["value"])
+        self.rows += 1
+        for column in self.tags.values():
+            if len(column) < self.rows:
+                column.append(None)
+
+
+class ColumnarSink(Sink):
+    # writes the raw per-service rows as files partitioned like
+    # date=YYYY-MM-DD/cluster=<name>/, one file per partition and flush, so
+    # it is flushed once per run rather than per cluster,
+    # under a local directory or an s3://bucket/prefix location. Rows
+    # collected from several accounts and regions go under
+    # date=YYYY-MM-DD/account=<id>/region=<name>/cluster=<name>/.
+    location: str
+    format: str
+    files: int = 0
+    rows: int = 0
+
+    def __init__(self, location: str, format: str = "csv.gz"):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        if format == "parquet":
+            # optional dependency; fail at startup rather than at the first flush
+            import pyarrow
+
+        self.location = location.rstrip("/")
+        self.format = format
+        self._partitions: Dict[Tuple[str, ...], _Partition] = {}
+
+    def handle_service(
+        self,
+        cluster: str,
+        service: str,
+        tags: List[Mapping[str, str]],
+        cpu_reservation: float,
+        memory_reservation: float,
+        hourly_cost: float,
+        hourly_waste: float,
+        account: str = None,
+        region: str = None,
+    ):
+        now = datetime.now(timezone.utc)
+        key = (
+            f"date={now.date()}",
+            *([f"account={account}"] if account is not None else []),
+            *([f"region={region}"] if region is not None else []),
+            f"cluster={cluster}",
+        )
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition()
+        partition.append(
+            (
+                now,
+                cluster,
+                service,
+                cpu_reservation,
+                memory_reservation,
+                hourly_cost,
+                hourly_waste,
+            ),
+            tags,
+        )
+
+    def flush(self):
+        partitions, self._partitions = self._partitions, {}
+        for key, partition in partitions.items():
+            name = (
+                f"{int(datetime.now(timezone.utc).timestamp())}-{uuid.uuid4().hex[:8]}"
+            )
+            self._write(
+                "/".join(key + (f"{name}.{self.format}",)),
+                self._encode(partition),
+            )
+            self.files += 1
+            self.rows += partition.rows
+
+    def reset_counts(self):
+        self.files, self.rows = 0, 0
+
+    def _encode(self, partition: _Partition) -> bytes:
+        tag_columns = {
+            f"{TAG_COLUMN_PREFIX}{key}": values
+            for key, values in sorted(partition.tags.items())
+        }
+        if self.format == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.table(
+                {
+                    **{name: partition.columns[name] for name in COLUMNS},
+                    **{
+                        name: pyarrow.array(
+                            values, pyarrow.string()
+                        ).dictionary_encode()
+                        for name, values in tag_columns.items()
+                    },
+                }
+            )
+            body = io.BytesIO()
+            pyarrow.parquet.write_table(table, body, compression="zstd")
+            return body.getvalue()
+
+        # csv has no dictionary encoding: tag values are written in full on
+        # every row, and only gzip takes out the repeats
+        body = io.StringIO()
+        writer = csv.writer(body)
+        writer.writerow(COLUMNS + list(tag_columns))
+        writer.writerows(
+            zip(
+                *(partition.columns[name] for name in COLUMNS),
+                *tag_columns.values(),
+            )
+        )
+        return gzip.compress(body.getvalue().encode("utf-8"))
+
+    def _write(self, path: str, body: bytes):
+        if self.location.startswith("s3://"):
+            bucket, _, prefix = self.location[len("s3://") :].partition("/")
+            s3 = clients.client("s3")
+            s3.put_object(
+                Bucket=bucket,
+                Key=f"{prefix}/{path}" if prefix != "" else path,
+                Body=body,
+            )
+            return
+
+        path = os.path.join(self.location, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
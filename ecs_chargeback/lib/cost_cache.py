@@ -0,0 +1,89 @@
+from typing import Dict, List, Tuple
+from datetime import date, datetime, timedelta, timezone
+from .object_cache import ObjectCache, default_cache
+
+# usage type -> (blended cost, usage quantity)
+UsageCosts = Dict[str, Tuple[float, float]]
+
+
+class DailyCostCache:
+    bucket: str
+    key: str
+    ttl: timedelta
+    settle_days: int
+    object_cache: ObjectCache
+    _days: Dict[str, dict] = None
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+        ttl: timedelta = timedelta(days=1),
+        settle_days: int = 2,
+        name: str = "costs",
+        object_cache: ObjectCache = None,
+    ):
+        self.bucket = bucket
+        self.key = f"{prefix}/{name}.json" if prefix is not None else f"{name}.json"
+        self.ttl = ttl
+        self.settle_days = settle_days
+        self.object_cache = object_cache if object_cache is not None else default_cache
+        self._days = {}
+
+    # the days dict is shared with the object cache, so put and prune
+    # replace it rather than change it in place
+    def load(self):
+        cached = self.object_cache.get(self.bucket, self.key)
+        self._days = cached["days"] if cached is not None else {}
+
+    def save(self):
+        self.object_cache.put(self.bucket, self.key, {"days": self._days})
+
+    def is_final(self, day: date) -> bool:
+        # cost explorer keeps adjusting a day's cost for a while after it
+        # closes; once fetched after settling, the record never changes
+        record = self._days.get(str(day))
+        if record is None:
+            return False
+        fetched_at = datetime.fromisoformat(record["fetched_at"])
+        return fetched_at.date() >= day + timedelta(days=1 + self.settle_days)
+
+    def stale_days(self, days: List[date]) -> List[date]:
+        now = datetime.now(timezone.utc)
+        stale = []
+        for day in days:
+            record = self._days.get(str(day))
+            if record is None:
+                stale.append(day)
+            elif not self.is_final(day):
+                fetched_at = datetime.fromisoformat(record["fetched_at"])
+                if fetched_at + self.ttl <= now:
+                    stale.append(day)
+        return stale
+
+    def get(self, day: date) -> Dict[str, UsageCosts]:
+        record = self._days.get(str(day))
+        if record is None:
+            return {}
+        return {
+            cluster_name: {
+                usage_type: tuple(costs) for usage_type, costs in usage.items()
+            }
+            for cluster_name, usage in record["clusters"].items()
+        }
+
+    def put(self, day: date, clusters: Dict[str, UsageCosts]):
+        self._days = {
+            **self._days,
+            str(day): {
+                "fetched_at": datetime.now(timezone.utc).isoformat(),
+                "clusters": clusters,
+            },
+        }
+
+    def prune(self, oldest: date):
+        self._days = {
+            day: record
+            for day, record in self._days.items()
+            if date.fromisoformat(day) >= oldest
+        }
@@ -1,33 +1,21 @@
-from dataclasses import dataclass
-from typing import List
-from .service import Service
-from datetime import date, timezone, timedelta, datetime
-import boto3
-import botocore
-import json
-import dataclasses
-from types import SimpleNamespace as Namespace
+from typing import Iterable, List
+from .service import Service, ServiceTable
+from .cost_cache import DailyCostCache
+from .cost_loader import ClusterInstanceType, FleetCostLoader
+from datetime import timedelta
+import os
 
-
-@dataclass
-class ClusterInstanceType:
-    instance_type_name: str
-    cost: float = 0
-    usage: float = 0
-    vcpus: int = 0
-    memory: int = 0
-
-
-class DataclassJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        return super().default(o)
+# Fargate bills the vCPU and GB-hours a task reserves rather than instances;
+# defaults are us-east-1 Linux/x86 on-demand prices
+FARGATE_VCPU_HOURLY_COST = float(os.getenv("FARGATE_VCPU_HOURLY_COST", "0.04048"))
+FARGATE_GB_HOURLY_COST = float(os.getenv("FARGATE_GB_HOURLY_COST", "0.004445"))
 
 
 class ClusterCostCalculator:
     name: str
     _instance_types: List[ClusterInstanceType] = None
+    _hourly_vcpu_cost: float = None
+    _memory_per_vcpu: float = None
 
     def __init__(
         self,
@@ -37,125 +25,31 @@ class ClusterCostCalculator:
         cache_bucket: str = None,
         cache_prefix: str = None,
         cache_ttl: timedelta = timedelta(days=1),
+        cost_loader: FleetCostLoader = None,
     ):
         self.name = name
 
-        s3 = boto3.resource("s3")
-        cache_object = None
-        if cache_bucket is not None:
-            key = (
-                f"{cache_prefix}/{self.name}.json"
-                if cache_prefix is not None
-                else f"{self.name}.json"
-            )
-            cache_object = s3.Object(cache_bucket, key)
-            try:
-                if cache_object.last_modified + cache_ttl > datetime.now(timezone.utc):
-                    file_content = cache_object.get()["Body"].read().decode("utf-8")
-                    self._instance_types = json.loads(
-                        file_content, object_hook=lambda d: Namespace(**d)
-                    )
-            except botocore.exceptions.ClientError as e:
-                if e.response["Error"]["Code"] != "404":
-                    raise
-
-        if self._instance_types is None:
-            self._load_instance_types(
-                cluster_tag=cluster_tag, cost_lookback=cost_lookback
-            )
-            self._load_instance_type_specs()
-
-            if cache_object is not None:
-                cache_object.put(
-                    Body=json.dumps(self._instance_types, cls=DataclassJSONEncoder)
-                )
-
-    def _load_instance_types(
-        self,
-        cluster_tag: str,
-        cost_lookback: timedelta,
-    ):
-        ce = boto3.client("ce")
-        end = date.today()
-        start = end - cost_lookback
-        response = ce.get_cost_and_usage(
-            TimePeriod={
-                "Start": str(start),
-                "End": str(end),
-            },
-            Granularity="DAILY",
-            Filter={
-                "And": [
-                    {
-                        "Tags": {
-                            "Key": cluster_tag,
-                            "Values": [self.name],
-                        },
-                    },
-                    {
-                        "Dimensions": {
-                            "Key": "USAGE_TYPE_GROUP",
-                            "Values": ["EC2: Running Hours"],
-                        },
-                    },
-                ]
-            },
-            Metrics=["BlendedCost", "UsageQuantity"],
-            GroupBy=[
-                {
-                    "Type": "DIMENSION",
-                    "Key": "USAGE_TYPE",
-                },
-            ],
-        )
-
-        self._instance_types = []
-        for result in response["ResultsByTime"]:
-            for group in result["Groups"]:
-                instance_type_name = group["Keys"][0].split(":")[1]
-
-                instance_type = next(
-                    (
-                        it
-                        for it in self._instance_types
-                        if it.instance_type_name == instance_type_name
-                    ),
-                    None,
-                )
-                if instance_type is None:
-                    instance_type = ClusterInstanceType(
-                        instance_type_name=instance_type_name
-                    )
-                    self._instance_types.append(instance_type)
-
-                instance_type.cost += float(group["Metrics"]["BlendedCost"]["Amount"])
-                instance_type.usage += float(
-                    group["Metrics"]["UsageQuantity"]["Amount"]
-                )
-
-    def _load_instance_type_specs(self):
-        if self._instance_types is None or len(self._instance_types) == 0:
-            return
-        ec2 = boto3.client("ec2")
-        response = ec2.describe_instance_types(
-            InstanceTypes=[it.instance_type_name for it in self._instance_types],
-        )
-
-        for i in response["InstanceTypes"]:
-            instance_type_name = i["InstanceType"]
-            instance_type = next(
-                (
-                    it
-                    for it in self._instance_types
-                    if it.instance_type_name == instance_type_name
+        if cost_loader is None:
+            cost_loader = FleetCostLoader(
+                cluster_tag=cluster_tag,
+                cost_lookback=cost_lookback,
+                cluster_names=[self.name],
+                cost_cache=DailyCostCache(
+                    bucket=cache_bucket,
+                    prefix=cache_prefix,
+                    ttl=cache_ttl,
+                    name=f"{self.name}.costs",
                 ),
-                None,
             )
-            if instance_type is not None:
-                instance_type.vcpus = i["VCpuInfo"]["DefaultVCpus"]
-                instance_type.memory = i["MemoryInfo"]["SizeInMiB"]
+        self._instance_types = cost_loader.instance_types(self.name)
 
     def hourly_service_reservation_cost(self, service: Service) -> float:
+        if service.fargate:
+            return sum(
+                fargate_hourly_costs(
+                    service.cpu_reservation, service.memory_reservation
+                )
+            )
         if self.memory_per_vcpu == 0:
             return 0
         vcpus = service.cpu_reservation / 1024
@@ -163,6 +57,14 @@ class ClusterCostCalculator:
         return self.hourly_vcpu_cost * vcpus * memory_multiplier
 
     def hourly_service_utilization_cost(self, service: Service) -> float:
+        if service.fargate:
+            cpu_cost, memory_cost = fargate_hourly_costs(
+                service.cpu_reservation, service.memory_reservation
+            )
+            return (
+                cpu_cost * service.cpu_utilization / 100
+                + memory_cost * service.memory_utilization / 100
+            )
         if self.memory_per_vcpu == 0:
             return 0
         vcpus = (service.cpu_utilization / 100) * (service.cpu_reservation / 1024)
@@ -173,28 +75,145 @@ class ClusterCostCalculator:
         )
         return self.hourly_vcpu_cost * vcpus * memory_multiplier
 
-    @property
-    def hourly_vcpu_cost(self) -> float:
-        weighted_sum_of_cost = 0
-        total_usage = 0
+    def hourly_service_costs(
+        self,
+        services: Iterable[Service],
+        cpu_utilization=None,
+        memory_utilization=None,
+    ):
+        # returns (hourly cost, hourly waste) arrays for the services, using
+        # their own utilization unless arrays are passed in
+        import numpy as np
+
+        if not isinstance(services, ServiceTable):
+            services = ServiceTable(services)
+        task_count = np.frombuffer(services.task_count, dtype=np.int64)
+        task_cpu = np.frombuffer(services.task_cpu_reservation, dtype=np.float64)
+        task_memory = np.frombuffer(services.task_memory_reservation, dtype=np.float64)
+        return self.hourly_costs(
+            cpu_reservation=task_count * task_cpu,
+            memory_reservation=task_count * task_memory,
+            memory_per_vcpu=np.divide(
+                1024 * task_memory,
+                task_cpu,
+                out=np.zeros(len(services)),
+                where=task_cpu != 0,
+            ),
+            cpu_utilization=(
+                cpu_utilization
+                if cpu_utilization is not None
+                else np.frombuffer(services.cpu_utilization, dtype=np.float64)
+            ),
+            memory_utilization=(
+                memory_utilization
+                if memory_utilization is not None
+                else np.frombuffer(services.memory_utilization, dtype=np.float64)
+            ),
+            fargate=np.frombuffer(services.fargate, dtype=np.int8) != 0,
+        )
 
-        for it in self._instance_types:
-            total_usage += it.usage
-            weighted_sum_of_cost += it.cost / it.vcpus
+    def hourly_costs(
+        self,
+        cpu_reservation,
+        memory_reservation,
+        memory_per_vcpu,
+        cpu_utilization,
+        memory_utilization,
+        fargate=None,
+    ):
+        return hourly_costs(
+            hourly_vcpu_cost=self.hourly_vcpu_cost,
+            cluster_memory_per_vcpu=self.memory_per_vcpu,
+            cpu_reservation=cpu_reservation,
+            memory_reservation=memory_reservation,
+            memory_per_vcpu=memory_per_vcpu,
+            cpu_utilization=cpu_utilization,
+            memory_utilization=memory_utilization,
+            fargate=fargate,
+        )
 
-        if total_usage == 0:
-            return 0
-        return weighted_sum_of_cost / total_usage
+    @property
+    def hourly_vcpu_cost(self) -> float:
+        if self._hourly_vcpu_cost is None:
+            self._load_rates()
+        return self._hourly_vcpu_cost
 
     @property
     def memory_per_vcpu(self) -> float:
+        if self._memory_per_vcpu is None:
+            self._load_rates()
+        return self._memory_per_vcpu
+
+    def _load_rates(self):
+        weighted_sum_of_cost = 0
         weighted_sum_of_ratios = 0
         total_usage = 0
 
         for it in self._instance_types:
             total_usage += it.usage
+            weighted_sum_of_cost += it.cost / it.vcpus
             weighted_sum_of_ratios += it.usage * (it.memory / it.vcpus)
 
         if total_usage == 0:
-            return 0
-        return weighted_sum_of_ratios / total_usage
+            self._hourly_vcpu_cost, self._memory_per_vcpu = 0, 0
+        else:
+            self._hourly_vcpu_cost = weighted_sum_of_cost / total_usage
+            self._memory_per_vcpu = weighted_sum_of_ratios / total_usage
+
+
+def hourly_costs(
+    hourly_vcpu_cost,
+    cluster_memory_per_vcpu,
+    cpu_reservation,
+    memory_reservation,
+    memory_per_vcpu,
+    cpu_utilization,
+    memory_utilization,
+    fargate=None,
+):
+    # vectorized form of hourly_service_reservation_cost and
+    # hourly_service_utilization_cost; the cluster rates may be scalars or
+    # per-service arrays, so services of several clusters can be costed in
+    # one pass, and services flagged in the fargate array are priced at
+    # Fargate rates, on their memory_reservation as memory_per_vcpu is 0
+    # for tasks without cpu. Returns (hourly cost, hourly waste) arrays.
+    import numpy as np
+
+    hourly_vcpu_cost = np.asarray(hourly_vcpu_cost, dtype=float)
+    cluster_memory_per_vcpu = np.asarray(cluster_memory_per_vcpu, dtype=float)
+    priced = cluster_memory_per_vcpu != 0
+    memory_ratio = np.divide(
+        memory_per_vcpu,
+        cluster_memory_per_vcpu,
+        out=np.zeros(np.broadcast(memory_per_vcpu, cluster_memory_per_vcpu).shape),
+        where=priced,
+    )
+    rate = np.where(priced, hourly_vcpu_cost, 0) * (cpu_reservation / 1024)
+
+    cost = rate * np.maximum(1, memory_ratio)
+    utilization_cost = (
+        rate
+        * (cpu_utilization / 100)
+        * np.maximum(1, (memory_utilization / 100) * memory_ratio)
+    )
+    if fargate is not None and fargate.any():
+        cpu_cost, memory_cost = fargate_hourly_costs(
+            cpu_reservation, memory_reservation
+        )
+        cost = np.where(fargate, cpu_cost + memory_cost, cost)
+        utilization_cost = np.where(
+            fargate,
+            cpu_cost * (cpu_utilization / 100)
+            + memory_cost * (memory_utilization / 100),
+            utilization_cost,
+        )
+    return cost, cost - utilization_cost
+
+
+def fargate_hourly_costs(cpu_reservation, memory_reservation):
+    # (vCPU, memory) hourly costs of Fargate tasks reserving the given cpu
+    # units and MiB, as scalars or arrays
+    return (
+        FARGATE_VCPU_HOURLY_COST * cpu_reservation / 1024,
+        FARGATE_GB_HOURLY_COST * memory_reservation / 1024,
+    )
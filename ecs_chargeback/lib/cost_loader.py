@@ -0,0 +1,189 @@
+from dataclasses import dataclass
+from typing import Dict, List
+from datetime import date, timedelta
+import threading
+from . import clients
+from .cost_cache import DailyCostCache, UsageCosts
+from . import instance_specs
+from .instance_specs import InstanceSpecCatalog
+
+
+@dataclass
+class ClusterInstanceType:
+    instance_type_name: str
+    cost: float = 0
+    usage: float = 0
+    vcpus: int = 0
+    memory: int = 0
+
+
+class FleetCostLoader:
+    cluster_tag: str
+    cost_lookback: timedelta
+    cluster_names: List[str]
+    cost_cache: DailyCostCache
+    spec_catalog: InstanceSpecCatalog
+    as_of: date
+    region: str
+    fetched_days: int = 0
+    _instance_types: Dict[str, List[ClusterInstanceType]] = None
+
+    def __init__(
+        self,
+        cluster_tag: str = "cluster",
+        cost_lookback: timedelta = timedelta(days=3),
+        cluster_names: List[str] = None,
+        cost_cache: DailyCostCache = None,
+        spec_catalog: InstanceSpecCatalog = None,
+        as_of: date = None,
+        region: str = None,
+    ):
+        self.cluster_tag = cluster_tag
+        self.cost_lookback = cost_lookback
+        self.cluster_names = cluster_names
+        self.cost_cache = cost_cache if cost_cache is not None else DailyCostCache()
+        self.spec_catalog = (
+            spec_catalog if spec_catalog is not None else instance_specs.default_catalog
+        )
+        # the lookback ends the day before as_of, today unless backfilling
+        self.as_of = as_of
+        # costs are only for clusters of one region, as cluster names are only
+        # unique within one; the region collected from unless given
+        self.region = region
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._instance_types is None:
+                if self.region is None:
+                    self.region = clients.client("ecs").meta.region_name
+                self._load_instance_types()
+                self._load_instance_type_specs()
+
+    def instance_types(self, cluster_name: str) -> List[ClusterInstanceType]:
+        self.load()
+        return self._instance_types.get(cluster_name, [])
+
+    def _load_instance_types(self):
+        end = self.as_of if self.as_of is not None else date.today()
+        days = [end - timedelta(days=n) for n in range(self.cost_lookback.days, 0, -1)]
+
+        self.cost_cache.load()
+        stale_days = self.cost_cache.stale_days(days)
+        if len(stale_days) > 0:
+            for day, clusters in self._load_daily_costs(min(stale_days), end).items():
+                self.cost_cache.put(day, clusters)
+            self.cost_cache.prune(days[0])
+            self.cost_cache.save()
+        # one query covers every day from the oldest stale one, fresh or not
+        self.fetched_days = (end - min(stale_days)).days if len(stale_days) > 0 else 0
+
+        self._instance_types = {}
+        instance_types_by_name = {}
+        for day in days:
+            for cluster_name, usage_costs in self.cost_cache.get(day).items():
+                for usage_type, (cost, usage) in usage_costs.items():
+                    instance_type_name = usage_type.split(":")[1]
+
+                    instance_type = instance_types_by_name.get(
+                        (cluster_name, instance_type_name)
+                    )
+                    if instance_type is None:
+                        instance_type = ClusterInstanceType(
+                            instance_type_name=instance_type_name
+                        )
+                        instance_types_by_name[(cluster_name, instance_type_name)] = (
+                            instance_type
+                        )
+                        self._instance_types.setdefault(cluster_name, []).append(
+                            instance_type
+                        )
+
+                    instance_type.cost += cost
+                    instance_type.usage += usage
+
+    def _load_daily_costs(
+        self, start: date, end: date
+    ) -> Dict[date, Dict[str, UsageCosts]]:
+        ce = clients.client("ce")
+        filters = [
+            {
+                "Dimensions": {
+                    "Key": "USAGE_TYPE_GROUP",
+                    "Values": ["EC2: Running Hours"],
+                },
+            },
+            # filtered rather than grouped by, as cost explorer groups by at
+            # most two keys
+            {
+                "Dimensions": {
+                    "Key": "REGION",
+                    "Values": [self.region],
+                },
+            },
+        ]
+        if self.cluster_names is not None:
+            filters.append(
+                {
+                    "Tags": {
+                        "Key": self.cluster_tag,
+                        "Values": self.cluster_names,
+                    },
+                }
+            )
+        request = dict(
+            TimePeriod={
+                "Start": str(start),
+                "End": str(end),
+            },
+            Granularity="DAILY",
+            Filter={"And": filters},
+            Metrics=["BlendedCost", "UsageQuantity"],
+            GroupBy=[
+                {
+                    "Type": "TAG",
+                    "Key": self.cluster_tag,
+                },
+                {
+                    "Type": "DIMENSION",
+                    "Key": "USAGE_TYPE",
+                },
+            ],
+        )
+
+        daily_costs = {}
+        while True:
+            response = ce.get_cost_and_usage(**request)
+            for result in response["ResultsByTime"]:
+                day = date.fromisoformat(result["TimePeriod"]["Start"])
+                clusters = daily_costs.setdefault(day, {})
+                for group in result["Groups"]:
+                    # tag group keys look like "<tag key>$<tag value>"
+                    cluster_name = group["Keys"][0].split("$", 1)[1]
+                    if cluster_name == "":
+                        continue
+                    usage_costs = clusters.setdefault(cluster_name, {})
+                    cost, usage = usage_costs.get(group["Keys"][1], (0, 0))
+                    usage_costs[group["Keys"][1]] = (
+                        cost + float(group["Metrics"]["BlendedCost"]["Amount"]),
+                        usage + float(group["Metrics"]["UsageQuantity"]["Amount"]),
+                    )
+
+            if "NextPageToken" not in response:
+                break
+            request["NextPageToken"] = response["NextPageToken"]
+        return daily_costs
+
+    def _load_instance_type_specs(self):
+        instance_type_names = {
+            it.instance_type_name
+            for instance_types in self._instance_types.values()
+            for it in instance_types
+        }
+        if len(instance_type_names) == 0:
+            return
+
+        specs = self.spec_catalog.specs(sorted(instance_type_names))
+        for instance_types in self._instance_types.values():
+            for it in instance_types:
+                it.vcpus, it.memory = specs.get(it.instance_type_name, (0, 0))
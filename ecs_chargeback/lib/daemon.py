@@ -0,0 +1,298 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+import json
+import threading
+import time
+import traceback
+from .cluster import Cluster
+from .collector import list_cluster_names
+from .cost_calculator import ClusterCostCalculator
+from .cost_loader import FleetCostLoader
+from .instrumentation import instrumentation
+from .rate_index import LiveRateIndex
+
+
+@dataclass
+class Schedule:
+    name: str
+    interval: float
+    job: Callable[[], None]
+    runs: int = 0
+    errors: int = 0
+    seconds: float = 0
+    ran_at: Optional[datetime] = None
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            self.job()
+        except Exception:
+            self.errors += 1
+            print(f"{self.name} :: {traceback.format_exc()}")
+        self.runs += 1
+        self.seconds = time.monotonic() - start
+        self.ran_at = datetime.now(timezone.utc)
+        print(f"{self.name}: {self.seconds:.2f}s")
+
+
+@dataclass
+class Snapshot:
+    # the latest per-service costs, encoded once per refresh so requests
+    # only write out bytes
+    generated_at: datetime
+    body: bytes
+    clusters: Dict[str, bytes]
+
+
+class Daemon:
+    # keeps clusters, their services and utilization, and the fleet's costs
+    # in memory, refreshes each on its own schedule and thread, and serves
+    # the latest snapshot over HTTP. A cluster is refreshed by one job at a
+    # time; a new snapshot is published after every job.
+    services_interval: float
+    utilization_interval: float
+    costs_interval: float
+    workers: int
+    snapshot: Optional[Snapshot] = None
+
+    def __init__(
+        self,
+        new_cluster: Callable[[str], Cluster],
+        new_cost_loader: Callable[[], FleetCostLoader],
+        services_interval: float = 60,
+        utilization_interval: float = 60,
+        costs_interval: float = 3600,
+        workers: int = 8,
+    ):
+        self.new_cluster = new_cluster
+        self.new_cost_loader = new_cost_loader
+        self.services_interval = services_interval
+        self.utilization_interval = utilization_interval
+        self.costs_interval = costs_interval
+        self.workers = workers
+        self.schedules = [
+            Schedule("services", services_interval, self.refresh_services),
+            Schedule("utilization", utilization_interval, self.refresh_utilization),
+            Schedule("costs", costs_interval, self.refresh_costs),
+        ]
+        self._clusters: Dict[str, Cluster] = {}
+        self._cluster_locks: Dict[str, threading.Lock] = {}
+        self._cost_loader: FleetCostLoader = None
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        # the first refresh of each kind runs before anything is served
+        for schedule in self.schedules:
+            schedule.run()
+        for schedule in self.schedules:
+            thread = threading.Thread(
+                target=self._loop, args=(schedule,), name=schedule.name, daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def refresh_services(self):
+        cluster_names = list_cluster_names()
+        for cluster_name in cluster_names:
+            if cluster_name not in self._clusters:
+                self._cluster_locks[cluster_name] = threading.Lock()
+                self._clusters[cluster_name] = self.new_cluster(cluster_name)
+        for cluster_name in set(self._clusters) - set(cluster_names):
+            del self._clusters[cluster_name]
+        cost_loader = self._cost_loader
+
+        def refresh(cluster: Cluster):
+            cluster.refresh_services()
+            # live rates follow the instances as the services move
+            if isinstance(cost_loader, LiveRateIndex):
+                cost_loader.refresh(cluster.name)
+
+        self._each_cluster(refresh)
+        self.publish()
+
+    def refresh_utilization(self):
+        self._each_cluster(Cluster.refresh_utilization)
+        self.publish()
+
+    def refresh_costs(self):
+        cost_loader = self.new_cost_loader()
+        cost_loader.load()
+        if isinstance(cost_loader, LiveRateIndex):
+            # list the instances here, on the pool, rather than one cluster
+            # at a time while publishing
+            self._each_cluster(lambda cluster: cost_loader.refresh(cluster.name))
+        self._cost_loader = cost_loader
+        self.publish()
+
+    def publish(self):
+        if self._cost_loader is None:
+            return
+        with self._publish_lock:
+            clusters = {}
+            for cluster_name, cluster in sorted(self._clusters.items()):
+                with self._cluster_locks[cluster_name]:
+                    if cluster._services is None:
+                        continue
+                    clusters[cluster_name] = self._cluster_rows(cluster)
+            generated_at = datetime.now(timezone.utc)
+            self.snapshot = Snapshot(
+                generated_at=generated_at,
+                body=_encode(
+                    {
+                        "generated_at": generated_at.isoformat(),
+                        "services": [row for rows in clusters.values() for row in rows],
+                    }
+                ),
+                clusters={
+                    cluster_name: _encode(
+                        {"generated_at": generated_at.isoformat(), "services": rows}
+                    )
+                    for cluster_name, rows in clusters.items()
+                },
+            )
+
+    def status(self) -> dict:
+        operations, _ = instrumentation.snapshot()
+        return {
+            "snapshot": (
+                self.snapshot.generated_at.isoformat()
+                if self.snapshot is not None
+                else None
+            ),
+            "clusters": len(self._clusters),
+            "schedules": {
+                schedule.name: {
+                    "interval": schedule.interval,
+                    "runs": schedule.runs,
+                    "errors": schedule.errors,
+                    "seconds": schedule.seconds,
+                    "ran_at": (
+                        schedule.ran_at.isoformat()
+                        if schedule.ran_at is not None
+                        else None
+                    ),
+                }
+                for schedule in self.schedules
+            },
+            "api_calls": {
+                f"{service}.{operation}": stats.calls
+                for (service, operation), stats in sorted(operations.items())
+            },
+        }
+
+    def server(self, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer((host, port), _handler(self))
+        server.daemon_threads = True
+        return server
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        # blocks until interrupted
+        server = self.server(host, port)
+        print(f"serving on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stop()
+
+    def _loop(self, schedule: Schedule):
+        while not self._stop.wait(schedule.interval):
+            schedule.run()
+
+    def _each_cluster(self, refresh: Callable[[Cluster], None]):
+        def run(item):
+            cluster_name, cluster = item
+            with instrumentation.cluster_scope(cluster_name):
+                with self._cluster_locks[cluster_name]:
+                    refresh(cluster)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, list(self._clusters.items())))
+
+    def _cluster_rows(self, cluster: Cluster) -> List[dict]:
+        services = cluster._services
+        if len(services) == 0:
+            return []
+        calculator = ClusterCostCalculator(
+            name=cluster.name, cost_loader=self._cost_loader
+        )
+        costs, wastes = calculator.hourly_service_costs(services)
+        return [
+            {
+                "cluster": cluster.name,
+                "service": service.name,
+                "tags": {tag["key"]: tag["value"] for tag in service.tags},
+                "cpu_reservation": service.cpu_reservation,
+                "memory_reservation": service.memory_reservation,
+                "cpu_utilization": service.cpu_utilization,
+                "memory_utilization": service.memory_utilization,
+                "fargate": service.fargate,
+                "hourly_cost": cost,
+                "hourly_waste": waste,
+            }
+            for service, cost, waste in zip(services, costs.tolist(), wastes.tolist())
+        ]
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _handler(daemon: Daemon):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so polling clients reuse their connection, with headers
+        # and body buffered into one write so small responses don't wait
+        # out a delayed ack
+        protocol_version = "HTTP/1.1"
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/status":
+                self._send(200, _encode(daemon.status()))
+                return
+            snapshot = daemon.snapshot
+            if path in ("/services", "/clusters"):
+                if snapshot is None:
+                    self._send(503, _encode({"error": "no snapshot yet"}))
+                    return
+                self._send(200, snapshot.body)
+                return
+            if path.startswith("/clusters/"):
+                body = (
+                    snapshot.clusters.get(path[len("/clusters/") :])
+                    if snapshot is not None
+                    else None
+                )
+                if body is None:
+                    self._send(404, _encode({"error": "no such cluster"}))
+                    return
+                self._send(200, body)
+                return
+            self._send(404, _encode({"error": "not found"}))
+
+        def _send(self, status: int, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # a line per request would cost more than serving it
+            pass
+
+    return Handler
@@ -1,17 +1,35 @@
-import datadog
+from typing import Dict, List, Tuple
+import time
+from .datadog_submitter import SeriesSubmitter
+from .instrumentation import OperationStats
+from .series_filter import SeriesFilter
+from .sink import Sink
 
+# the per-service series a rollup sums
+ROLLUP_SERIES = ("cpu_reservation", "memory_reservation", "hourly_cost", "hourly_waste")
 
-class DataDogHandler:
+
+class DataDogHandler(Sink):
     def __init__(
         self,
         api_key: str,
         metric_prefix: str,
+        buffered: bool = False,
+        api_host: str = "https://api.datadoghq.com",
+        series_filter: SeriesFilter = None,
+        rollup_tags: List[str] = None,
     ):
         self.metric_prefix = metric_prefix
-
-        datadog.initialize(
-            api_key=api_key,
-        )
+        # unbuffered handlers submit every call's metrics right away
+        self.buffered = buffered
+        self.submitter = SeriesSubmitter(api_key=api_key, api_host=api_host)
+        # with a filter, service series that have not changed are skipped
+        # until its heartbeat is due
+        self.series_filter = series_filter
+        # services are also summed per cluster and value of each of these tag
+        # keys, and sent as <prefix>.rollup.* when flushed
+        self.rollup_tags = rollup_tags if rollup_tags is not None else []
+        self._rollups: Dict[Tuple[str, str, str, str, str], List[float]] = {}
 
     def handle_service(
         self,
@@ -22,14 +40,31 @@ class DataDogHandler:
         memory_reservation: float,
         hourly_cost: float,
         hourly_waste: float,
+        account: str = None,
+        region: str = None,
     ):
         dd_tags = [
             f"cluster:{cluster}",
             f"service:{service}",
         ]
+        dd_tags.extend(_partition_tags(account, region))
         dd_tags.extend([f"{t['key']}:{t['value']}" for t in tags])
-        datadog.api.Metric.send(
-            metrics=[
+        if len(self.rollup_tags) > 0:
+            tag_values = {t["key"]: t["value"] for t in tags}
+            for key in self.rollup_tags:
+                totals = self._rollups.setdefault(
+                    (cluster, account, region, key, tag_values.get(key, "untagged")),
+                    [0.0] * len(ROLLUP_SERIES),
+                )
+                for i, value in enumerate(
+                    (cpu_reservation, memory_reservation, hourly_cost, hourly_waste)
+                ):
+                    totals[i] += value
+        self._send_changed(
+            cluster,
+            account,
+            region,
+            [
                 {
                     "metric": self._metric_name_cpu_reservation(),
                     "points": cpu_reservation,
@@ -54,9 +89,165 @@ class DataDogHandler:
                     "tags": dd_tags,
                     "type": "rate",
                 },
+            ],
+        )
+
+    def handle_cluster(
+        self,
+        cluster: str,
+        collection_seconds: float,
+        account: str = None,
+        region: str = None,
+    ):
+        self._send(
+            [
+                {
+                    "metric": self._metric_name_collection_seconds(),
+                    "points": collection_seconds,
+                    "tags": [f"cluster:{cluster}"] + _partition_tags(account, region),
+                    "type": "gauge",
+                },
+            ]
+        )
+
+    def handle_instrumentation(
+        self,
+        operations: Dict[Tuple[str, str], OperationStats],
+        clusters: Dict[str, OperationStats],
+    ):
+        metrics = []
+        for (service, operation), stats in operations.items():
+            metrics.extend(
+                self._operation_metrics(
+                    stats, [f"aws_service:{service}", f"operation:{operation}"]
+                )
+            )
+        for cluster, stats in clusters.items():
+            metrics.extend(self._operation_metrics(stats, [f"cluster:{cluster}"]))
+        if len(metrics) > 0:
+            self._send(metrics)
+
+    def handle_export(self, rows: int, files: int):
+        self._send_counts("export", [("rows", rows), ("files", files)])
+
+    def handle_rates(self, instances: int, unpriced: int, uncatalogued_clusters: int):
+        # container instances live rates were taken from, and those and the
+        # clusters that could not be priced from the catalog
+        self._send_counts(
+            "rates",
+            [
+                ("instances", instances),
+                ("unpriced", unpriced),
+                ("uncatalogued_clusters", uncatalogued_clusters),
+            ],
+        )
+
+    def handle_series_filter(self):
+        # the series filter's counts as <prefix>.series.*; rollups still
+        # pending are filtered first, so they count in this run
+        self._send_rollups()
+        self._send_counts(
+            "series",
+            [
+                ("emitted", self.series_filter.emitted),
+                ("suppressed", self.series_filter.suppressed),
+            ],
+        )
+
+    def _send_counts(self, group: str, counts: List[Tuple[str, int]]):
+        self._send(
+            [
+                {
+                    "metric": f"{self.metric_prefix}.{group}.{name}",
+                    "points": value,
+                    "tags": [],
+                    "type": "count",
+                }
+                for name, value in counts
             ]
         )
 
+    def _operation_metrics(self, stats: OperationStats, tags: List[str]):
+        return [
+            {
+                "metric": self._metric_name_api(name),
+                "points": value,
+                "tags": tags,
+                "type": metric_type,
+            }
+            for name, value, metric_type in [
+                ("calls", stats.calls, "count"),
+                ("errors", stats.errors, "count"),
+                ("retries", stats.retries, "count"),
+                ("throttles", stats.throttles, "count"),
+                ("bytes", stats.bytes, "count"),
+                ("latency.avg", 1000 * stats.seconds / max(1, stats.calls), "gauge"),
+                ("latency.p95", stats.latency_quantile(0.95), "gauge"),
+                ("latency.p99", stats.latency_quantile(0.99), "gauge"),
+            ]
+        ]
+
+    def flush(self):
+        self._send_rollups()
+        self._submit()
+
+    def _submit(self):
+        # series are only remembered as sent once they were
+        try:
+            self.submitter.flush()
+        except Exception:
+            if self.series_filter is not None:
+                self.series_filter.discard()
+            raise
+        if self.series_filter is not None:
+            self.series_filter.commit()
+
+    def _send_rollups(self):
+        rollups, self._rollups = self._rollups, {}
+        for (cluster, account, region, key, value), totals in rollups.items():
+            tags = [f"cluster:{cluster}", f"{key}:{value}"]
+            tags.extend(_partition_tags(account, region))
+            self._send_changed(
+                cluster,
+                account,
+                region,
+                [
+                    {
+                        "metric": f"{self.metric_prefix}.rollup.{name}",
+                        "points": total,
+                        "tags": tags,
+                        "type": "gauge" if name.endswith("reservation") else "rate",
+                    }
+                    for name, total in zip(ROLLUP_SERIES, totals)
+                ],
+            )
+
+    def _send_changed(self, cluster: str, account: str, region: str, metrics):
+        # only gauges are filtered; rates such as hourly_cost are always sent,
+        # as sums over services would drop whatever was suppressed
+        if self.series_filter is not None:
+            key = self.series_filter.key(cluster, account, region)
+            now = int(time.time())
+            metrics = [
+                m
+                for m in metrics
+                if m["type"] != "gauge"
+                or self.series_filter.keep(
+                    key, m["metric"], m["tags"], m["points"], now
+                )
+            ]
+            if len(metrics) == 0:
+                return
+        self._send(metrics)
+
+    def _send(self, metrics):
+        now = int(time.time())
+        for m in metrics:
+            m["points"] = [[now, m["points"]]]
+        self.submitter.add(metrics)
+        if not self.buffered:
+            self._submit()
+
     def _metric_name_cpu_reservation(self):
         return f"{self.metric_prefix}.cpu_reservation"
 
@@ -68,3 +259,18 @@ class DataDogHandler:
 
     def _metric_name_hourly_waste(self):
         return f"{self.metric_prefix}.hourly_waste"
+
+    def _metric_name_collection_seconds(self):
+        return f"{self.metric_prefix}.collection_seconds"
+
+    def _metric_name_api(self, name: str):
+        return f"{self.metric_prefix}.api.{name}"
+
+
+def _partition_tags(account: str, region: str) -> List[str]:
+    tags = []
+    if account is not None:
+        tags.append(f"account:{account}")
+    if region is not None:
+        tags.append(f"region:{region}")
+    return tags
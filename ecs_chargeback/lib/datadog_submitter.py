@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+from typing import List, Optional
+import gzip
+import json
+import random
+import time
+from .instrumentation import instrumentation
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class SubmissionStats:
+    series: int = 0
+    requests: int = 0
+    retries: int = 0
+    bytes: int = 0
+    seconds: float = 0
+    # series dropped because their submission failed after every retry
+    failed: int = 0
+
+
+class SeriesSubmitter:
+    api_key: str
+    url: str
+    max_payload_bytes: int
+    max_retries: int
+    stats: SubmissionStats
+
+    def __init__(
+        self,
+        api_key: str,
+        api_host: str = "https://api.datadoghq.com",
+        max_payload_bytes: int = 3_000_000,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.api_key = api_key
+        self.url = f"{api_host}/api/v1/series"
+        self.max_payload_bytes = max_payload_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = SubmissionStats()
+        # created on the first submission, keeping urllib3 out of import time
+        self._http = None
+        self._buffer = []
+        self._buffer_bytes = 0
+        # the first failure of a batch submitted from add, raised by flush
+        self._error = None
+
+    def reset_counts(self):
+        self.stats = SubmissionStats()
+
+    def add(self, series: List[dict]):
+        for s in series:
+            encoded = json.dumps(s).encode("utf-8")
+            if self._buffer_bytes + len(encoded) > self.max_payload_bytes:
+                error = self._submit()
+                if self._error is None:
+                    self._error = error
+            self._buffer.append(encoded)
+            self._buffer_bytes += len(encoded) + 1
+
+    def flush(self):
+        # raises the first failure since the last flush, once every batch
+        # has been tried
+        error, self._error = self._error, None
+        submit_error = self._submit()
+        if error is None:
+            error = submit_error
+        if error is not None:
+            raise error
+
+    def _submit(self) -> Optional[Exception]:
+        if len(self._buffer) == 0:
+            return None
+        # size is bounded before compression, which keeps the compressed
+        # payload well under the intake limit
+        payload = gzip.compress(
+            b'{"series":[' + b",".join(self._buffer) + b"]}", compresslevel=6
+        )
+        series = len(self._buffer)
+        self._buffer = []
+        self._buffer_bytes = 0
+
+        start = time.monotonic()
+        try:
+            self._post(payload)
+        except RuntimeError as e:
+            self.stats.failed += series
+            return e
+        finally:
+            self.stats.seconds += time.monotonic() - start
+        self.stats.series += series
+        self.stats.bytes += len(payload)
+        return None
+
+    def _post(self, payload: bytes):
+        import urllib3
+
+        if self._http is None:
+            self._http = urllib3.PoolManager(maxsize=4, retries=False)
+        start = time.monotonic()
+        retries, throttles, error = 0, 0, True
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self._http.request(
+                        "POST",
+                        self.url,
+                        body=payload,
+                        headers={
+                            "Content-Type": "application/json",
+                            "Content-Encoding": "gzip",
+                            "DD-API-KEY": self.api_key,
+                        },
+                    )
+                except urllib3.exceptions.HTTPError as e:
+                    # connection resets, timeouts and protocol errors are
+                    # retried like a 5xx
+                    self.stats.requests += 1
+                    if attempt == self.max_retries:
+                        raise RuntimeError(
+                            f"datadog series submission failed :: {e!r}"
+                        ) from e
+                    self.stats.retries += 1
+                    retries += 1
+                    time.sleep(self.backoff * (2**attempt) * (1 + random.random()))
+                    continue
+                self.stats.requests += 1
+                if response.status < 300:
+                    error = False
+                    return
+                if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise RuntimeError(
+                        f"datadog series submission failed :: {response.status} "
+                        f"{response.data[:200]!r}"
+                    )
+                self.stats.retries += 1
+                retries += 1
+                throttles += int(response.status == 429)
+                time.sleep(self.backoff * (2**attempt) * (1 + random.random()))
+        finally:
+            instrumentation.record(
+                "datadog",
+                "SubmitSeries",
+                time.monotonic() - start,
+                bytes=len(payload),
+                retries=retries,
+                throttles=throttles,
+                error=error,
+            )
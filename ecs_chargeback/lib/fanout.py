@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+import json
+from . import clients
+
+
+def shard(cluster_names: List[str], shard_size: int) -> List[List[str]]:
+    return [
+        cluster_names[i : i + shard_size]
+        for i in range(0, len(cluster_names), shard_size)
+    ]
+
+
+class LambdaInvoker:
+    function_name: str
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+
+    def __call__(self, event: dict):
+        clients.client("lambda").invoke(
+            FunctionName=self.function_name,
+            InvocationType="Event",
+            Payload=json.dumps(event).encode("utf-8"),
+        )
+
+
+class InProcessInvoker:
+    # stands in for LambdaInvoker when running locally, calling the handler
+    # on a thread pool the way asynchronous invocations would run
+    def __init__(self, handler: Callable[[dict, object], None], workers: int = 1):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def __call__(self, event: dict):
+        # round-trip through json so workers see exactly what lambda would
+        event = json.loads(json.dumps(event))
+        self.futures.append(self.executor.submit(self.handler, event, None))
+
+    def wait(self):
+        while len(self.futures) > 0:
+            self.futures.pop(0).result()
+
+
+def fan_out(
+    cluster_names: List[str],
+    shard_size: int,
+    invoke: Callable[[dict], None],
+    **event,
+) -> int:
+    shards = shard(cluster_names, shard_size)
+    for clusters in shards:
+        invoke(dict(event, clusters=clusters))
+    return len(shards)
@@ -0,0 +1,112 @@
+from typing import Dict, List, Tuple
+import json
+import os
+import tempfile
+import threading
+from . import clients
+from .object_cache import ObjectCache, default_cache
+
+DESCRIBE_INSTANCE_TYPES_BATCH_SIZE = 100
+
+# instance type name -> (vcpus, memory in MiB)
+InstanceSpec = Tuple[int, int]
+
+
+class InstanceSpecCatalog:
+    path: str
+    bucket: str
+    key: str
+    object_cache: ObjectCache
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(
+        self,
+        path: str = None,
+        bucket: str = None,
+        prefix: str = None,
+        object_cache: ObjectCache = None,
+    ):
+        self.path = (
+            path
+            if path is not None
+            else os.path.join(
+                tempfile.gettempdir(), "ecs-chargeback-instance-types.json"
+            )
+        )
+        self.bucket = bucket
+        self.key = (
+            f"{prefix}/instance-types.json"
+            if prefix is not None
+            else "instance-types.json"
+        )
+        self.object_cache = object_cache if object_cache is not None else default_cache
+        self._specs = None
+        self._lock = threading.Lock()
+
+    def specs(self, instance_type_names: List[str]) -> Dict[str, InstanceSpec]:
+        with self._lock:
+            if self._specs is None:
+                self._load()
+
+            unknown = sorted(
+                {name for name in instance_type_names if name not in self._specs}
+            )
+            self.misses += len(unknown)
+            self.hits += len(instance_type_names) - len(unknown)
+            if len(unknown) > 0:
+                self._describe(unknown)
+                self._save()
+
+            return {
+                name: self._specs[name]
+                for name in instance_type_names
+                if name in self._specs
+            }
+
+    def _load(self):
+        self._specs = {}
+        try:
+            with open(self.path) as f:
+                self._specs = {k: tuple(v) for k, v in json.load(f).items()}
+            return
+        except (OSError, ValueError):
+            pass
+
+        if self.bucket is None:
+            return
+        specs = self.object_cache.get(self.bucket, self.key)
+        if specs is None:
+            return
+        self._specs = {k: tuple(v) for k, v in specs.items()}
+        self._save_local()
+
+    def _describe(self, instance_type_names: List[str]):
+        ec2 = clients.client("ec2")
+        for i in range(0, len(instance_type_names), DESCRIBE_INSTANCE_TYPES_BATCH_SIZE):
+            response = ec2.describe_instance_types(
+                InstanceTypes=instance_type_names[
+                    i : i + DESCRIBE_INSTANCE_TYPES_BATCH_SIZE
+                ],
+            )
+            for spec in response["InstanceTypes"]:
+                self._specs[spec["InstanceType"]] = (
+                    spec["VCpuInfo"]["DefaultVCpus"],
+                    spec["MemoryInfo"]["SizeInMiB"],
+                )
+
+    def _save(self):
+        self._save_local()
+        if self.bucket is not None:
+            self.object_cache.put(self.bucket, self.key, dict(self._specs))
+
+    def _save_local(self):
+        try:
+            with open(self.path, "w") as f:
+                json.dump(self._specs, f)
+        except OSError as e:
+            print(f"{self.path} :: {e}")
+
+
+# shared by every loader in the process that isn't given its own catalog
+default_catalog = InstanceSpecCatalog()
@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import bisect
+import threading
+import time
+
+# upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf")]
+THROTTLE_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "SlowDown",
+    "LimitExceededException",
+}
+
+
+@dataclass
+class OperationStats:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    throttles: int = 0
+    bytes: int = 0
+    seconds: float = 0
+    latency_buckets: List[int] = field(
+        default_factory=lambda: [0] * len(LATENCY_BUCKETS_MS)
+    )
+
+    def record(self, seconds: float, bytes: int, retries: int, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.retries += retries
+        self.bytes += bytes
+        self.seconds += seconds
+        self.latency_buckets[
+            bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)
+        ] += 1
+
+    def merge(self, other: "OperationStats"):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.retries += other.retries
+        self.throttles += other.throttles
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.latency_buckets = [
+            a + b for a, b in zip(self.latency_buckets, other.latency_buckets)
+        ]
+
+    def latency_quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th call, in milliseconds
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.latency_buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                return bound
+        return 0
+
+
+class Instrumentation:
+    operations: Dict[Tuple[str, str], OperationStats]
+    clusters: Dict[str, OperationStats]
+
+    def __init__(self):
+        self.operations = {}
+        self.clusters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def instrument(self, session):
+        session.events.register("before-parameter-build.*.*", self._before_call)
+        session.events.register("after-call.*.*", self._after_call)
+        session.events.register("after-call-error.*.*", self._after_call_error)
+        session.events.register("needs-retry.*.*", self._needs_retry)
+
+    @contextmanager
+    def cluster_scope(self, cluster_name: str):
+        # attributes calls made on this thread to the cluster
+        previous = getattr(self._local, "cluster_name", None)
+        self._local.cluster_name = cluster_name
+        try:
+            yield
+        finally:
+            self._local.cluster_name = previous
+
+    def record(
+        self,
+        service: str,
+        operation: str,
+        seconds: float,
+        bytes: int = 0,
+        retries: int = 0,
+        throttles: int = 0,
+        error: bool = False,
+    ):
+        cluster_name = getattr(self._local, "cluster_name", None)
+        with self._lock:
+            stats = self.operations.setdefault((service, operation), OperationStats())
+            stats.record(seconds, bytes, retries, error)
+            stats.throttles += throttles
+            if cluster_name is not None:
+                stats = self.clusters.setdefault(cluster_name, OperationStats())
+                stats.record(seconds, bytes, retries, error)
+                stats.throttles += throttles
+
+    def snapshot(self, reset: bool = False):
+        with self._lock:
+            operations, clusters = self.operations, self.clusters
+            if reset:
+                self.operations, self.clusters = {}, {}
+            else:
+                operations, clusters = dict(operations), dict(clusters)
+        return operations, clusters
+
+    def merge(
+        self,
+        operations: Dict[Tuple[str, str], OperationStats],
+        clusters: Dict[str, OperationStats],
+    ):
+        # adds a snapshot taken in another process
+        with self._lock:
+            for key, stats in operations.items():
+                self.operations.setdefault(key, OperationStats()).merge(stats)
+            for cluster_name, stats in clusters.items():
+                self.clusters.setdefault(cluster_name, OperationStats()).merge(stats)
+
+    def _before_call(self, model, context, **kwargs):
+        context["instrumentation_start"] = time.monotonic()
+        context["instrumentation_operation"] = (
+            model.service_model.service_name,
+            model.name,
+        )
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        metadata = parsed.get("ResponseMetadata", {})
+        self.record(
+            model.service_model.service_name,
+            model.name,
+            time.monotonic() - context.get("instrumentation_start", time.monotonic()),
+            bytes=int(http_response.headers.get("content-length", 0)),
+            retries=metadata.get("RetryAttempts", 0),
+            error=http_response.status_code >= 300,
+        )
+
+    def _after_call_error(self, context, **kwargs):
+        # raised before a response was parsed, e.g. a connection error
+        if "instrumentation_operation" not in context:
+            return
+        self.record(
+            *context["instrumentation_operation"],
+            time.monotonic() - context["instrumentation_start"],
+            error=True,
+        )
+
+    def _needs_retry(self, response, operation, **kwargs):
+        # only counts throttled attempts; returning None leaves the retry
+        # decision to botocore
+        if response is None:
+            return None
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in THROTTLE_CODES:
+            with self._lock:
+                key = (operation.service_model.service_name, operation.name)
+                self.operations.setdefault(key, OperationStats()).throttles += 1
+                cluster_name = getattr(self._local, "cluster_name", None)
+                if cluster_name is not None:
+                    self.clusters.setdefault(
+                        cluster_name, OperationStats()
+                    ).throttles += 1
+        return None
+
+
+# shared by every client created through lib.clients and by the datadog
+# submitter
+instrumentation = Instrumentation()
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Set
+import json
+import time
+from . import clients
+from .object_cache import ObjectCache
+
+RECEIVE_MESSAGE_BATCH_SIZE = 10
+RECEIVE_MESSAGE_WAIT_SECS = 1
+MAX_RECEIVES_PER_CHUNK = 100
+SERVICE_DETAIL_TYPES = ("ECS Service Action", "ECS Deployment State Change")
+
+
+class ServiceInventory:
+    # per-cluster snapshot of describe_services results, keyed by service
+    # arn, so a run only re-describes the services an ECS event marked dirty
+    # and re-lists the whole cluster once per reconcile interval. Snapshots
+    # look like {"reconciled_at": iso, "services": {arn: record},
+    # "dirty": [service name]}.
+    bucket: str
+    prefix: str
+    reconcile_interval: timedelta
+    object_cache: ObjectCache
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+        reconcile_interval: timedelta = timedelta(hours=1),
+        object_cache: ObjectCache = None,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.reconcile_interval = reconcile_interval
+        # dirty markers are written by the coordinator and consumed by
+        # workers, so every read revalidates rather than trusting memory
+        self.object_cache = (
+            object_cache
+            if object_cache is not None
+            else ObjectCache(max_entries=1024, ttl=timedelta(0))
+        )
+
+    def key(self, cluster_name: str) -> str:
+        if self.prefix is None:
+            return f"inventory/{cluster_name}.json"
+        return f"{self.prefix}/inventory/{cluster_name}.json"
+
+    def load(self, cluster_name: str) -> Optional[dict]:
+        return self.object_cache.get(self.bucket, self.key(cluster_name))
+
+    def save(self, cluster_name: str, snapshot: dict):
+        self.object_cache.put(self.bucket, self.key(cluster_name), snapshot)
+
+    def needs_reconcile(self, snapshot: dict) -> bool:
+        reconciled_at = datetime.fromisoformat(snapshot["reconciled_at"])
+        return reconciled_at + self.reconcile_interval <= datetime.now(timezone.utc)
+
+    def reconciled(self, services: Dict[str, dict]) -> dict:
+        return {
+            "reconciled_at": datetime.now(timezone.utc).isoformat(),
+            "services": services,
+            "dirty": [],
+        }
+
+    def mark(self, changes: Dict[str, Set[str]]):
+        # clusters without a snapshot get a full listing anyway
+        for cluster_name, service_names in changes.items():
+            snapshot = self.load(cluster_name)
+            if snapshot is None:
+                continue
+            dirty = set(snapshot["dirty"])
+            if service_names <= dirty:
+                continue
+            self.save(
+                cluster_name,
+                {**snapshot, "dirty": sorted(dirty | service_names)},
+            )
+
+
+def drain_events(
+    queue_url: str, inventory: ServiceInventory, max_seconds: float = 10
+) -> int:
+    # reads the ECS events EventBridge forwards to the queue until it is empty
+    # or max_seconds have passed, records the services they touch as dirty
+    # and only then deletes the messages, so a failed run leaves them to the
+    # next one. Long polling, so an empty answer means the queue is empty.
+    # Returns the events read.
+    sqs = clients.client("sqs")
+    deadline = time.monotonic() + max_seconds
+    read = 0
+    empty = False
+    while not empty and time.monotonic() < deadline:
+        # marked and deleted in chunks, well within the visibility timeout
+        changes: Dict[str, Set[str]] = {}
+        receipts = []
+        for _ in range(MAX_RECEIVES_PER_CHUNK):
+            messages = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=RECEIVE_MESSAGE_BATCH_SIZE,
+                WaitTimeSeconds=RECEIVE_MESSAGE_WAIT_SECS,
+            ).get("Messages", [])
+            if len(messages) == 0:
+                empty = True
+                break
+            for message in messages:
+                receipts.append(message["ReceiptHandle"])
+                for cluster_name, service_name in _changed_services(
+                    json.loads(message["Body"])
+                ):
+                    changes.setdefault(cluster_name, set()).add(service_name)
+            if time.monotonic() >= deadline:
+                break
+
+        inventory.mark(changes)
+        for i in range(0, len(receipts), RECEIVE_MESSAGE_BATCH_SIZE):
+            sqs.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[
+                    {"Id": str(j), "ReceiptHandle": receipt}
+                    for j, receipt in enumerate(
+                        receipts[i : i + RECEIVE_MESSAGE_BATCH_SIZE]
+                    )
+                ],
+            )
+        read += len(receipts)
+    return read
+
+
+def _changed_services(event: dict) -> Iterable[tuple]:
+    detail = event.get("detail", {})
+    if event.get("detail-type") == "ECS Task State Change":
+        # tasks started by a service carry a group of "service:<name>"
+        group = detail.get("group", "")
+        if group.startswith("service:") and "clusterArn" in detail:
+            yield _arn_name(detail["clusterArn"]), group[len("service:") :]
+    elif event.get("detail-type") in SERVICE_DETAIL_TYPES:
+        for arn in event.get("resources", []):
+            # arn:aws:ecs:<region>:<account>:service/<cluster>/<service>
+            parts = arn.split(":", 5)[-1].split("/")
+            if len(parts) == 3 and parts[0] == "service":
+                yield parts[1], parts[2]
+            elif len(parts) == 2 and "clusterArn" in detail:
+                yield _arn_name(detail["clusterArn"]), parts[1]
+
+
+def _arn_name(arn: str) -> str:
+    return arn.split("/")[-1]
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+import json
+import os
+import threading
+import botocore
+from . import clients
+
+# (bucket, key)
+CacheKey = Tuple[Optional[str], str]
+
+
+@dataclass
+class CacheStats:
+    # served from memory within the ttl
+    hits: int = 0
+    # memory copy expired and S3 answered 304 Not Modified
+    revalidations: int = 0
+    # body read from S3, either cold or because it changed
+    fetches: int = 0
+    # neither memory nor S3 had the object; the caller loads it from origin
+    misses: int = 0
+    # callers that waited on another thread's read of the same object
+    collapsed: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{self.hits} hits, {self.revalidations} revalidations, "
+            f"{self.fetches} fetches, {self.misses} misses, "
+            f"{self.collapsed} collapsed, {self.writes} writes"
+        )
+
+
+@dataclass
+class _Entry:
+    value: Any
+    etag: Optional[str]
+    checked_at: datetime
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ObjectCache:
+    # JSON objects kept in S3, fronted by an in-memory LRU that lives as long
+    # as the process, so a warm lambda container only revalidates with
+    # If-None-Match once the memory copy is older than the ttl. Values are
+    # shared between callers and must be treated as read-only.
+    max_entries: int
+    ttl: timedelta
+    stats: CacheStats
+
+    def __init__(
+        self,
+        max_entries: int = 64,
+        ttl: timedelta = timedelta(minutes=5),
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._inflight: Dict[CacheKey, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket: Optional[str], key: str) -> Optional[Any]:
+        cache_key = (bucket, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(cache_key)
+                self.stats.hits += 1
+                return entry.value
+            flight = self._inflight.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[cache_key] = _Flight()
+            else:
+                self.stats.collapsed += 1
+
+        if not leader:
+            # another thread is already reading the object; share its result
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._read(cache_key, entry)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[cache_key]
+            flight.done.set()
+
+    def put(self, bucket: Optional[str], key: str, value: Any):
+        etag = None
+        if bucket is not None:
+            s3 = clients.client("s3")
+            etag = s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(value))["ETag"]
+        with self._lock:
+            self.stats.writes += 1
+            self._store((bucket, key), _Entry(value, etag, _now()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _read(self, cache_key: CacheKey, entry: Optional[_Entry]) -> Optional[Any]:
+        bucket, key = cache_key
+        if bucket is None:
+            # memory only; an expired copy is as good as it gets
+            with self._lock:
+                if entry is None:
+                    self.stats.misses += 1
+                    return None
+                self.stats.hits += 1
+                self._store(cache_key, _Entry(entry.value, None, _now()))
+            return entry.value
+
+        params = {"Bucket": bucket, "Key": key}
+        if entry is not None and entry.etag is not None:
+            params["IfNoneMatch"] = entry.etag
+        s3 = clients.client("s3")
+        try:
+            response = s3.get_object(**params)
+        except botocore.exceptions.ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                with self._lock:
+                    self.stats.revalidations += 1
+                    self._store(cache_key, _Entry(entry.value, entry.etag, _now()))
+                return entry.value
+            if code not in ("404", "NoSuchKey"):
+                raise
+            with self._lock:
+                self.stats.misses += 1
+                self._entries.pop(cache_key, None)
+            return None
+
+        value = json.loads(response["Body"].read().decode("utf-8"))
+        with self._lock:
+            self.stats.fetches += 1
+            self._store(cache_key, _Entry(value, response.get("ETag"), _now()))
+        return value
+
+    def _expired(self, entry: _Entry) -> bool:
+        return entry.checked_at + self.ttl <= _now()
+
+    def _store(self, cache_key: CacheKey, entry: _Entry):
+        self._entries[cache_key] = entry
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# shared by every cache in the process that isn't given its own, so it
+# survives between invocations of a warm lambda container
+default_cache = ObjectCache(
+    max_entries=int(os.getenv("OBJECT_CACHE_MAX_ENTRIES", "64")),
+    ttl=timedelta(seconds=int(os.getenv("OBJECT_CACHE_TTL_SECS", "300"))),
+)
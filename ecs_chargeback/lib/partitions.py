@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+import threading
+import traceback
+from . import clients
+from .instrumentation import instrumentation
+from .sink import BufferedSink
+
+
+@dataclass(frozen=True)
+class Partition:
+    account: str
+    region: str
+    role_arn: str
+
+
+@dataclass
+class PartitionResult:
+    partition: Partition
+    sink: BufferedSink = field(default_factory=BufferedSink)
+    unfinished: List[str] = field(default_factory=list)
+    # an instrumentation snapshot, for partitions collected in another process
+    instrumentation: Optional[tuple] = None
+    # what live rates priced, as the rate index stays in the worker process
+    live_rates: Counter = field(default_factory=Counter)
+    error: Optional[str] = None
+
+
+def account_partitions(
+    accounts: List[str], regions: List[str], role_name: str
+) -> List[Partition]:
+    # region by region, so an account's other regions usually start once its
+    # first one has cached the account's costs
+    return [
+        Partition(account, region, f"arn:aws:iam::{account}:role/{role_name}")
+        for region in regions
+        for account in accounts
+    ]
+
+
+class RoleCache:
+    # assumed-role credentials per role, kept until shortly before they
+    # expire so a warm lambda container only calls AssumeRole about once an
+    # hour per account. Worker processes forked after a refresh inherit them.
+    refresh_margin: timedelta
+    session_name: str
+    assumed: int = 0
+
+    def __init__(
+        self,
+        refresh_margin: timedelta = timedelta(minutes=5),
+        session_name: str = "ecs-chargeback",
+    ):
+        self.refresh_margin = refresh_margin
+        self.session_name = session_name
+        self._credentials: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, partitions: List[Partition], workers: int = 8):
+        # assumes the roles about to expire ahead of time and concurrently
+        role_arns = sorted({partition.role_arn for partition in partitions})
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.credentials, role_arns))
+
+    def credentials(self, role_arn: str) -> dict:
+        credentials = self._credentials.get(role_arn)
+        if credentials is None or self._expiring(credentials):
+            credentials = clients.client("sts").assume_role(
+                RoleArn=role_arn, RoleSessionName=self.session_name
+            )["Credentials"]
+            with self._lock:
+                self._credentials[role_arn] = credentials
+                self.assumed += 1
+        return credentials
+
+    def client_config(self, partition: Partition) -> dict:
+        # client arguments for the partition, see clients.use_partition
+        credentials = self.credentials(partition.role_arn)
+        return {
+            "region_name": partition.region,
+            "aws_access_key_id": credentials["AccessKeyId"],
+            "aws_secret_access_key": credentials["SecretAccessKey"],
+            "aws_session_token": credentials["SessionToken"],
+        }
+
+    def _expiring(self, credentials: dict) -> bool:
+        expiration = credentials["Expiration"]
+        if isinstance(expiration, str):
+            expiration = datetime.fromisoformat(expiration)
+        return expiration - self.refresh_margin <= datetime.now(timezone.utc)
+
+
+def collect_partitions(
+    partitions: List[Partition],
+    collect_partition: Callable[[Partition], PartitionResult],
+    processes: int = 1,
+) -> Iterator[PartitionResult]:
+    # runs collect_partition over the partitions on forked worker processes,
+    # each collecting one partition at a time with its own thread pool, and
+    # yields the results as they finish. Workers are plain processes talking
+    # over pipes, since lambda has no /dev/shm for multiprocessing.Pool.
+    if processes <= 1:
+        for partition in partitions:
+            yield _collect(collect_partition, partition)
+        return
+
+    import multiprocessing
+    import multiprocessing.connection
+
+    context = multiprocessing.get_context("fork")
+    pending = list(reversed(partitions))
+    workers = []
+    busy = {}
+    try:
+        for _ in range(min(processes, len(partitions))):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(child_connection, collect_partition),
+                daemon=True,
+            )
+            process.start()
+            child_connection.close()
+            workers.append((process, connection))
+            busy[connection] = pending.pop()
+            connection.send(busy[connection])
+
+        while len(busy) > 0:
+            for connection in multiprocessing.connection.wait(list(busy)):
+                partition = busy.pop(connection)
+                try:
+                    result = connection.recv()
+                except EOFError:
+                    # the worker died, e.g. out of memory; its partition is lost
+                    yield PartitionResult(partition, error="worker process exited")
+                    continue
+                if len(pending) > 0:
+                    busy[connection] = pending.pop()
+                    connection.send(busy[connection])
+                yield result
+        for partition in reversed(pending):
+            yield PartitionResult(partition, error="no worker process left")
+    finally:
+        for process, connection in workers:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process, _ in workers:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def _worker(connection, collect_partition: Callable[[Partition], PartitionResult]):
+    # drop what was inherited from the parent: its API counts, and clients
+    # whose connections it still owns
+    instrumentation.snapshot(reset=True)
+    clients.reset()
+    while True:
+        partition = connection.recv()
+        if partition is None:
+            break
+        result = _collect(collect_partition, partition)
+        result.instrumentation = instrumentation.snapshot(reset=True)
+        connection.send(result)
+    connection.close()
+
+
+def _collect(
+    collect_partition: Callable[[Partition], PartitionResult], partition: Partition
+) -> PartitionResult:
+    try:
+        return collect_partition(partition)
+    except Exception:
+        return PartitionResult(partition, error=traceback.format_exc())
+    finally:
+        clients.use_partition(None)
@@ -0,0 +1,39 @@
+from typing import Dict
+import json
+import os
+import threading
+
+# on-demand Linux prices shipped with the function; PRICE_CATALOG points at
+# another file in the same format to price other regions or instance types
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "prices.json")
+
+
+class PriceCatalog:
+    # hourly instance prices by region and instance type, read once from a
+    # local file like {"regions": {"us-east-1": {"m5.large": 0.096}}}
+    path: str
+
+    def __init__(self, path: str = None):
+        self.path = (
+            path if path is not None else os.getenv("PRICE_CATALOG", DEFAULT_PATH)
+        )
+        self._regions = None
+        self._lock = threading.Lock()
+
+    def prices(self, region: str) -> Dict[str, float]:
+        with self._lock:
+            if self._regions is None:
+                self._load()
+            return self._regions.get(region, {})
+
+    def _load(self):
+        self._regions = {}
+        try:
+            with open(self.path) as f:
+                self._regions = json.load(f)["regions"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{self.path} :: {e}")
+
+
+# shared by every rate index in the process that isn't given its own catalog
+default_catalog = PriceCatalog()
@@ -0,0 +1,155 @@
+from collections import Counter
+from typing import Dict, List
+import threading
+from . import clients
+from . import instance_specs
+from .cost_loader import ClusterInstanceType, FleetCostLoader
+from .instance_specs import InstanceSpecCatalog
+from .price_catalog import PriceCatalog, default_catalog as default_price_catalog
+
+LIST_CONTAINER_INSTANCES_PAGE_SIZE = 100
+DESCRIBE_CONTAINER_INSTANCES_BATCH_SIZE = 100
+RATE_SOURCES = ("live", "cost-explorer")
+
+
+class LiveRateIndex:
+    # prices the container instances registered to each cluster right now at
+    # the catalog's hourly rates, in place of FleetCostLoader. Cost explorer
+    # only calibrates: each cluster's rates are scaled by what its instances
+    # actually cost over the cost lookback (reservations, savings plans,
+    # spot) against the catalog. Instance types missing from the catalog
+    # are priced at their cost explorer rate, or left out without one. In
+    # regions the catalog has no prices for, clusters keep their cost
+    # explorer rates.
+    cost_loader: FleetCostLoader
+    price_catalog: PriceCatalog
+    spec_catalog: InstanceSpecCatalog
+    instances: int = 0
+    unpriced: int = 0
+    uncatalogued_clusters: int = 0
+
+    def __init__(
+        self,
+        cost_loader: FleetCostLoader = None,
+        price_catalog: PriceCatalog = None,
+        spec_catalog: InstanceSpecCatalog = None,
+    ):
+        self.cost_loader = cost_loader
+        self.price_catalog = (
+            price_catalog if price_catalog is not None else default_price_catalog
+        )
+        self.spec_catalog = (
+            spec_catalog
+            if spec_catalog is not None
+            else (
+                cost_loader.spec_catalog
+                if cost_loader is not None
+                else instance_specs.default_catalog
+            )
+        )
+        self.calibration: Dict[str, float] = {}
+        self._instance_types: Dict[str, List[ClusterInstanceType]] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.cost_loader is not None:
+            self.cost_loader.load()
+
+    def instance_types(self, cluster_name: str) -> List[ClusterInstanceType]:
+        with self._lock:
+            instance_types = self._instance_types.get(cluster_name)
+        if instance_types is None:
+            instance_types = self.refresh(cluster_name)
+        return instance_types
+
+    def refresh(self, cluster_name: str) -> List[ClusterInstanceType]:
+        # lists the cluster's instances again and reprices them
+        self.load()
+        ecs = clients.client("ecs")
+        prices = self.price_catalog.prices(ecs.meta.region_name)
+        billed = (
+            self.cost_loader.instance_types(cluster_name)
+            if self.cost_loader is not None
+            else []
+        )
+        if len(prices) == 0:
+            with self._lock:
+                self._instance_types[cluster_name] = billed
+                self.uncatalogued_clusters += 1
+            return billed
+        counts = self._count_instance_types(ecs, cluster_name)
+        factor = calibration(billed, prices)
+        billed_rates = {
+            it.instance_type_name: it.cost / it.usage for it in billed if it.usage > 0
+        }
+        specs = self.spec_catalog.specs(sorted(counts)) if len(counts) > 0 else {}
+
+        instance_types = []
+        unpriced = 0
+        for instance_type_name, count in sorted(counts.items()):
+            if instance_type_name in prices:
+                hourly = prices[instance_type_name] * factor
+            elif instance_type_name in billed_rates:
+                hourly = billed_rates[instance_type_name]
+            else:
+                unpriced += count
+                continue
+            vcpus, memory = specs.get(instance_type_name, (0, 0))
+            if vcpus == 0:
+                unpriced += count
+                continue
+            # an hour of the instances running now
+            instance_types.append(
+                ClusterInstanceType(
+                    instance_type_name=instance_type_name,
+                    cost=hourly * count,
+                    usage=count,
+                    vcpus=vcpus,
+                    memory=memory,
+                )
+            )
+
+        with self._lock:
+            self._instance_types[cluster_name] = instance_types
+            self.calibration[cluster_name] = factor
+            self.instances += sum(counts.values())
+            self.unpriced += unpriced
+        return instance_types
+
+    def _count_instance_types(self, ecs, cluster_name: str) -> Counter:
+        # pages of instance arns are described as they arrive, so only the
+        # counts per instance type are kept
+        counts = Counter()
+        paginator = ecs.get_paginator("list_container_instances")
+        for response in paginator.paginate(
+            cluster=cluster_name,
+            PaginationConfig={"PageSize": LIST_CONTAINER_INSTANCES_PAGE_SIZE},
+        ):
+            arns = response["containerInstanceArns"]
+            for i in range(0, len(arns), DESCRIBE_CONTAINER_INSTANCES_BATCH_SIZE):
+                described = ecs.describe_container_instances(
+                    cluster=cluster_name,
+                    containerInstances=arns[
+                        i : i + DESCRIBE_CONTAINER_INSTANCES_BATCH_SIZE
+                    ],
+                )
+                for instance in described["containerInstances"]:
+                    for attribute in instance.get("attributes", []):
+                        if attribute["name"] == "ecs.instance-type":
+                            counts[attribute["value"]] += 1
+                            break
+        return counts
+
+
+def calibration(billed: List[ClusterInstanceType], prices: Dict[str, float]) -> float:
+    # what the cluster's instances cost over the lookback, as a share of
+    # their catalog price, over the instance types the catalog knows
+    cost, listed = 0.0, 0.0
+    for it in billed:
+        price = prices.get(it.instance_type_name)
+        if price is not None:
+            cost += it.cost
+            listed += it.usage * price
+    if cost == 0 or listed == 0:
+        return 1.0
+    return cost / listed
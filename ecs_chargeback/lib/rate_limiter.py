@@ -0,0 +1,167 @@
+from typing import Dict, Tuple
+import functools
+import os
+import threading
+import time
+from .instrumentation import THROTTLE_CODES
+
+# (region, service, operation); the service is the one in botocore event
+# names, e.g. "ecs" or "cost-explorer"
+BucketKey = Tuple[str, str, str]
+
+
+class TokenBucket:
+    # paces calls to `rate` per second with bursts of up to a second's worth,
+    # and adapts the rate to throttling: multiplied by `decrease` when a call
+    # is throttled, at most once per cooldown so a burst of throttled calls
+    # in flight counts once, then raised by `increase` per second of
+    # successful calls, back up to the configured maximum
+    max_rate: float
+    min_rate: float
+    decrease: float
+    increase: float
+    cooldown: float
+    rate: float
+    throttles: int = 0
+    waited: float = 0
+
+    def __init__(
+        self,
+        max_rate: float,
+        min_rate: float = 0.5,
+        decrease: float = 0.7,
+        increase: float = 2.0,
+        cooldown: float = 1.0,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.decrease = decrease
+        self.increase = increase
+        self.cooldown = cooldown
+        self.rate = max_rate
+        self._tokens = max(1.0, max_rate)
+        self._updated_at = time.monotonic()
+        self._decreased_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # takes a token, sleeping until it is due; tokens go negative so that
+        # waiting callers queue up behind each other
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                max(1.0, self.rate),
+                self._tokens + (now - self._updated_at) * self.rate,
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._decreased_at < self.cooldown:
+                return
+            self._decreased_at = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+
+class RateLimiter:
+    # one token bucket per region and API, shared by every client and worker
+    # thread in the process. Tokens are taken per attempt, retries included,
+    # and botocore's own retries back off and retry throttled attempts.
+    default_rate: float
+    rates: Dict[str, float]
+    buckets: Dict[BucketKey, TokenBucket]
+
+    def __init__(self, default_rate: float = 50, rates: Dict[str, float] = None):
+        # rates are keyed by "service" or "service.Operation"
+        self.default_rate = default_rate
+        self.rates = rates if rates is not None else {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, region: str, service: str, operation: str) -> TokenBucket:
+        key = (region, service, operation)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    rate = self.rates.get(
+                        f"{service}.{operation}",
+                        self.rates.get(service, self.default_rate),
+                    )
+                    # a rate of 0 leaves the API unpaced
+                    bucket = self.buckets[key] = TokenBucket(
+                        rate if rate > 0 else float("inf")
+                    )
+        return bucket
+
+    def install(self, client):
+        region = client.meta.region_name
+        # first, so the token is taken before anything answers the request
+        client.meta.events.register_first(
+            "before-send", functools.partial(self._before_send, region)
+        )
+        client.meta.events.register(
+            "needs-retry", functools.partial(self._needs_retry, region)
+        )
+
+    def summary(self) -> str:
+        buckets = sorted(self.buckets.items())
+        slowed = ", ".join(
+            f"{service}.{operation}@{region} {bucket.rate:.1f}/s"
+            for (region, service, operation), bucket in buckets
+            if bucket.rate < bucket.max_rate
+        )
+        return (
+            f"{sum(bucket.throttles for _, bucket in buckets)} throttles, "
+            f"waited {sum(bucket.waited for _, bucket in buckets):.3f}s"
+            + (f", slowed {slowed}" if slowed != "" else "")
+        )
+
+    def _before_send(self, region, event_name, **kwargs):
+        _, service, operation = event_name.split(".")
+        self.bucket(region, service, operation).acquire()
+
+    def _needs_retry(self, region, event_name, response, **kwargs):
+        # returning None leaves the retry decision to botocore
+        if response is None:
+            return None
+        _, service, operation = event_name.split(".")
+        bucket = self.bucket(region, service, operation)
+        if response[1].get("Error", {}).get("Code") in THROTTLE_CODES:
+            bucket.throttled()
+        elif response[0].status_code < 300:
+            bucket.succeeded()
+        return None
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    # "ecs.DescribeServices=20,cost-explorer=5"
+    rates = {}
+    for item in value.split(","):
+        if item.strip() == "":
+            continue
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+# shared by every client created through lib.clients; AWS_RATE_LIMIT is the
+# requests per second of each API and region, AWS_RATE_LIMITS overrides it
+# per service or operation, and a rate of 0 turns pacing off
+limiter = RateLimiter(
+    default_rate=float(os.getenv("AWS_RATE_LIMIT", "50")),
+    rates=_parse_rates(os.getenv("AWS_RATE_LIMITS", "")),
+)
@@ -0,0 +1,68 @@
+from typing import Callable, Dict, List
+import json
+import botocore
+from . import clients
+
+
+class SchedulerState:
+    bucket: str
+    key: str
+    pending: List[str]
+    cluster_costs: Dict[str, float]
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+    ):
+        self.bucket = bucket
+        self.key = (
+            f"{prefix}/scheduler-state.json"
+            if prefix is not None
+            else "scheduler-state.json"
+        )
+        self.pending = []
+        self.cluster_costs = {}
+
+    def load(self):
+        if self.bucket is None:
+            return
+        s3 = clients.client("s3")
+        try:
+            body = s3.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return
+        state = json.loads(body.decode("utf-8"))
+        self.pending = state["pending"]
+        self.cluster_costs = state["cluster_costs"]
+
+    def save(self):
+        if self.bucket is None:
+            return
+        s3 = clients.client("s3")
+        s3.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=json.dumps(
+                {"pending": self.pending, "cluster_costs": self.cluster_costs}
+            ),
+        )
+
+    def order(self, cluster_names: List[str]) -> List[str]:
+        # clusters left over from the last run go first, then the most
+        # expensive clusters so the metrics that matter most land early
+        carried_over = [name for name in self.pending if name in cluster_names]
+        rest = sorted(
+            (name for name in cluster_names if name not in carried_over),
+            key=lambda name: -self.cluster_costs.get(name, 0),
+        )
+        return carried_over + rest
+
+
+def lambda_time_remaining(context, safety_margin: float = 10) -> Callable[[], float]:
+    get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining_time is None:
+        return None
+    return lambda: get_remaining_time() / 1000 - safety_margin
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from typing import Dict, List
+import hashlib
+from .object_cache import ObjectCache
+
+
+class _SentSeries:
+    # what was sent for one cluster before this run, and what will have been
+    # once this run's series are submitted
+    def __init__(self, previous: Dict[str, list]):
+        self.previous = previous
+        self.next: Dict[str, list] = {}
+
+
+class SeriesFilter:
+    # remembers the last value sent for each series of a cluster's services,
+    # kept in S3 like the utilization sketches, so a series whose value has
+    # not changed is only sent again once heartbeat has passed since it last
+    # was. Snapshots look like {"sent": {series hash: [value, epoch seconds]}}
+    # and only keep the series handled in the last run.
+    heartbeat: timedelta
+    bucket: str
+    prefix: str
+    object_cache: ObjectCache
+    emitted: int = 0
+    suppressed: int = 0
+
+    def __init__(
+        self,
+        heartbeat: timedelta,
+        bucket: str = None,
+        prefix: str = None,
+        object_cache: ObjectCache = None,
+    ):
+        self.heartbeat = heartbeat
+        self.bucket = bucket
+        self.prefix = prefix
+        # a cluster may be collected by another container next time, so
+        # every read revalidates
+        self.object_cache = (
+            object_cache
+            if object_cache is not None
+            else ObjectCache(max_entries=1024, ttl=timedelta(0))
+        )
+        self._pending: Dict[str, _SentSeries] = {}
+
+    def key(self, cluster: str, account: str = None, region: str = None) -> str:
+        parts = [] if self.prefix is None else [self.prefix]
+        if account is not None:
+            parts.extend(["accounts", account])
+        if region is not None:
+            parts.append(region)
+        return "/".join(parts + ["series", f"{cluster}.json"])
+
+    def keep(self, key: str, metric: str, tags: List[str], value, now: int) -> bool:
+        # whether the series has to be sent, recording it as sent if so
+        sent = self._pending.get(key)
+        if sent is None:
+            snapshot = self.object_cache.get(self.bucket, key)
+            sent = self._pending[key] = _SentSeries(
+                snapshot["sent"] if snapshot is not None else {}
+            )
+        series = _series_hash(metric, tags)
+        last = sent.previous.get(series)
+        if (
+            last is not None
+            and last[0] == value
+            and now - last[1] < self.heartbeat.total_seconds()
+        ):
+            sent.next[series] = last
+            self.suppressed += 1
+            return False
+        sent.next[series] = [value, now]
+        self.emitted += 1
+        return True
+
+    def commit(self):
+        # once the kept series were submitted; clusters whose series all
+        # went unchanged and are still the same ones are not written again
+        for key, sent in self._pending.items():
+            if sent.next != sent.previous:
+                self.object_cache.put(self.bucket, key, {"sent": sent.next})
+        self._pending.clear()
+
+    def discard(self):
+        # when submitting failed, so everything is sent again next time
+        self._pending.clear()
+
+    def reset_counts(self):
+        self.emitted, self.suppressed = 0, 0
+
+
+def _series_hash(metric: str, tags: List[str]) -> str:
+    name = "\0".join([metric] + sorted(tags)).encode("utf-8")
+    return hashlib.blake2b(name, digest_size=8).hexdigest()
@@ -1,27 +1,180 @@
-from dataclasses import dataclass, field
-from typing import List, Mapping
+from array import array
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+import sys
 
 
-@dataclass
 class Service:
-    name: str
-    task_count: int
-    task_cpu_reservation: int = 0
-    task_memory_reservation: int = 0
-    cpu_utilization: float = 0
-    memory_utilization: float = 0
-    tags: List[Mapping[str, str]] = field(default_factory=list)
+    __slots__ = (
+        "name",
+        "task_count",
+        "task_cpu_reservation",
+        "task_memory_reservation",
+        "cpu_utilization",
+        "memory_utilization",
+        "fargate",
+        "tags",
+        "cluster",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        task_count: int,
+        task_cpu_reservation: float = 0,
+        task_memory_reservation: float = 0,
+        cpu_utilization: float = 0,
+        memory_utilization: float = 0,
+        fargate: bool = False,
+        tags: List[Mapping[str, str]] = None,
+        cluster: str = None,
+    ):
+        self.name = name
+        self.task_count = task_count
+        self.task_cpu_reservation = task_cpu_reservation
+        self.task_memory_reservation = task_memory_reservation
+        self.cpu_utilization = cpu_utilization
+        self.memory_utilization = memory_utilization
+        self.fargate = fargate
+        self.tags = [] if tags is None else tags
+        self.cluster = cluster
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"Service({fields})"
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
 
     @property
-    def cpu_reservation(self) -> int:
+    def cpu_reservation(self) -> float:
         return self.task_count * self.task_cpu_reservation
 
     @property
-    def memory_reservation(self) -> int:
+    def memory_reservation(self) -> float:
         return self.task_count * self.task_memory_reservation
 
     @property
-    def memory_per_vcpu(self) -> int:
+    def memory_per_vcpu(self) -> float:
         if self.task_cpu_reservation == 0:
             return 0
         return 1024 * self.task_memory_reservation / self.task_cpu_reservation
+
+
+class TagPool:
+    # interns ECS tags, so every service carrying the same key/value shares
+    # one id and one tag dict
+    def __init__(self):
+        self.tags: List[Mapping[str, str]] = []
+        self._ids: Dict[Tuple[str, str], int] = {}
+
+    def intern(self, tag: Mapping[str, str]) -> int:
+        key = (tag["key"], tag["value"])
+        tag_id = self._ids.get(key)
+        if tag_id is None:
+            tag_id = len(self.tags)
+            self.tags.append({"key": sys.intern(key[0]), "value": key[1]})
+            self._ids[key] = tag_id
+        return tag_id
+
+
+class ServiceTable:
+    # column store for the services of one or more clusters: numeric fields
+    # live in typed arrays, tags are interned ids and rows are found by
+    # cluster and name, as service names are only unique within a cluster.
+    # Iterating yields Service records built from the rows.
+    def __init__(self, services: Iterable[Service] = (), tag_pool: TagPool = None):
+        self.names: List[str] = []
+        self.clusters: List[Optional[str]] = []
+        self.task_count = array("q")
+        # per task reservations are averages over the running tasks, which
+        # differ while a service deploys a new task definition
+        self.task_cpu_reservation = array("d")
+        self.task_memory_reservation = array("d")
+        self.cpu_utilization = array("d")
+        self.memory_utilization = array("d")
+        self.fargate = array("b")
+        self.tag_pool = TagPool() if tag_pool is None else tag_pool
+        self._tag_ids = array("I")
+        self._tag_offsets = array("I", [0])
+        self._index: Dict[Tuple[Optional[str], str], int] = {}
+        self.extend(services)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[Service]:
+        for i in range(len(self.names)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> Service:
+        return Service(
+            name=self.names[i],
+            task_count=self.task_count[i],
+            task_cpu_reservation=self.task_cpu_reservation[i],
+            task_memory_reservation=self.task_memory_reservation[i],
+            cpu_utilization=self.cpu_utilization[i],
+            memory_utilization=self.memory_utilization[i],
+            fargate=bool(self.fargate[i]),
+            tags=self.tags(i),
+            cluster=self.clusters[i],
+        )
+
+    def append(
+        self,
+        name: str,
+        task_count: int,
+        task_cpu_reservation: float = 0,
+        task_memory_reservation: float = 0,
+        cpu_utilization: float = 0,
+        memory_utilization: float = 0,
+        fargate: bool = False,
+        tags: Iterable[Mapping[str, str]] = (),
+        cluster: str = None,
+    ) -> int:
+        i = len(self.names)
+        self.names.append(name)
+        self.clusters.append(cluster)
+        self._index[(cluster, name)] = i
+        self.task_count.append(task_count)
+        self.task_cpu_reservation.append(task_cpu_reservation)
+        self.task_memory_reservation.append(task_memory_reservation)
+        self.cpu_utilization.append(cpu_utilization)
+        self.memory_utilization.append(memory_utilization)
+        self.fargate.append(fargate)
+        self._tag_ids.extend(self.tag_pool.intern(tag) for tag in tags)
+        self._tag_offsets.append(len(self._tag_ids))
+        return i
+
+    def extend(self, services: Iterable[Service]):
+        for service in services:
+            self.append(
+                name=service.name,
+                task_count=service.task_count,
+                task_cpu_reservation=service.task_cpu_reservation,
+                task_memory_reservation=service.task_memory_reservation,
+                cpu_utilization=service.cpu_utilization,
+                memory_utilization=service.memory_utilization,
+                fargate=service.fargate,
+                tags=service.tags,
+                cluster=service.cluster,
+            )
+
+    def index(self, name: str, cluster: str = None) -> Optional[int]:
+        return self._index.get((cluster, name))
+
+    def get(self, name: str, cluster: str = None) -> Optional[Service]:
+        i = self._index.get((cluster, name))
+        if i is None:
+            return None
+        return self[i]
+
+    def tags(self, i: int) -> List[Mapping[str, str]]:
+        tags = self.tag_pool.tags
+        return [
+            tags[tag_id]
+            for tag_id in self._tag_ids[self._tag_offsets[i] : self._tag_offsets[i + 1]]
+        ]
@@ -0,0 +1,74 @@
+from typing import List, Mapping
+
+
+class Sink:
+    # where collected chargeback goes; a sink may buffer until flush
+    # account and region are set when collecting from several of them
+    def handle_service(
+        self,
+        cluster: str,
+        service: str,
+        tags: List[Mapping[str, str]],
+        cpu_reservation: float,
+        memory_reservation: float,
+        hourly_cost: float,
+        hourly_waste: float,
+        account: str = None,
+        region: str = None,
+    ):
+        pass
+
+    def handle_cluster(
+        self,
+        cluster: str,
+        collection_seconds: float,
+        account: str = None,
+        region: str = None,
+    ):
+        pass
+
+    def flush(self):
+        pass
+
+
+class MultiSink(Sink):
+    def __init__(self, sinks: List[Sink]):
+        self.sinks = sinks
+
+    def handle_service(self, **kwargs):
+        for sink in self.sinks:
+            sink.handle_service(**kwargs)
+
+    def handle_cluster(self, **kwargs):
+        for sink in self.sinks:
+            sink.handle_cluster(**kwargs)
+
+    def flush(self):
+        # every sink is flushed even if one fails; the first failure is
+        # raised after
+        error = None
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+
+class BufferedSink(Sink):
+    # keeps what it is handed, e.g. to pass it from a worker process to the
+    # sinks of the parent
+    def __init__(self):
+        self.calls = []
+
+    def handle_service(self, **kwargs):
+        self.calls.append(("handle_service", kwargs))
+
+    def handle_cluster(self, **kwargs):
+        self.calls.append(("handle_cluster", kwargs))
+
+    def replay(self, sink: Sink, **kwargs):
+        for method, call_kwargs in self.calls:
+            getattr(sink, method)(**call_kwargs, **kwargs)
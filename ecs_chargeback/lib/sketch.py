@@ -0,0 +1,91 @@
+from typing import Dict
+import math
+
+# weights below this are dropped when a sketch decays
+MIN_WEIGHT = 0.001
+
+
+class QuantileSketch:
+    # streaming quantiles with relative accuracy, in the style of DDSketch:
+    # values land in logarithmic bins, so any quantile is within
+    # relative_accuracy of a value that was added, and sketches of the same
+    # accuracy merge by adding their bins. Weights are floats so older
+    # values can be decayed away. Values below min_value count as zero.
+    relative_accuracy: float
+    min_value: float
+    zeros: float
+    bins: Dict[int, float]
+
+    def __init__(self, relative_accuracy: float = 0.02, min_value: float = 0.1):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.zeros = 0.0
+        self.bins = {}
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    @property
+    def count(self) -> float:
+        return self.zeros + sum(self.bins.values())
+
+    def add(self, value: float, weight: float = 1.0):
+        if value < self.min_value:
+            self.zeros += weight
+            return
+        i = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[i] = self.bins.get(i, 0.0) + weight
+
+    def merge(self, other: "QuantileSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("sketches of different accuracy do not merge")
+        self.zeros += other.zeros
+        for i, weight in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0.0) + weight
+
+    def decay(self, factor: float):
+        self.zeros *= factor
+        self.bins = {
+            i: weight * factor
+            for i, weight in self.bins.items()
+            if weight * factor >= MIN_WEIGHT
+        }
+
+    def quantile(self, q: float) -> float:
+        # 0 for an empty sketch
+        rank = q * self.count
+        seen = self.zeros
+        if rank < seen or len(self.bins) == 0:
+            return 0.0
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if seen > rank:
+                break
+        # the middle of the bin, in relative terms
+        return 2 * self._gamma**i / (self._gamma + 1)
+
+    def to_dict(self) -> dict:
+        # bins are stored densely from the lowest one
+        if len(self.bins) == 0:
+            return {"zeros": self.zeros, "offset": 0, "bins": []}
+        offset = min(self.bins)
+        return {
+            "zeros": round(self.zeros, 4),
+            "offset": offset,
+            "bins": [
+                round(self.bins.get(i, 0.0), 4)
+                for i in range(offset, max(self.bins) + 1)
+            ],
+        }
+
+    @classmethod
+    def from_dict(
+        cls, state: dict, relative_accuracy: float = 0.02, min_value: float = 0.1
+    ) -> "QuantileSketch":
+        sketch = cls(relative_accuracy, min_value)
+        sketch.zeros = state["zeros"]
+        sketch.bins = {
+            state["offset"] + n: weight
+            for n, weight in enumerate(state["bins"])
+            if weight > 0
+        }
+        return sketch
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from .object_cache import ObjectCache
+from .sketch import QuantileSketch
+
+UTILIZATION_ATTRIBUTES = ("cpu_utilization", "memory_utilization")
+
+
+class ClusterUtilization:
+    # decaying quantile sketches of one cluster's service utilization and
+    # how far the datapoints behind them reach
+    fetched_until: Optional[datetime]
+    sketches: Dict[Tuple[str, str], QuantileSketch]
+
+    def __init__(self, fetched_until: datetime = None):
+        self.fetched_until = fetched_until
+        self.sketches = {}
+
+    def sketch(self, service_name: str, attribute: str) -> QuantileSketch:
+        key = (service_name, attribute)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = QuantileSketch()
+        return sketch
+
+
+class UtilizationStore:
+    # per-cluster utilization sketches kept in S3 like the service inventory,
+    # so each run only fetches the datapoints since the previous one. Points
+    # are weighted by 0.5 ** (age / half_life), which makes a quantile cover
+    # roughly the last few half lives. Snapshots look like
+    # {"fetched_until": iso, "services": {name: {attribute: sketch}}}.
+    bucket: str
+    prefix: str
+    percentile: float
+    half_life: timedelta
+    initial_lookback: timedelta
+    object_cache: ObjectCache
+
+    def __init__(
+        self,
+        bucket: str = None,
+        prefix: str = None,
+        percentile: float = 95,
+        half_life: timedelta = timedelta(hours=24),
+        initial_lookback: timedelta = timedelta(hours=3),
+        object_cache: ObjectCache = None,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.percentile = percentile
+        self.half_life = half_life
+        self.initial_lookback = initial_lookback
+        # a cluster may be collected by another container next time, so
+        # every read revalidates
+        self.object_cache = (
+            object_cache
+            if object_cache is not None
+            else ObjectCache(max_entries=1024, ttl=timedelta(0))
+        )
+
+    def key(self, cluster_name: str) -> str:
+        if self.prefix is None:
+            return f"utilization/{cluster_name}.json"
+        return f"{self.prefix}/utilization/{cluster_name}.json"
+
+    def load(self, cluster_name: str) -> ClusterUtilization:
+        snapshot = self.object_cache.get(self.bucket, self.key(cluster_name))
+        if snapshot is None:
+            return ClusterUtilization()
+        state = ClusterUtilization(datetime.fromisoformat(snapshot["fetched_until"]))
+        for service_name, sketches in snapshot["services"].items():
+            for attribute, sketch in sketches.items():
+                state.sketches[(service_name, attribute)] = QuantileSketch.from_dict(
+                    sketch
+                )
+        return state
+
+    def save(
+        self, cluster_name: str, state: ClusterUtilization, service_names: List[str]
+    ):
+        # services that are gone are dropped with their sketches
+        services: Dict[str, dict] = {name: {} for name in service_names}
+        for (service_name, attribute), sketch in state.sketches.items():
+            if service_name in services:
+                services[service_name][attribute] = sketch.to_dict()
+        self.object_cache.put(
+            self.bucket,
+            self.key(cluster_name),
+            {"fetched_until": state.fetched_until.isoformat(), "services": services},
+        )
+
+    def fetch_start(self, state: ClusterUtilization, end: datetime) -> datetime:
+        # after a long gap only the last initial_lookback is worth fetching
+        start = end - self.initial_lookback
+        if state.fetched_until is not None and state.fetched_until > start:
+            return state.fetched_until
+        return start
+
+    def add(
+        self,
+        state: ClusterUtilization,
+        service_name: str,
+        attribute: str,
+        end: datetime,
+        timestamps: Iterable[datetime],
+        values: Iterable[float],
+    ):
+        # the points of one series, weighted by their age at end
+        new = QuantileSketch()
+        for timestamp, value in zip(timestamps, values):
+            new.add(value, self.weight(end - timestamp))
+        state.sketch(service_name, attribute).merge(new)
+
+    def advance(self, state: ClusterUtilization, end: datetime):
+        # ages the existing sketches to end, before new points are added
+        if state.fetched_until is not None:
+            factor = self.weight(end - state.fetched_until)
+            for sketch in state.sketches.values():
+                sketch.decay(factor)
+        state.fetched_until = end
+
+    def weight(self, age: timedelta) -> float:
+        return 0.5 ** (age / self.half_life)
+
+    def utilization(
+        self, state: ClusterUtilization, service_name: str, attribute: str
+    ) -> float:
+        sketch = state.sketches.get((service_name, attribute))
+        if sketch is None:
+            return 0.0
+        return sketch.quantile(self.percentile / 100)
@@ -1,36 +1,227 @@
 #!/usr/bin/env python3
 
 from tabulate import tabulate
-from lib.cluster import Cluster
+from lib import clients
+from lib.backfill import Backfill, BackfillCheckpoint
+from lib.cluster import RESERVATION_SOURCES, Cluster
+from lib.columnar_sink import FORMATS, ColumnarSink
+from lib.collector import collect, default_workers, list_cluster_names
+from lib.cost_cache import DailyCostCache
 from lib.cost_calculator import ClusterCostCalculator
-from datetime import timedelta
+from lib.cost_loader import FleetCostLoader
+from lib.daemon import Daemon
+from lib.instance_specs import InstanceSpecCatalog
+from lib.instrumentation import instrumentation
+from lib.object_cache import default_cache
+from lib.rate_index import RATE_SOURCES, LiveRateIndex
+from lib.rate_limiter import limiter
+from lib.service import TagPool
+from lib.utilization import UtilizationStore
+from datetime import date, datetime, time, timedelta, timezone
+import argparse
 import boto3
+import os
+import sys
 
 
 def main():
-    ecs = boto3.client("ecs")
-    clusterArns = ecs.list_clusters()["clusterArns"]
-    for clusterArn in clusterArns:
-        cluster_name = clusterArn.split("/")[1]
-        cluster = Cluster(
+    parser = argparse.ArgumentParser(description="Print ECS service chargeback.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=default_workers(),
+        help="number of clusters to collect concurrently",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="record every AWS call and response to PATH for replaying offline",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="LOCATION",
+        help="also write the rows as files partitioned by date and cluster "
+        "under a local directory or s3://bucket/prefix",
+    )
+    parser.add_argument(
+        "--export-format", choices=FORMATS, default="csv.gz", help="file format"
+    )
+    parser.add_argument(
+        "--utilization-percentile",
+        type=float,
+        help="compute waste on this percentile of the last few hours of "
+        "utilization instead of the peak of the last five minutes",
+    )
+    parser.add_argument(
+        "--container-insights",
+        action="store_true",
+        help="take utilization from Container Insights",
+    )
+    parser.add_argument(
+        "--reservation-source",
+        choices=RESERVATION_SOURCES,
+        default="tasks",
+        help="sum the reservations of running tasks, or multiply running "
+        "counts by the service's task definition",
+    )
+    parser.add_argument(
+        "--rate-source",
+        choices=RATE_SOURCES,
+        default="cost-explorer",
+        help="price the container instances running now at catalog prices "
+        "calibrated by cost explorer, or take rates from cost explorer alone",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    backfill_parser = subparsers.add_parser(
+        "backfill",
+        help="write per-window chargeback for a past date range to a CSV file",
+    )
+    backfill_parser.add_argument(
+        "--start", type=date.fromisoformat, required=True, help="first day, UTC"
+    )
+    backfill_parser.add_argument(
+        "--end", type=date.fromisoformat, required=True, help="day after the last, UTC"
+    )
+    backfill_parser.add_argument(
+        "--window-hours",
+        type=int,
+        default=24,
+        help="length of each window; utilization is averaged over it",
+    )
+    backfill_parser.add_argument(
+        "--chunk-windows",
+        type=int,
+        default=30,
+        help="windows fetched per GetMetricData pass, which bounds memory",
+    )
+    backfill_parser.add_argument("--clusters", nargs="+", help="defaults to all")
+    backfill_parser.add_argument("--output", metavar="PATH", required=True)
+    backfill_parser.add_argument(
+        "--checkpoint",
+        metavar="PATH",
+        help="where progress is kept to resume from, defaults to PATH.checkpoint",
+    )
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="keep refreshing chargeback in memory and serve it as JSON over HTTP",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument(
+        "--services-interval",
+        type=float,
+        default=60,
+        help="seconds between listings of clusters, services and tasks",
+    )
+    serve_parser.add_argument(
+        "--utilization-interval",
+        type=float,
+        default=60,
+        help="seconds between utilization refreshes",
+    )
+    serve_parser.add_argument(
+        "--costs-interval",
+        type=float,
+        default=3600,
+        help="seconds between cost refreshes; settled days are never fetched again",
+    )
+    serve_parser.add_argument(
+        "--cache-bucket",
+        default=os.getenv("CACHE_BUCKET"),
+        help="share the lambda's cost cache in this bucket instead of "
+        "keeping costs in memory only",
+    )
+    args = parser.parse_args()
+
+    recorder = None
+    if args.record is not None:
+        # the recorder is benchmark tooling, kept out of the lambda asset
+        sys.path.insert(
+            0,
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "benchmarks",
+            ),
+        )
+        from replay import Recorder
+
+        session = boto3.session.Session()
+        recorder = Recorder(session)
+        clients.configure(session)
+
+    if args.command == "backfill":
+        backfill(args)
+        if recorder is not None:
+            recorder.save(args.record)
+        return
+    if args.command == "serve":
+        serve(args)
+        return
+
+    cluster_names = list_cluster_names()
+    spec_catalog = InstanceSpecCatalog()
+    task_definitions = {}
+    tag_pool = TagPool()
+    utilization_store = (
+        UtilizationStore(percentile=args.utilization_percentile)
+        if args.utilization_percentile is not None
+        else None
+    )
+    cost_loader = FleetCostLoader(
+        cluster_tag="cluster",
+        cost_lookback=timedelta(days=3),
+        cost_cache=DailyCostCache(bucket=None, prefix=None, ttl=timedelta(days=1)),
+        spec_catalog=spec_catalog,
+    )
+    if args.rate_source == "live":
+        cost_loader = LiveRateIndex(cost_loader=cost_loader, spec_catalog=spec_catalog)
+
+    export = (
+        ColumnarSink(location=args.export, format=args.export_format)
+        if args.export is not None
+        else None
+    )
+
+    def new_cluster(cluster_name):
+        return Cluster(
             name=cluster_name,
+            task_definitions=task_definitions,
+            tag_pool=tag_pool,
             utilization_lookback=timedelta(minutes=5),
             utilization_period=60,
             utilization_stat="Average",
+            reservation_source=args.reservation_source,
+            utilization_store=utilization_store,
+            container_insights=args.container_insights,
         )
 
-        if len(cluster.services) == 0:
-            continue
-
-        cluster_calculator = ClusterCostCalculator(
+    def new_calculator(cluster_name):
+        return ClusterCostCalculator(
             name=cluster_name,
-            cluster_tag="cluster",
-            cost_lookback=timedelta(days=3),
-            cache_bucket=None,
-            cache_prefix=None,
-            cache_ttl=timedelta(days=1),
+            cost_loader=cost_loader,
         )
 
+    for collection in collect(
+        cluster_names, new_cluster, new_calculator, workers=args.workers
+    ):
+        if collection.calculator is None:
+            continue
+
+        cluster, cluster_calculator = collection.cluster, collection.calculator
+        costs, wastes = cluster_calculator.hourly_service_costs(cluster.services)
+        if export is not None:
+            for service, cost, waste in zip(
+                cluster.services, costs.tolist(), wastes.tolist()
+            ):
+                export.handle_service(
+                    cluster=cluster.name,
+                    service=service.name,
+                    tags=service.tags,
+                    cpu_reservation=service.cpu_reservation,
+                    memory_reservation=service.memory_reservation,
+                    hourly_cost=cost,
+                    hourly_waste=waste,
+                )
         services_table = [
             [
                 service.name,
@@ -39,14 +230,15 @@ def main():
                 service.memory_reservation,
                 service.memory_utilization,
                 service.memory_per_vcpu,
-                cluster_calculator.hourly_service_reservation_cost(service),
-                cluster_calculator.hourly_service_reservation_cost(service)
-                - cluster_calculator.hourly_service_utilization_cost(service),
+                cost,
+                waste,
             ]
-            for service in cluster.services
+            for service, cost, waste in zip(
+                cluster.services, costs.tolist(), wastes.tolist()
+            )
         ]
         print(
-            f"\n\nCLUSTER: {cluster.name} (cost/vcpu:{(cluster_calculator.hourly_vcpu_cost):.2f} mem/vcpu:{cluster_calculator.memory_per_vcpu:.0f}) \n"
+            f"\n\nCLUSTER: {cluster.name} (cost/vcpu:{(cluster_calculator.hourly_vcpu_cost):.2f} mem/vcpu:{cluster_calculator.memory_per_vcpu:.0f} api calls:{cluster.api_calls}) \n"
         )
         print(
             tabulate(
@@ -64,6 +256,142 @@ def main():
             )
         )
 
+    if recorder is not None:
+        recorder.save(args.record)
+
+    operations, clusters = instrumentation.snapshot()
+    print("\n\nAPI CALLS\n")
+    print(
+        tabulate(
+            [
+                [service, operation] + instrumentation_columns(stats)
+                for (service, operation), stats in sorted(operations.items())
+            ]
+            + [
+                [f"cluster:{cluster}", "*"] + instrumentation_columns(stats)
+                for cluster, stats in sorted(clusters.items())
+            ],
+            headers=[
+                "Service",
+                "Operation",
+                "Calls",
+                "Errors",
+                "Retries",
+                "Throttles",
+                "KiB",
+                "Total (s)",
+                "Avg (ms)",
+                "p95 (ms)",
+            ],
+        )
+    )
+
+    print(
+        f"\ninstance type catalog: {spec_catalog.hits} hits, "
+        f"{spec_catalog.misses} misses"
+    )
+    print(f"object cache: {default_cache.stats.summary()}")
+    print(f"rate limiter: {limiter.summary()}")
+    if isinstance(cost_loader, LiveRateIndex):
+        print(
+            f"live rates: {cost_loader.instances} instances, "
+            f"{cost_loader.unpriced} unpriced, {cost_loader.uncatalogued_clusters} "
+            "clusters in regions without catalog prices"
+        )
+    if export is not None:
+        # one file per partition for the whole run
+        export.flush()
+        print(f"export: {export.rows} rows in {export.files} files")
+
+
+def backfill(args):
+    checkpoint = BackfillCheckpoint(
+        args.checkpoint if args.checkpoint is not None else f"{args.output}.checkpoint"
+    )
+    job = Backfill(
+        cluster_names=(
+            args.clusters if args.clusters is not None else list_cluster_names()
+        ),
+        start=datetime.combine(args.start, time(), tzinfo=timezone.utc),
+        end=datetime.combine(args.end, time(), tzinfo=timezone.utc),
+        window=timedelta(hours=args.window_hours),
+        chunk_windows=args.chunk_windows,
+        spec_catalog=InstanceSpecCatalog(),
+        reservation_source=args.reservation_source,
+    )
+    # opened for update so a resumed backfill can cut off rows written after
+    # its checkpoint
+    mode = "r+" if os.path.exists(args.output) else "w"
+    with open(args.output, mode, newline="") as output:
+        job.run(output, checkpoint)
+    print(f"wrote {job.rows} rows to {args.output}")
+
+
+def serve(args):
+    spec_catalog = InstanceSpecCatalog()
+    task_definitions = {}
+    tag_pool = TagPool()
+    utilization_store = (
+        UtilizationStore(percentile=args.utilization_percentile)
+        if args.utilization_percentile is not None
+        else None
+    )
+    # one cost cache for the life of the process; unsettled days are fetched
+    # again once per cost refresh. Keyed by region like the lambda's
+    region = clients.client("ecs").meta.region_name
+    cost_cache = DailyCostCache(
+        bucket=args.cache_bucket,
+        prefix=os.getenv("CACHE_PREFIX", None),
+        ttl=timedelta(seconds=args.costs_interval),
+        name=f"{region}/costs",
+    )
+
+    def new_cluster(cluster_name):
+        return Cluster(
+            name=cluster_name,
+            task_definitions=task_definitions,
+            tag_pool=tag_pool,
+            reservation_source=args.reservation_source,
+            utilization_store=utilization_store,
+            container_insights=args.container_insights,
+        )
+
+    def new_cost_loader():
+        cost_loader = FleetCostLoader(
+            cluster_tag="cluster",
+            cost_lookback=timedelta(days=3),
+            cost_cache=cost_cache,
+            spec_catalog=spec_catalog,
+            region=region,
+        )
+        if args.rate_source == "cost-explorer":
+            return cost_loader
+        return LiveRateIndex(cost_loader=cost_loader, spec_catalog=spec_catalog)
+
+    daemon = Daemon(
+        new_cluster,
+        new_cost_loader,
+        services_interval=args.services_interval,
+        utilization_interval=args.utilization_interval,
+        costs_interval=args.costs_interval,
+        workers=args.workers,
+    )
+    daemon.start()
+    daemon.serve(args.host, args.port)
+
+
+def instrumentation_columns(stats):
+    return [
+        stats.calls,
+        stats.errors,
+        stats.retries,
+        stats.throttles,
+        stats.bytes / 1024,
+        stats.seconds,
+        1000 * stats.seconds / max(1, stats.calls),
+        stats.latency_quantile(0.95),
+    ]
+
 
 if __name__ == "__main__":
     main()
@@ -9,6 +9,7 @@ from aws_cdk import (
     aws_events,
     aws_events_targets,
     aws_s3,
+    aws_sqs,
     aws_iam,
 )
 
@@ -27,7 +28,18 @@ class ChargebackStack(cdk.Stack):
         dd_api_key_secret_id: str,
         dd_api_key_secret_field: str = "api_key",
         bucket_name: str = None,
-        **kwargs
+        collector_workers: int = 8,
+        fanout_shard_size: int = 0,
+        inventory_reconcile_mins: int = 0,
+        export_format: str = "",
+        collection_accounts: str = "",
+        collection_regions: str = "",
+        collection_role_name: str = "ecs-chargeback",
+        utilization_percentile: str = "",
+        container_insights: bool = False,
+        datadog_heartbeat_mins: str = "",
+        datadog_rollup_tags: str = "",
+        **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
 
@@ -56,9 +68,71 @@ class ChargebackStack(cdk.Stack):
                 "COST_LOOKBACK_DAYS": str(cost_lookback_days),
                 "DATADOG_API_KEY": datadog_api_key.to_string(),
                 "DATADOG_METRIC_PREFIX": datadog_metric_prefix,
+                "COLLECTOR_WORKERS": str(collector_workers),
+                "FANOUT_SHARD_SIZE": str(fanout_shard_size),
             },
             timeout=cdk.Duration.seconds(60),
         )
+
+        if export_format != "":
+            chargeback.add_environment(
+                "EXPORT_LOCATION", f"s3://{cache_bucket.bucket_name}/exports"
+            )
+            chargeback.add_environment("EXPORT_FORMAT", export_format)
+
+        if utilization_percentile != "":
+            chargeback.add_environment("UTILIZATION_PERCENTILE", utilization_percentile)
+        if container_insights:
+            chargeback.add_environment("CONTAINER_INSIGHTS", "true")
+        if datadog_heartbeat_mins != "":
+            chargeback.add_environment("DATADOG_HEARTBEAT_MINS", datadog_heartbeat_mins)
+        if datadog_rollup_tags != "":
+            chargeback.add_environment("DATADOG_ROLLUP_TAGS", datadog_rollup_tags)
+
+        if collection_accounts != "":
+            # the role must exist in every account, trusting this function's
+            # role and allowed to list, describe and read costs and metrics
+            accounts = collection_accounts.split(",")
+            chargeback.add_environment("COLLECTION_ACCOUNTS", collection_accounts)
+            chargeback.add_environment("COLLECTION_ROLE_NAME", collection_role_name)
+            if collection_regions != "":
+                chargeback.add_environment("COLLECTION_REGIONS", collection_regions)
+            chargeback.add_to_role_policy(
+                aws_iam.PolicyStatement(
+                    actions=["sts:AssumeRole"],
+                    resources=[
+                        f"arn:aws:iam::{account}:role/{collection_role_name}"
+                        for account in accounts
+                    ],
+                )
+            )
+
+        if inventory_reconcile_mins > 0:
+            # ECS service, deployment and task events mark services for the
+            # next run to describe again, instead of re-listing every run
+            inventory_queue = aws_sqs.Queue(
+                self,
+                "ChargebackInventoryQueue",
+                retention_period=cdk.Duration.days(1),
+            )
+            aws_events.Rule(
+                self,
+                "ChargebackInventoryRule",
+                event_pattern=aws_events.EventPattern(
+                    source=["aws.ecs"],
+                    detail_type=[
+                        "ECS Service Action",
+                        "ECS Deployment State Change",
+                        "ECS Task State Change",
+                    ],
+                ),
+                targets=[aws_events_targets.SqsQueue(inventory_queue)],
+            )
+            inventory_queue.grant_consume_messages(chargeback.role)
+            chargeback.add_environment("INVENTORY_QUEUE_URL", inventory_queue.queue_url)
+            chargeback.add_environment(
+                "INVENTORY_RECONCILE_MINS", str(inventory_reconcile_mins)
+            )
         chargeback.add_to_role_policy(
             aws_iam.PolicyStatement(
                 actions=[
@@ -66,7 +140,10 @@ class ChargebackStack(cdk.Stack):
                     "ecs:ListServices",
                     "ecs:DescribeServices",
                     "ecs:DescribeTaskDefinition",
-                    "ecs:ListTagsForResource",
+                    "ecs:ListTasks",
+                    "ecs:DescribeTasks",
+                    "ecs:ListContainerInstances",
+                    "ecs:DescribeContainerInstances",
                     "cloudwatch:GetMetricData",
                     "ec2:DescribeInstanceTypes",
                     "ce:GetCostAndUsage",
@@ -75,6 +152,24 @@ class ChargebackStack(cdk.Stack):
             )
         )
 
+        if fanout_shard_size > 0:
+            # in fan-out mode the function invokes itself with a shard of
+            # clusters; granting on the function itself would be a circular
+            # dependency, so the arn is matched by the name cdk generates for it
+            chargeback.add_to_role_policy(
+                aws_iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[
+                        self.format_arn(
+                            service="lambda",
+                            resource="function",
+                            resource_name=f"{self.stack_name}-ChargebackHandler*",
+                            arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                        )
+                    ],
+                )
+            )
+
         cache_bucket.grant_read_write(chargeback.role)
 
         rule = aws_events.Rule(
@@ -100,6 +195,24 @@ ChargebackStack(
         "chargeback:datadog-api-key-secret-field"
     ),
     datadog_metric_prefix=app.node.try_get_context("chargeback:datadog-metric-prefix"),
+    collector_workers=int(app.node.try_get_context("chargeback:collector-workers")),
+    fanout_shard_size=int(app.node.try_get_context("chargeback:fanout-shard-size")),
+    inventory_reconcile_mins=int(
+        app.node.try_get_context("chargeback:inventory-reconcile-mins")
+    ),
+    export_format=app.node.try_get_context("chargeback:export-format"),
+    collection_accounts=app.node.try_get_context("chargeback:collection-accounts"),
+    collection_regions=app.node.try_get_context("chargeback:collection-regions"),
+    collection_role_name=app.node.try_get_context("chargeback:collection-role-name"),
+    utilization_percentile=app.node.try_get_context(
+        "chargeback:utilization-percentile"
+    ),
+    container_insights=app.node.try_get_context("chargeback:container-insights")
+    == "true",
+    datadog_heartbeat_mins=app.node.try_get_context(
+        "chargeback:datadog-heartbeat-mins"
+    ),
+    datadog_rollup_tags=app.node.try_get_context("chargeback:datadog-rollup-tags"),
     env=cdk.Environment(
         account=os.environ["CDK_DEFAULT_ACCOUNT"],
         region=os.environ["CDK_DEFAULT_REGION"],
@@ -0,0 +1,37 @@
+from os.path import join, dirname, abspath
+import os
+import sys
+import tempfile
+
+root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, join(root, "ecs_chargeback"))
+sys.path.insert(0, join(root, "benchmarks"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+
+import boto3
+import pytest
+from lib import clients, instance_specs, object_cache
+from lib.instrumentation import instrumentation
+from replay import Replayer
+from fleet import SyntheticFleet
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    # a small synthetic fleet every AWS call is answered from, with the
+    # process-wide caches emptied so each test starts cold
+    fleet = SyntheticFleet(clusters=2, services=20, task_definitions=5)
+    session = boto3.session.Session()
+    fleet.replayer = Replayer(session, fleet, latency=0)
+    clients.configure(session)
+    tempfile.tempdir = str(tmp_path)
+    instance_specs.default_catalog = instance_specs.InstanceSpecCatalog()
+    object_cache.default_cache.clear()
+    object_cache.default_cache.stats = object_cache.CacheStats()
+    instrumentation.snapshot(reset=True)
+    for module in ("lambda", "main"):
+        sys.modules.pop(module, None)
+    yield fleet
+    tempfile.tempdir = None
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+import csv
+import pytest
+from lib.backfill import Backfill, BackfillCheckpoint
+
+
+def backfill(fleet) -> Backfill:
+    return Backfill(
+        cluster_names=fleet.cluster_names,
+        start=datetime(2025, 1, 1, tzinfo=timezone.utc),
+        end=datetime(2025, 1, 5, tzinfo=timezone.utc),
+        window=timedelta(days=1),
+        chunk_windows=2,
+    )
+
+
+def windows(path) -> list:
+    with open(path, newline="") as f:
+        return [tuple(row[:4]) for row in csv.reader(f)]
+
+
+def test_backfill_resumes_from_its_checkpoint(fleet, tmp_path):
+    expected = tmp_path / "expected.csv"
+    with open(expected, "w", newline="") as output:
+        backfill(fleet).run(output)
+
+    # the first cluster of the second chunk fails after the first chunk
+    get_metric_data = fleet._cloudwatch_GetMetricData
+    calls = []
+
+    def interrupted(params):
+        calls.append(params)
+        if len(calls) > len(fleet.cluster_names):
+            raise KeyboardInterrupt
+        return get_metric_data(params)
+
+    path = tmp_path / "backfill.csv"
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.checkpoint"))
+    fleet._cloudwatch_GetMetricData = interrupted
+    with open(path, "w", newline="") as output:
+        with pytest.raises(KeyboardInterrupt):
+            backfill(fleet).run(output, checkpoint)
+        # rows written after the checkpoint are cut off on resume
+        output.write("2025-01-03T00:00:00+00:00,partial\n")
+
+    fleet._cloudwatch_GetMetricData = get_metric_data
+    fleet.replayer.calls.clear()
+    job = backfill(fleet)
+    with open(path, "r+", newline="") as output:
+        job.run(output, checkpoint)
+
+    assert windows(path) == windows(expected)
+    assert job.rows == 4 * 20
+    # only the second chunk is queried again
+    assert fleet.replayer.calls[("cloudwatch", "GetMetricData")] == len(
+        fleet.cluster_names
+    )
@@ -0,0 +1,66 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import json
+import threading
+from lib.cluster import Cluster
+from lib.cost_loader import FleetCostLoader
+from lib.daemon import Daemon
+
+
+def get(server, path: str):
+    url = f"http://127.0.0.1:{server.server_port}{path}"
+    try:
+        with urlopen(url, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def get_in_thread(server, path: str):
+    # answers a single request, before the daemon has published anything
+    thread = threading.Thread(target=server.handle_request, daemon=True)
+    thread.start()
+    response = get(server, path)
+    thread.join()
+    return response
+
+
+def test_daemon_serves_the_latest_snapshot(fleet):
+    daemon = Daemon(
+        new_cluster=lambda cluster_name: Cluster(name=cluster_name),
+        new_cost_loader=FleetCostLoader,
+        services_interval=3600,
+        utilization_interval=3600,
+    )
+    server = daemon.server(port=0)
+    assert get_in_thread(server, "/services") == (503, {"error": "no snapshot yet"})
+
+    daemon.start()
+    try:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        status, body = get(server, "/services")
+        assert status == 200
+        assert len(body["services"]) == 20
+        assert all(service["hourly_cost"] > 0 for service in body["services"])
+
+        cluster_name = fleet.cluster_names[0]
+        status, body = get(server, f"/clusters/{cluster_name}")
+        assert status == 200
+        assert {service["cluster"] for service in body["services"]} == {cluster_name}
+        assert get(server, "/clusters/missing")[0] == 404
+
+        status, body = get(server, "/status")
+        assert status == 200
+        assert body["clusters"] == len(fleet.cluster_names)
+        assert {name: s["runs"] for name, s in body["schedules"].items()} == {
+            "services": 1,
+            "utilization": 1,
+            "costs": 1,
+        }
+        assert body["api_calls"]["ecs.DescribeServices"] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        daemon.stop()
@@ -0,0 +1,47 @@
+from datetime import timedelta
+import json
+from lib.datadog_handler import DataDogHandler
+from lib.series_filter import SeriesFilter
+from replay import ReplayHTTP
+
+
+def buffered_metrics(dd: DataDogHandler) -> list:
+    return [json.loads(series)["metric"] for series in dd.submitter._buffer]
+
+
+def test_unchanged_gauges_are_suppressed_but_rates_sent(fleet):
+    dd = DataDogHandler(
+        api_key="test",
+        metric_prefix="test",
+        buffered=True,
+        series_filter=SeriesFilter(heartbeat=timedelta(hours=1), bucket="bucket"),
+        rollup_tags=["team"],
+    )
+    dd.submitter._http = ReplayHTTP()
+    service = dict(
+        cluster="prod",
+        service="web",
+        tags=[{"key": "team", "value": "a"}],
+        cpu_reservation=256,
+        memory_reservation=512,
+        hourly_cost=0.1,
+        hourly_waste=0.05,
+    )
+
+    dd.handle_service(**service)
+    dd.flush()
+    dd.handle_service(**service)
+    dd._send_rollups()
+    assert sorted(buffered_metrics(dd)) == [
+        "test.hourly_cost",
+        "test.hourly_waste",
+        "test.rollup.hourly_cost",
+        "test.rollup.hourly_waste",
+    ]
+    assert (dd.series_filter.emitted, dd.series_filter.suppressed) == (4, 4)
+
+    dd.handle_series_filter()
+    assert buffered_metrics(dd)[-2:] == [
+        "test.series.emitted",
+        "test.series.suppressed",
+    ]
@@ -0,0 +1,61 @@
+import json
+import os
+import pytest
+from lib.cost_loader import ClusterInstanceType
+from lib.instance_specs import InstanceSpecCatalog
+from lib.price_catalog import PriceCatalog
+from lib.rate_index import LiveRateIndex
+
+
+class BilledCosts:
+    # what cost explorer billed each cluster over the lookback
+    def __init__(self, instance_types):
+        self._instance_types = instance_types
+
+    def load(self):
+        pass
+
+    def instance_types(self, cluster_name: str):
+        return self._instance_types
+
+
+def rate_index(tmp_path, region: str, prices: dict, billed: list) -> LiveRateIndex:
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"regions": {region: prices}}))
+    return LiveRateIndex(
+        cost_loader=BilledCosts(billed),
+        price_catalog=PriceCatalog(path=str(path)),
+        spec_catalog=InstanceSpecCatalog(path=os.devnull),
+    )
+
+
+def test_live_rates_are_calibrated_by_billed_costs(fleet, tmp_path):
+    cluster = fleet.cluster_names[0]
+    listed, uncatalogued = fleet.instance_types[cluster]
+    index = rate_index(
+        tmp_path,
+        "us-east-1",
+        {listed: 0.1},
+        [
+            # billed at 80% of the catalog price, e.g. under a savings plan
+            ClusterInstanceType(listed, cost=0.08 * 24, usage=24),
+            ClusterInstanceType(uncatalogued, cost=0.3 * 24, usage=24),
+        ],
+    )
+
+    rates = {it.instance_type_name: it for it in index.refresh(cluster)}
+    assert index.calibration[cluster] == pytest.approx(0.8)
+    assert rates[listed].cost / rates[listed].usage == pytest.approx(0.08)
+    assert rates[uncatalogued].cost / rates[uncatalogued].usage == pytest.approx(0.3)
+    assert index.instances == sum(it.usage for it in rates.values())
+    assert (index.unpriced, index.uncatalogued_clusters) == (0, 0)
+
+
+def test_regions_outside_the_catalog_keep_billed_rates(fleet, tmp_path):
+    cluster = fleet.cluster_names[0]
+    billed = [ClusterInstanceType("m5.large", cost=2.4, usage=24, vcpus=2)]
+    index = rate_index(tmp_path, "eu-west-1", {"m5.large": 0.1}, billed)
+
+    assert index.instance_types(cluster) == billed
+    assert index.uncatalogued_clusters == 1
+    assert fleet.replayer.calls[("ecs", "ListContainerInstances")] == 0
@@ -0,0 +1,199 @@
+import csv
+import importlib
+import os
+import re
+import sys
+from botocore.exceptions import ClientError
+from lib.fanout import InProcessInvoker
+from replay import ReplayHTTP
+
+
+class OutOfTime:
+    # a lambda context with less time left than the deadline's safety margin
+    def get_remaining_time_in_millis(self):
+        return 5_000
+
+
+def submitted(out: str) -> dict:
+    # the datadog submission counts report printed for the last run
+    line = re.findall(r"^datadog: .*$", out, re.MULTILINE)[-1]
+    return {
+        name: int(value) for value, name in re.findall(r"(\d+) (series|failed)", line)
+    }
+
+
+def run_lambda(monkeypatch, http: ReplayHTTP, context=None, **env):
+    monkeypatch.setenv("DATADOG_API_KEY", "test")
+    monkeypatch.setenv("DATADOG_METRIC_PREFIX", "test")
+    monkeypatch.setenv("CACHE_BUCKET", "test")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    lambda_module = importlib.import_module("lambda")
+    lambda_module.dd.submitter._http = http
+    lambda_module.dd.submitter.backoff = 0
+    # fan-out workers run on a thread instead of another lambda
+    lambda_module.invoker = InProcessInvoker(lambda_module.handler)
+    lambda_module.handler({}, context)
+    lambda_module.invoker.wait()
+    return lambda_module
+
+
+def test_lambda_sends_every_service(fleet, monkeypatch, tmp_path, capsys):
+    http = ReplayHTTP()
+    lambda_module = run_lambda(
+        monkeypatch, http, EXPORT_LOCATION=str(tmp_path / "export")
+    )
+
+    stats = submitted(capsys.readouterr().out)
+    assert stats["failed"] == 0
+    # four series per service, besides the cluster and self-metrics
+    assert stats["series"] >= 4 * 20
+    # a warm container counts each run on its own
+    assert lambda_module.dd.submitter.stats.series == 0
+    assert http.requests > 0
+    assert lambda_module.scheduler_state.key in fleet.objects
+    assert set(lambda_module.scheduler_state.cluster_costs) == set(fleet.cluster_names)
+    assert all(
+        cost > 0 for cost in lambda_module.scheduler_state.cluster_costs.values()
+    )
+
+    # one exported file per cluster for the run
+    files = [
+        os.path.join(directory, name)
+        for directory, _, names in os.walk(tmp_path / "export")
+        for name in names
+    ]
+    assert len(files) == len(fleet.cluster_names)
+
+
+def test_lambda_survives_datadog_failures(fleet, monkeypatch, capsys):
+    lambda_module = run_lambda(monkeypatch, ReplayHTTP(status=500))
+
+    assert submitted(capsys.readouterr().out)["failed"] > 0
+    # every cluster was still collected and the run's state saved
+    assert set(lambda_module.scheduler_state.cluster_costs) == set(fleet.cluster_names)
+    assert lambda_module.scheduler_state.key in fleet.objects
+
+
+def test_lambda_carries_over_clusters_at_the_deadline(fleet, monkeypatch):
+    lambda_module = run_lambda(monkeypatch, ReplayHTTP(), context=OutOfTime())
+
+    assert sorted(lambda_module.scheduler_state.pending) == sorted(fleet.cluster_names)
+    assert lambda_module.scheduler_state.cluster_costs == {}
+    assert lambda_module.scheduler_state.key in fleet.objects
+
+
+def test_lambda_collects_past_a_failing_cluster(fleet, monkeypatch):
+    broken = fleet.cluster_names[0]
+    list_services = fleet._ecs_ListServices
+
+    def denied(params):
+        if params["cluster"] == broken:
+            raise ClientError(
+                {"Error": {"Code": "AccessDeniedException"}}, "ListServices"
+            )
+        return list_services(params)
+
+    fleet._ecs_ListServices = denied
+    lambda_module = run_lambda(monkeypatch, ReplayHTTP())
+
+    assert set(lambda_module.scheduler_state.cluster_costs) == set(
+        fleet.cluster_names[1:]
+    )
+    # failed clusters are not carried over, so they cannot starve the others
+    assert lambda_module.scheduler_state.pending == []
+    assert lambda_module.scheduler_state.key in fleet.objects
+
+
+def test_lambda_inventory_only_walks_dirty_services(fleet, monkeypatch):
+    lambda_module = run_lambda(monkeypatch, ReplayHTTP(), INVENTORY_QUEUE_URL="queue")
+    calls = fleet.replayer.calls
+    assert calls[("ecs", "ListTasks")] > 0
+
+    # a run without events describes nothing again
+    calls.clear()
+    lambda_module.handler({}, None)
+    assert calls[("ecs", "ListTasks")] == 0
+    assert calls[("ecs", "DescribeServices")] == 0
+
+    # an event marks one service dirty, and only its tasks are listed
+    cluster = fleet.cluster_names[0]
+    service = fleet.services[cluster][0]
+    fleet.scale(cluster, service["serviceName"], service["runningCount"] + 1)
+    calls.clear()
+    lambda_module.handler({}, None)
+    assert calls[("sqs", "DeleteMessageBatch")] == 1
+    assert calls[("ecs", "DescribeServices")] == 1
+    assert calls[("ecs", "ListTasks")] == 1
+
+
+def test_lambda_fans_out_a_shard_per_worker(fleet, monkeypatch, capsys):
+    lambda_module = run_lambda(monkeypatch, ReplayHTTP(), FANOUT_SHARD_SIZE="1")
+
+    assert set(lambda_module.scheduler_state.cluster_costs) == set(fleet.cluster_names)
+    # the coordinator reports too, so its calls don't leak into a later run
+    out = capsys.readouterr().out
+    assert "fanned out 2 clusters to 2 workers" in out
+    assert out.count("datadog: ") == 1 + len(fleet.cluster_names)
+
+
+def test_main_prints_every_cluster(fleet, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    importlib.import_module("main").main()
+
+    out = capsys.readouterr().out
+    for cluster_name in fleet.cluster_names:
+        assert f"CLUSTER: {cluster_name} " in out
+    for services in fleet.services.values():
+        for service in services:
+            assert service["serviceName"] in out
+
+
+def test_main_backfill_writes_every_window(fleet, monkeypatch, tmp_path):
+    output = tmp_path / "backfill.csv"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "main.py",
+            "backfill",
+            "--start",
+            "2025-01-01",
+            "--end",
+            "2025-01-04",
+            "--output",
+            str(output),
+        ],
+    )
+    importlib.import_module("main").main()
+
+    with open(output, newline="") as f:
+        rows = list(csv.reader(f))
+    # a header, then three daily windows of every service
+    assert len(rows) == 1 + 3 * 20
+
+
+def test_lambda_merges_every_partition(fleet, monkeypatch, capsys):
+    # two accounts in two regions; worker processes get the same results
+    # back, but forking under pytest is left to benchmarks/run.py
+    lambda_module = run_lambda(
+        monkeypatch,
+        ReplayHTTP(),
+        COLLECTION_ACCOUNTS="100000000000,100000000001",
+        COLLECTION_REGIONS="us-east-1,eu-west-1",
+        COLLECTOR_PROCESSES="1",
+        RATE_SOURCE="live",
+    )
+
+    out = capsys.readouterr().out
+    assert "::" not in out
+    assert submitted(out)["series"] >= 4 * 4 * 20
+    # the shipped catalog only prices us-east-1, so the clusters of
+    # eu-west-1 keep their billed rates
+    assert "0 unpriced, 4 clusters in regions without catalog prices" in out
+    assert len(lambda_module.live_rates) == 0
+
+    # a worker's rates travel back in its result, not in its module state
+    result = lambda_module.collect_partition(lambda_module.partitions[0], None)
+    assert result.live_rates["instances"] > 0
+    assert len(lambda_module.live_rates) == 0
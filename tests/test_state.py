@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+from lib.cost_cache import DailyCostCache
+from lib.cost_loader import FleetCostLoader
+from lib.inventory import _changed_services
+from lib.object_cache import ObjectCache
+from lib.rate_limiter import TokenBucket
+from lib.series_filter import SeriesFilter
+from lib.sketch import QuantileSketch
+
+
+def test_cost_cache_days_settle():
+    # with no ttl, every day not yet final is fetched again
+    cache = DailyCostCache(ttl=timedelta(0), settle_days=2)
+    today = datetime.now(timezone.utc).date()
+    settled, settling = today - timedelta(days=3), today - timedelta(days=1)
+    cache.put(settled, {"prod": {"BoxUsage:m5.large": (1.0, 24.0)}})
+    cache.put(settling, {})
+
+    assert cache.is_final(settled)
+    assert not cache.is_final(settling)
+    missing = today - timedelta(days=2)
+    assert cache.stale_days([settled, missing, settling]) == [missing, settling]
+    assert cache.get(settled) == {"prod": {"BoxUsage:m5.large": (1.0, 24.0)}}
+
+    cache.ttl = timedelta(hours=1)
+    assert cache.stale_days([settled, missing, settling]) == [missing]
+    cache.prune(settling)
+    assert cache.get(settled) == {}
+
+
+def test_cost_loader_counts_the_days_it_queries(fleet):
+    def loader(days: int) -> FleetCostLoader:
+        cache = DailyCostCache(bucket="bucket", ttl=timedelta(0), settle_days=2)
+        loader = FleetCostLoader(cost_lookback=timedelta(days=days), cost_cache=cache)
+        loader.load()
+        return loader
+
+    assert loader(5).fetched_days == 5
+    # two older days are missing and two recent ones still settling, and
+    # the days in between are queried again with them
+    assert loader(7).fetched_days == 7
+    assert fleet.replayer.calls[("ce", "GetCostAndUsage")] == 2
+
+
+def test_object_cache_revalidates_unchanged_objects(fleet):
+    writer = ObjectCache(ttl=timedelta(0))
+    reader = ObjectCache(ttl=timedelta(0))
+    writer.put("bucket", "state.json", {"n": 1})
+
+    assert reader.get("bucket", "state.json") == {"n": 1}
+    assert reader.get("bucket", "state.json") == {"n": 1}
+    assert (reader.stats.fetches, reader.stats.revalidations) == (1, 1)
+
+    writer.put("bucket", "state.json", {"n": 2})
+    assert reader.get("bucket", "state.json") == {"n": 2}
+    assert reader.stats.fetches == 2
+    assert reader.get("bucket", "missing.json") is None
+    assert reader.stats.misses == 1
+
+
+def test_sketch_merge_and_decay():
+    low, high = QuantileSketch(), QuantileSketch()
+    for _ in range(100):
+        low.add(10)
+        high.add(50)
+    low.merge(high)
+    assert low.count == 200
+    assert abs(low.quantile(0.25) - 10) / 10 <= low.relative_accuracy
+    assert abs(low.quantile(0.75) - 50) / 50 <= low.relative_accuracy
+
+    # decayed values weigh less than new ones
+    low.decay(0.1)
+    for _ in range(100):
+        low.add(10)
+    assert abs(low.quantile(0.9) - 10) / 10 <= low.relative_accuracy
+    low.decay(1e-6)
+    assert low.bins == {}
+    restored = QuantileSketch.from_dict(high.to_dict())
+    assert restored.quantile(0.5) == high.quantile(0.5)
+
+
+def test_token_bucket_backs_off_once_per_cooldown():
+    bucket = TokenBucket(max_rate=10, min_rate=1, decrease=0.5, cooldown=60)
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 5
+    assert bucket.throttles == 2
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+    assert bucket.acquire() == 0
+
+
+def test_series_filter_commit_and_discard(fleet):
+    series_filter = SeriesFilter(heartbeat=timedelta(hours=1), bucket="bucket")
+    key = series_filter.key("prod", account="123", region="eu-west-1")
+    assert key == "accounts/123/eu-west-1/series/prod.json"
+
+    assert series_filter.keep(key, "cost", ["service:web"], 1.0, 0)
+    series_filter.discard()
+    # nothing was remembered, so the series is sent again
+    assert series_filter.keep(key, "cost", ["service:web"], 1.0, 0)
+    series_filter.commit()
+
+    assert not series_filter.keep(key, "cost", ["service:web"], 1.0, 60)
+    assert series_filter.keep(key, "cost", ["service:web"], 2.0, 60)
+    assert series_filter.keep(key, "cost", ["service:api"], 1.0, 60)
+    series_filter.commit()
+    # unchanged values are sent again once the heartbeat is due
+    assert series_filter.keep(key, "cost", ["service:web"], 2.0, 3660)
+    assert (series_filter.emitted, series_filter.suppressed) == (5, 1)
+
+
+def test_changed_services_from_events():
+    cluster_arn = "arn:aws:ecs:us-east-1:123:cluster/prod"
+    events = [
+        {
+            "detail-type": "ECS Service Action",
+            "resources": ["arn:aws:ecs:us-east-1:123:service/prod/web"],
+        },
+        {
+            # service arns of the old format leave the cluster out
+            "detail-type": "ECS Deployment State Change",
+            "resources": ["arn:aws:ecs:us-east-1:123:service/api"],
+            "detail": {"clusterArn": cluster_arn},
+        },
+        {
+            "detail-type": "ECS Task State Change",
+            "detail": {"group": "service:worker", "clusterArn": cluster_arn},
+        },
+        {
+            "detail-type": "ECS Task State Change",
+            "detail": {"group": "family:batch", "clusterArn": cluster_arn},
+        },
+    ]
+    changed = [service for event in events for service in _changed_services(event)]
+    assert changed == [("prod", "web"), ("prod", "api"), ("prod", "worker")]